@@ -9,9 +9,14 @@ import settings
 ntasks = int(os.getenv('SLURM_NTASKS','1'))
 threads = int(os.getenv('OMP_NUM_THREADS','1'))
 
-runcat = RunCatalog.from_list(settings.runlist_fn)
-
-with TaskManager(ntasks=ntasks) as tm:
+comm = None
+if ntasks > 1:
+    from mpi4py import MPI
+    comm = MPI.COMM_WORLD
+# run list is read by rank 0 only, then broadcast
+runcat = RunCatalog.from_list(settings.runlist_fn,comm=comm)
+
+with TaskManager(ntasks=ntasks,share_tasks=True) as tm: # all ranks hold runcat
 
     for run in tm.iterate(runcat):
 
@@ -88,7 +88,7 @@ def write_randoms(truth_fn, injected_fn, bricknames=None, density=1e3, seed=None
     bricks = BrickCatalog()
     logger.info('Generating randoms in %s',bricknames)
     if gen_in_brick:
-        randoms = 0
+        randoms = []
         for brickname in bricknames:
             brick = bricks.get_by_name(brickname)
             radecbox = brick.get_radecbox()
@@ -96,7 +96,8 @@ def write_randoms(truth_fn, injected_fn, bricknames=None, density=1e3, seed=None
             tmp = SimCatalog()
             tmp.ra,tmp.dec = utils.sample_ra_dec(size,radecbox,rng=rng)
             tmp.brickname = np.full(tmp.size,brickname)
-            randoms += tmp
+            randoms.append(tmp)
+        randoms = SimCatalog.concatenate(randoms)
     else:
         bricks = bricks.get_by_name(bricknames)
         radecbox = bricks.get_radecbox(total=True)
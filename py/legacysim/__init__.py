@@ -12,9 +12,9 @@ Contains:
 
 from ._version import __version__
 
-__all__ = ['LegacySurveySim','get_sim_id','find_file','find_legacypipe_file','find_legacysim_file']
-__all__ += ['BaseCatalog','SimCatalog','BrickCatalog','RunCatalog','analysis','utils','setup_logging','batch']
+__all__ = ['LegacySurveySim','get_sim_id','find_file','find_files','find_legacypipe_file','find_legacysim_file']
+__all__ += ['BaseCatalog','SimCatalog','BrickCatalog','RunCatalog','CatalogBuilder','analysis','utils','setup_logging','batch']
 
-from .survey import LegacySurveySim, get_sim_id, find_file, find_legacypipe_file, find_legacysim_file
-from .catalog import BaseCatalog, SimCatalog, BrickCatalog, RunCatalog
+from .survey import LegacySurveySim, get_sim_id, find_file, find_files, find_legacypipe_file, find_legacysim_file
+from .catalog import BaseCatalog, SimCatalog, BrickCatalog, RunCatalog, CatalogBuilder
 from .utils import setup_logging
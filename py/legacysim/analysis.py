@@ -1,15 +1,17 @@
 """Convenient classes to perform **legacysim** analysis: image cutouts, catalog merging, catalog matching, computing time."""
 
 import os
+import json
 import logging
+import fnmatch
 
 import numpy as np
 from scipy import stats,special
 from matplotlib import pyplot as plt
 import fitsio
 
-from .survey import find_file
-from .catalog import SimCatalog, RunCatalog
+from .survey import find_file, get_sim_id
+from .catalog import SimCatalog, RunCatalog, CatalogBuilder
 from . import utils
 
 
@@ -257,10 +259,10 @@ class ImageAnalysis(BaseImage):
         if base_dir is None: base_dir = self.base_dir
         if source is None: source = self.source
         self.sources_fn = find_file(base_dir=base_dir,filetype=filetype,brickname=self.brickname,source=source,**self.kwargs_simid)
-        self.sources = SimCatalog(self.sources_fn)
+        self.sources = SimCatalog(self.sources_fn,lazy=True)
         if hasattr(self.sources,'collided'):
             # Remove sources that were not injected
-            self.sources = self.sources[~self.sources.collided]
+            self.sources.cut(~self.sources.collided)
         if hasattr(self,'wcs'):
             bx,by = self.wcs.radec2pixelxy(self.sources.ra,self.sources.dec)[1:]
             self.sources.bx = bx - 1
@@ -328,7 +330,7 @@ class ImageAnalysis(BaseImage):
             Corresponding indices in :attr:`sources`.
         """
         fn = find_file(base_dir=self.base_dir,filetype='tractor',brickname=self.brickname,source=self.source,**self.kwargs_simid)
-        tractor = SimCatalog(fn)
+        tractor = SimCatalog(fn,lazy=True)
         index_sources,_,distance = self.sources.match_radec(tractor,radius_in_degree=range_observed_injected_in_degree[-1],nearest=False,return_distance=True)
         matched_sources = index_sources[distance<match_in_degree]
         mask_matched = np.isin(index_sources,matched_sources)
@@ -462,7 +464,8 @@ class CatalogMerging(object):
         if source is None: source = self.source
         return '%s_%s' % (source,filetype.replace('-','_'))
 
-    def merge(self, filetype='tractor', base_dir=None, source=None, keep_columns=None, add=False, write=False, **kwargs_write):
+    def merge(self, filetype='tractor', base_dir=None, source=None, keep_columns=None, where=None, add=False, write=False, incremental=False,
+                nthreads=1, prefetch=None, **kwargs_write):
         """
         Merge catalogs, return the result and add to ``self`` (``add == True``) and/or directly write on disk (``write == True``).
 
@@ -480,7 +483,12 @@ class CatalogMerging(object):
             If not ``None``, supersedes :attr:`source`.
 
         keep_columns : list, default=None
-            Keep only these columns.
+            Keep only these columns. Other columns are not read from disk.
+
+        where : string, callable, list, default=None
+            Keep only rows satisfying these predicates, see :meth:`~legacysim.catalog.BaseCatalog.mask_where`.
+            Columns are read from disk for these rows only.
+            For ``filetype == 'injected'``, sources with ``collided == True`` are always removed.
 
         add : bool, default=False
             Add merged catalog to ``self``.
@@ -488,8 +496,22 @@ class CatalogMerging(object):
         write : bool, default=False
             Write merged catalog to disk.
 
+        incremental : bool, default=False
+            If ``True`` (requires ``write``), a manifest of merged file names, sizes, modification times and row ranges
+            is saved next to the merged catalog, see :meth:`get_manifest_fn`.
+            On later calls, only new or modified files are read; rows of modified files or files no longer in :attr:`runcat` are dropped
+            from the previously merged catalog, and rows are ordered as in a full merge (following :attr:`runcat`).
+            If merging options changed, all files are read again.
+
+        nthreads : int, default=1
+            Number of threads to read catalogs with, see :func:`utils.read_files`.
+
+        prefetch : int, default=None
+            Maximum number of catalogs read in advance, see :func:`utils.read_files`.
+
         kwargs_write : bool
-            If ``write``, arguments to pick up catalog file name. See :meth:`set_cat_fn`.
+            If ``write``, arguments to pick up catalog file name and partitioning. See :meth:`write_catalog`.
+            Partitions are written with ``nthreads`` threads.
 
         Returns
         -------
@@ -504,19 +526,27 @@ class CatalogMerging(object):
             logger.warning('Nothing to be done with loaded files. Escaping.')
             return cat
 
-        def read_catalog(fn,**kwargs):
-            if os.path.isfile(fn):
-                return SimCatalog(fn,**kwargs)
-            logger.warning('File %s not found.',fn)
-            return None
+        if where is None: where = []
+        if isinstance(where,str) or callable(where): where = [where]
+        if filetype == 'injected': where = ['~collided'] + list(where)
 
-        for run in self.runcat:
+        def select(tmp):
+            # read columns needed for predicates, then only kept columns of selected rows
+            if where: tmp.cut(tmp.mask_where(where))
+            if keep_columns is None:
+                tmp.load_columns()
+            else:
+                tmp.load_columns(*keep_columns)
+            return tmp
+
+        def read(fn):
+            if not os.path.isfile(fn):
+                logger.warning('File %s not found.',fn)
+                return None
             if filetype in ['ps','ps-events']:
-                fn = find_file(base_dir=base_dir,filetype='ps',brickname=run.brickname,source='legacysim',**run.kwargs_simid)
-                tmp = read_catalog(fn,ext=1)
-                if tmp is None: continue
+                tmp = SimCatalog(fn,ext=1,lazy=True)
+                events = SimCatalog(fn,ext=2,lazy=True)
                 tf = tmp.unixtime.max()
-                events = read_catalog(fn,ext=2)
                 ti = events.unixtime.min()
                 if filetype == 'ps-events':
                     tmp = events
@@ -524,21 +554,84 @@ class CatalogMerging(object):
                     tmp.mid = tmp.full(tmp.get_header()['PPID'])
                 tmp.unixti = tmp.full(ti)
                 tmp.unixtf = tmp.full(tf)
+                return select(tmp)
+            return select(SimCatalog(fn,lazy=True))
+
+        runs = list(self.runcat)
+        if filetype in ['ps','ps-events']:
+            fns = self.runcat.find_files(base_dir=base_dir,filetype='ps',source='legacysim')
+        else:
+            fns = self.runcat.find_files(base_dir=base_dir,filetype=filetype,source=source)
+
+        builder = CatalogBuilder(SimCatalog)
+        if incremental:
+            if not write:
+                raise ValueError('Incremental merge requires write = True')
+            if any(callable(predicate) for predicate in where):
+                raise ValueError('Callable predicates cannot be saved in merge manifest')
+            if kwargs_write.get('partition_by',None) is not None:
+                raise ValueError('Incremental merge does not support partitioned output')
+            cat_fn = self.cats_fn[self.set_cat_fn(**kwargs_write)]
+            manifest_fn = self.get_manifest_fn(cat_fn)
+            options = {'filetype':filetype,'source':source,'keep_columns':keep_columns,'where':where}
+            manifest = {}
+            if os.path.exists(manifest_fn) and os.path.exists(cat_fn):
+                with open(manifest_fn,'r') as file:
+                    manifest = json.load(file)
+                if manifest['options'] != options:
+                    logger.info('Merging options changed since last merge, reading all files.')
+                    manifest = {}
+            previous = {entry['fn']:entry for entry in manifest.get('files',[])}
+            kept,stats = {},{}
+            for irun,fn in enumerate(fns):
+                stat = utils.get_file_stat(fn)
+                entry = previous.get(fn,None)
+                if entry is not None and stat is not None and (entry['size'],entry['mtime']) == stat:
+                    kept[irun] = entry
+                else:
+                    stats[irun] = stat
+            logger.info('Keeping rows of %d unchanged files, reading %d new or modified files.',len(kept),len(stats))
+            if kept:
+                index = np.concatenate([np.arange(entry['rowstart'],entry['rowstart'] + entry['nrows']) for entry in kept.values()])
+                # fancy indexing loads rows in memory, hence catalog on disk can be safely overwritten
+                kept_cat = self.read_catalog(cat_fn=cat_fn)[index]
+                offset = 0
+                for entry in kept.values():
+                    entry['rowstart'],offset = offset,offset + entry['nrows']
+            entries = []
+
+        # rows are appended in run order, such that an incremental merge gives the same catalog as a full one
+        read_fns = [fn for irun,fn in enumerate(fns) if not (incremental and irun in kept)]
+        read_cats = iter(utils.read_files(read,read_fns,nthreads=nthreads,prefetch=prefetch))
+        for irun,(run,fn) in enumerate(zip(runs,fns)):
+            if incremental and irun in kept:
+                entry = kept[irun]
+                tmp = kept_cat[entry['rowstart']:entry['rowstart'] + entry['nrows']]
+                entries.append({**entry,'rowstart':len(builder)})
+                builder.append(tmp)
+                continue
+            tmp = next(read_cats)
+            if tmp is None: continue
+            if filetype in ['ps','ps-events']:
                 tmp.brickname = tmp.full(run.brickname)
-            else:
-                fn = find_file(base_dir=base_dir,filetype=filetype,brickname=run.brickname,source=source,**run.kwargs_simid)
-                tmp = read_catalog(fn)
-                if tmp is None: continue
             for key,val in run.kwargs_simid.items():
                 tmp.set(key,tmp.full(val))
-            if filetype == 'injected':
-                tmp.cut(~tmp.collided)
             if keep_columns is not None:
                 tmp.keep_columns(*keep_columns)
-            cat += tmp
+            if incremental:
+                stat = stats[irun]
+                entries.append({'fn':fn,'size':stat[0],'mtime':stat[1],'rowstart':len(builder),'nrows':tmp.size})
+            builder.append(tmp)
+        cat = builder.finalize()
         key = self.get_key(filetype=filetype,source=source)
         if write:
-            self.write_catalog(cat=cat,**kwargs_write)
+            if incremental:
+                # remove manifest first, such that an interrupted write triggers a full merge next time
+                if os.path.exists(manifest_fn): os.remove(manifest_fn)
+            self.write_catalog(cat=cat,nthreads=nthreads,**kwargs_write)
+            if incremental:
+                with open(manifest_fn,'w') as file:
+                    json.dump({'options':options,'files':entries},file)
         if add:
             self.cats[key] = cat
         return cat
@@ -571,36 +664,99 @@ class CatalogMerging(object):
             self.cats_fn[key] = cat_fn
         return key
 
-    def write_catalog(self, cat=None, **kwargs):
+    @staticmethod
+    def get_manifest_fn(cat_fn):
+        """Return name of the manifest file used by incremental :meth:`merge`, next to catalog file name ``cat_fn``."""
+        return '%s.manifest.json' % cat_fn.rstrip(os.sep)
+
+    def write_catalog(self, cat=None, partition_by=None, nside=32, nthreads=1, **kwargs):
         """
         Write catalog to disk.
 
+        If ``partition_by`` is provided, catalog is written as a directory of partitions with :meth:`~legacysim.catalog.BaseCatalog.write_partitions`.
+        Else, if catalog file name ends with '.npy', catalog is written with :meth:`~legacysim.catalog.BaseCatalog.write_npy_dir`,
+        which can be memory-mapped when read by :meth:`read_catalog`.
+
         Parameters
         ----------
         cat : SimCatalog, default=None
             Catalog to save. If ``None``, is got from :attr:`cats`.
 
+        partition_by : string, default=None
+            If not ``None``, partitioning ('brick', 'healpix' or 'simid'), see :meth:`~legacysim.catalog.BaseCatalog.get_partition_keys`.
+
+        nside : int, default=32
+            HEALPix resolution, used if ``partition_by == 'healpix'``.
+
+        nthreads : int, default=1
+            Number of threads to write partitions with.
+
         kwargs : dict
             Arguments for :meth:`set_cat_fn`, to set catalog file name.
         """
         key = self.set_cat_fn(**kwargs)
         if cat is None: cat = self.cats[key]
-        cat.writeto(self.cats_fn[key])
+        if partition_by is not None:
+            cat.write_partitions(self.cats_fn[key],partition_by=partition_by,nside=nside,nthreads=nthreads)
+        elif self.cats_fn[key].endswith('.npy'):
+            cat.write_npy_dir(self.cats_fn[key])
+        else:
+            cat.writeto(self.cats_fn[key])
 
-    def read_catalog(self, add=False, **kwargs):
+    def read_catalog(self, add=False, partitions=None, radecbox=None, columns=None, where=None, nthreads=1, **kwargs):
         """
         Read catalog from disk.
 
+        If catalog file name is a directory holding partitions, only partitions needed by the query are read
+        with :meth:`~legacysim.catalog.BaseCatalog.read_partitions`.
+        Else if it is a directory, catalog is memory-mapped with :meth:`~legacysim.catalog.BaseCatalog.read_npy_dir`.
+
         Parameters
         ----------
         add : bool, default=False
             Add catalog to ``self``.
 
+        partitions : string, int, list, default=None
+            Partition keys to read (only for partitioned catalogs).
+
+        radecbox : list, tuple, default=None
+            ramin, ramax, decmin, decmax: keep only rows inside this box.
+
+        columns : list, default=None
+            Columns to read. If ``None``, read all columns.
+
+        where : string, callable, list, default=None
+            Keep only rows satisfying these predicates, see :meth:`~legacysim.catalog.BaseCatalog.mask_where`.
+
+        nthreads : int, default=1
+            Number of threads to read partitions with.
+
         kwargs : dict
             Arguments for :meth:`set_cat_fn`, to set catalog file name.
         """
         key = self.set_cat_fn(**kwargs)
-        cat = SimCatalog(self.cats_fn[key])
+        cat_fn = self.cats_fn[key]
+        if SimCatalog.read_partition_index(cat_fn) is not None:
+            cat = SimCatalog.read_partitions(cat_fn,partitions=partitions,radecbox=radecbox,columns=columns,where=where,nthreads=nthreads)
+        else:
+            if partitions is not None:
+                raise ValueError('Catalog %s is not partitioned' % cat_fn)
+            if os.path.isdir(cat_fn):
+                cat = SimCatalog.read_npy_dir(cat_fn,columns=columns)
+            else:
+                cat = SimCatalog(cat_fn,lazy=True)
+            if where is None: where = []
+            if isinstance(where,str) or callable(where): where = [where]
+            where = list(where)
+            if radecbox is not None:
+                ramin,ramax,decmin,decmax = radecbox
+                where += ['ra >= %r' % ramin,'ra <= %r' % ramax,'dec >= %r' % decmin,'dec <= %r' % decmax]
+            if where: cat.cut(cat.mask_where(where))
+            if columns is None:
+                cat.load_columns()
+            else:
+                cat.load_columns(*columns)
+                cat.keep_columns(*columns)
         if add: self.cats[key] = cat
         return cat
 
@@ -621,7 +777,7 @@ class CatalogMerging(object):
         state = {}
         for key in ['base_dir','cats_fn','cats_dir']:
             state[key] = self.get(key)
-        state['runcat'] = self.runcat.to_dict()
+        state['runcat'] = self.runcat
         return state
 
     def setstate(self, state):
@@ -629,36 +785,86 @@ class CatalogMerging(object):
         self.cats = {}
         for key in state:
             self.set(key,state[key])
-        self.runcat = RunCatalog.from_dict(self.runcat)
+        if isinstance(self.runcat,dict):
+            # state saved with previous, pickle-based format
+            self.runcat = RunCatalog.from_dict(self.runcat)
 
     def save(self, save_fn=None):
         """
         Save ``self`` to disk.
 
+        ``save_fn`` is a directory, holding arrays (e.g. matching indices) as ``.npy`` files, which are memory-mapped by :meth:`load`,
+        :attr:`runcat` written with :meth:`~legacysim.catalog.BaseCatalog.write_npy_dir` and other entries in a JSON file.
+
         Parameters
         ----------
         save_fn : string, default=None
-            File name where to save ``self``.
+            Directory where to save ``self``.
             If not ``None``, supersedes :attr:`self.save_fn`.
         """
         if save_fn is not None: self.save_fn = save_fn
         logger.info('Saving %s to %s.',self.__class__.__name__,self.save_fn)
-        utils.mkdir(os.path.dirname(self.save_fn))
-        np.save(self.save_fn,self.getstate())
+        utils.mkdir(self.save_fn)
+
+        def encode(value, name):
+            if isinstance(value,RunCatalog):
+                value.write_npy_dir(os.path.join(self.save_fn,'%s.npy' % name))
+                return {'runcat':'%s.npy' % name}
+            if isinstance(value,np.ndarray) and value.dtype.kind != 'O':
+                fn = os.path.join(self.save_fn,'%s.npy' % name)
+                # write to temporary file, then rename, as fn may be currently memory-mapped
+                with open(fn + '.tmp','wb') as file:
+                    np.save(file,value)
+                os.replace(fn + '.tmp',fn)
+                return {'npy':'%s.npy' % name}
+            if isinstance(value,dict):
+                return {'dict':{key:encode(val,'%s.%s' % (name,key)) for key,val in value.items()}}
+            if isinstance(value,(list,tuple)):
+                return {'list':[encode(val,'%s.%d' % (name,ival)) for ival,val in enumerate(value)]}
+            if isinstance(value,(np.generic,np.ndarray)):
+                value = value.tolist()
+            return {'value':value}
+
+        state = {key:encode(val,key) for key,val in self.getstate().items()}
+        with open(os.path.join(self.save_fn,'state.json'),'w') as file:
+            json.dump(state,file)
 
     @classmethod
-    def load(cls, save_fn):
+    def load(cls, save_fn, mmap_mode='r'):
         """
         Load ``self`` from disk.
 
+        Catalogs are not merged nor read at this stage.
+
         Parameters
         ----------
         save_fn : string
-            File name where ``self`` is saved.
+            Directory (or file, for the previous pickle-based format) where ``self`` is saved.
+
+        mmap_mode : string, default='r'
+            Memory-map mode for arrays, see :func:`numpy.load`.
         """
-        state = np.load(save_fn,allow_pickle=True)[()]
+        if os.path.isfile(save_fn):
+            state = np.load(save_fn,allow_pickle=True)[()]
+        else:
+            with open(os.path.join(save_fn,'state.json'),'r') as file:
+                state = json.load(file)
+
+            def decode(value):
+                if 'runcat' in value:
+                    return RunCatalog.read_npy_dir(os.path.join(save_fn,value['runcat']),mmap_mode=None)
+                if 'npy' in value:
+                    return np.load(os.path.join(save_fn,value['npy']),mmap_mode=mmap_mode)
+                if 'dict' in value:
+                    return {key:decode(val) for key,val in value['dict'].items()}
+                if 'list' in value:
+                    return [decode(val) for val in value['list']]
+                return value['value']
+
+            state = {key:decode(val) for key,val in state.items()}
         self = object.__new__(cls)
         self.setstate(state)
+        self.save_fn = save_fn
         return self
 
     def set_catalog(self, name, filetype=None, source=None, **kwargs_merge):
@@ -704,12 +910,19 @@ class CatalogMatching(CatalogMerging):
 
     output : SimCatalog
         Catalog of output sources.
+
+    matches : list
+        List of dictionaries holding :attr:`_match_keys` arrays, for each matching radius given to :meth:`match`.
     """
 
+    _match_keys = ['inter_input','inter_output','distance','extra_input','extra_output',
+                    'inter_input_injected','inter_output_injected','distance_injected']
+
     def getstate(self):
         """Export ``self`` to ``dict``."""
         state = super(CatalogMatching,self).getstate()
-        for key in ['add_input_tractor','injected','observed','distance']:
+        for key in ['add_input_tractor','injected','observed','distance','radius_in_degree','matches',
+                    'candidate_input','candidate_output','candidate_distance','candidate_run']:
             if self.has(key):
                 state[key] = self.get(key)
         for put in ['input','output']:
@@ -720,10 +933,17 @@ class CatalogMatching(CatalogMerging):
         return state
 
     def setstate(self, state):
-        """Add ``state`` to ``self``."""
+        """Add ``state`` to ``self``; :attr:`input` and :attr:`output` will be set up (see :meth:`setup`) when first accessed."""
         super(CatalogMatching,self).setstate(state)
-        if self.has('add_input_tractor'):
-            self.setup(add_input_tractor=state['add_input_tractor'])
+        self._setup_pending = self.has('add_input_tractor')
+
+    def __getattr__(self, name):
+        """Set up :attr:`input` and :attr:`output` when first accessed after :meth:`setstate`."""
+        if name in ['input','output'] and self.__dict__.get('_setup_pending',False):
+            self._setup_pending = False
+            self.setup(add_input_tractor=self.add_input_tractor)
+            return self.get(name)
+        raise AttributeError('%s object has no attribute %s' % (self.__class__.__name__,name))
 
     def setup(self, add_input_tractor=False):
         """
@@ -759,26 +979,55 @@ class CatalogMatching(CatalogMerging):
 
         Parameters
         ----------
-        radius_in_degree : float, default=1.5/3600.
+        radius_in_degree : float, list, default=1.5/3600.
             Radius (degree) for input - output matching.
+            If list, a single search is performed at the largest radius, all candidate pairs are kept,
+            and the nearest matches for each radius are derived from them (see :meth:`set_radius`).
+            Matches for each radius are stored in :attr:`matches`; :attr:`inter_input`, :attr:`inter_output`, etc.
+            correspond to the last radius of the list.
 
         add_input_tractor : bool, string, default=False
             Passed on to :meth:`setup`.
         """
         self.setup(add_input_tractor=add_input_tractor)
-        self.inter_input,self.inter_output,self.distance = [],[],[]
+        self.radius_in_degree = radius_in_degree
+        radii = np.ravel(radius_in_degree)
+        nearest = np.ndim(radius_in_degree) == 0
+        self.candidate_input,self.candidate_output,self.candidate_distance,self.candidate_run = [],[],[],[]
         index_input,index_output = self.input.index(),self.output.index()
-        for mask_input,mask_output in zip(self.runcat.iter_mask(self.input),self.runcat.iter_mask(self.output)):
+        for irun,(mask_input,mask_output) in enumerate(zip(self.runcat.iter_mask(self.input),self.runcat.iter_mask(self.output))):
             # to avoid applying simid cuts on observed sources (of the legacypipe run), i.e. we keep all observed sources in the brick
             mask_input[self.observed] = self.input.brickname[self.observed] == self.input.brickname[self.injected][0]
-            inter_input,inter_output,distance = self.input[mask_input].match_radec(self.output[mask_output],nearest=True,
-                                                                                    radius_in_degree=radius_in_degree,return_distance=True)
-            self.inter_input.append(index_input[mask_input][inter_input])
-            self.inter_output.append(index_output[mask_output][inter_output])
-            self.distance.append(distance)
-        for key in ['inter_input','inter_output','distance']:
+            inter_input,inter_output,distance = self.input[mask_input].match_radec(self.output[mask_output],nearest=nearest,
+                                                                                    radius_in_degree=radii.max(),return_distance=True)
+            self.candidate_input.append(index_input[mask_input][inter_input])
+            self.candidate_output.append(index_output[mask_output][inter_output])
+            self.candidate_distance.append(distance)
+            self.candidate_run.append(np.full(inter_input.size,irun))
+        for key in ['candidate_input','candidate_output','candidate_distance','candidate_run']:
             self.set(key,np.concatenate(self.get(key)))
 
+        self.matches = []
+        for radius in radii:
+            self.set_radius(radius)
+            self.matches.append({key:self.get(key) for key in self._match_keys})
+
+    def set_radius(self, radius_in_degree):
+        """
+        Set :attr:`inter_input`, :attr:`inter_output`, etc. for matching radius ``radius_in_degree``,
+        from the candidate pairs obtained with :meth:`match` (no new search is performed).
+
+        Parameters
+        ----------
+        radius_in_degree : float
+            Radius (degree) for input - output matching.
+            Should not be larger than the radius used in :meth:`match`.
+        """
+        if radius_in_degree > np.max(self.radius_in_degree):
+            raise ValueError('Radius %.4g is larger than the matching radius %.4g; call match() again.' % (radius_in_degree,np.max(self.radius_in_degree)))
+        self.inter_input,self.inter_output,self.distance = utils.select_nearest(self.candidate_input,self.candidate_output,self.candidate_distance,
+                                                                                radius_in_degree=radius_in_degree,groups=self.candidate_run)
+
         logger.info('Matching %d objects / %d in input, %d in output',self.inter_input.size,self.input.size,self.output.size)
         mask_injected = np.isin(self.inter_input,self.injected)
         for key in ['input','output']:
@@ -788,10 +1037,13 @@ class CatalogMatching(CatalogMerging):
         logger.info('Matching %d injected objects / %d in input, %d in output',self.inter_input_injected.size,self.injected.size,self.output.size)
 
     def export(self, base='input', key_input='input', key_output=None, key_distance='distance', key_matched='matched', key_injected='injected',
-                injected=False, write=False, **kwargs_write):
+                injected=False, fields_input=None, fields_output=None, write=False, chunksize=None, **kwargs_write):
         """
         Export the matched catalog obtained with :meth:`match`.
 
+        Each column of the exported catalog is built once, from the :attr:`input` and :attr:`output` columns,
+        without copying the full catalogs.
+
         Parameters
         ----------
         base : string, default='input'
@@ -820,9 +1072,20 @@ class CatalogMatching(CatalogMerging):
         injected : bool, default=False
             If ``True``, restrict to injected sources.
 
+        fields_input : list, default=None
+            Input fields to export (before adding prefix ``key_input``), may contain shell-style wildcards, e.g. 'flux_*'.
+            If ``None``, export all input fields.
+
+        fields_output : list, default=None
+            Same as ``fields_input``, for output fields.
+
         write : bool, default=False
             Write catalog to disk.
 
+        chunksize : int, default=None
+            If not ``None`` and ``write == True``, the catalog is written to disk by chunks of ``chunksize`` rows,
+            without being built in memory. ``None`` is then returned.
+
         kwargs_write : dict
             Arguments for :meth:`write_catalog`.
 
@@ -831,48 +1094,95 @@ class CatalogMatching(CatalogMerging):
         cat : SimCatalog
             Catalog of input - output sources.
         """
-        full_input = self.input.copy()
-        if key_input:
-            for field in full_input.fields: full_input.rename(field,'%s_%s' % (key_input,field))
-        output = self.output.copy()
-        if key_output:
-            for field in output.fields: output.rename(field,'%s_%s' % (key_output,field))
-        if key_distance is not None:
-            for key,cat in zip(['input','output'],[full_input,output]):
-                distance = cat.nans()
-                distance[self.get('inter_%s' % key)] = self.distance
-                cat.set(key_distance,distance)
-        if key_matched is not None:
-            for key,cat in zip(['input','output'],[full_input,output]):
-                match = cat.falses()
-                match[self.get('inter_%s' % key)] = True
-                cat.set(key_matched,match)
-
         inter_input,inter_output = self.inter_input,self.inter_output
-        extra_input,extra_output = self.extra_input,self.extra_output
         if injected:
             inter_input,inter_output = self.inter_input_injected,self.inter_output_injected
-        if key_injected:
-            mask_injected = full_input.falses()
-            mask_injected[self.injected] = True
-            full_input.set(key_injected,mask_injected)
+
+        rows = {}
         if base == 'input':
-            cat = full_input
-            cat.fill(output,index_self=inter_input,index_other=inter_output)
+            rows['input'] = self.input.index()
+            rows['output'] = self.input.full(-1,dtype=int)
+            rows['output'][inter_input] = inter_output
         elif base == 'output':
-            cat = output
-            cat.fill(full_input,index_self=inter_output,index_other=inter_input)
+            rows['output'] = self.output.index()
+            rows['input'] = self.output.full(-1,dtype=int)
+            rows['input'][inter_output] = inter_input
         elif base == 'inter':
-            cat = full_input[inter_input]
-            cat.fill(output,index_self=None,index_other=inter_output)
+            rows['input'],rows['output'] = inter_input,inter_output
         elif base == 'extra':
-            cat = full_input[extra_input]
-            cat.fill(output,index_self='after',index_other=extra_output)
+            rows['input'] = np.concatenate([self.extra_input,np.full_like(self.extra_output,-1)])
+            rows['output'] = np.concatenate([np.full_like(self.extra_input,-1),self.extra_output])
         elif base == 'all':
-            cat = full_input[self.injected] if injected else full_input
-            cat.fill(output,index_self='after')
+            index_input = self.injected if injected else self.input.index()
+            rows['input'] = np.concatenate([index_input,np.full(self.output.size,-1,dtype=index_input.dtype)])
+            rows['output'] = np.concatenate([np.full_like(index_input,-1),self.output.index()])
+        else:
+            raise ValueError('Unknown base %s' % base)
+
+        columns = {}
+        for key,cat,fields,prefix in zip(['input','output'],[self.input,self.output],[fields_input,fields_output],[key_input,key_output]):
+            columns[key] = {}
+            if fields is None:
+                fields = cat.fields
+            else:
+                if isinstance(fields,str): fields = [fields]
+                fields = [field for field in cat.fields if any(fnmatch.fnmatch(field,pattern) for pattern in fields)]
+            for field in fields:
+                columns[key]['%s_%s' % (prefix,field) if prefix else field] = cat.get(field)
+            if key_distance is not None:
+                distance = cat.nans()
+                distance[self.get('inter_%s' % key)] = self.distance
+                columns[key][key_distance] = distance
+            if key_matched is not None:
+                match = cat.falses()
+                match[self.get('inter_%s' % key)] = True
+                columns[key][key_matched] = match
+        if key_injected:
+            mask_injected = self.input.falses()
+            mask_injected[self.injected] = True
+            columns['input'][key_injected] = mask_injected
+
+        # columns of the base catalog come first; where both input and output are defined, the non-base one prevails
+        keys = ['output','input'] if base == 'output' else ['input','output']
+        names = list(columns[keys[0]].keys()) + [name for name in columns[keys[1]] if name not in columns[keys[0]]]
+        size = rows['input'].size
+
+        def get_column(name, rowslice):
+            cols = [columns[key].get(name,None) for key in keys]
+            if cols[0] is not None and cols[1] is not None and cols[0].shape[1:] != cols[1].shape[1:]:
+                cols[0] = None
+            ref = cols[0] if cols[0] is not None else cols[1]
+            toret = np.zeros(shape=(len(range(size)[rowslice]),)+ref.shape[1:],dtype=ref.dtype)
+            if np.issubdtype(toret.dtype,np.floating):
+                toret[...] = np.nan
+            for key,col in zip(keys,cols):
+                if col is None: continue
+                index = rows[key][rowslice]
+                mask = index >= 0
+                toret[mask] = col[index[mask]]
+            return toret
+
+        filetype = 'match_%s' % base
+        if write and chunksize is not None:
+            key = self.set_cat_fn(filetype=filetype,source='legacysim',**kwargs_write)
+            fn = self.cats_fn[key]
+            logger.info('Writing matched catalog to %s by chunks of %d rows.',fn,chunksize)
+            utils.mkdir(os.path.dirname(fn))
+            with fitsio.FITS(fn,'rw',clobber=True) as file:
+                for start in range(0,max(size,1),chunksize):
+                    rowslice = slice(start,start+chunksize)
+                    data = [get_column(name,rowslice) for name in names]
+                    if start == 0:
+                        file.write(data,names=names)
+                    else:
+                        file[-1].append(data,names=names)
+            return None
+
+        cat = SimCatalog(length=size)
+        for name in names:
+            cat.set(name,get_column(name,slice(None)))
         if write:
-            self.write_catalog(cat=cat,filetype='match_%s' % base,source='legacysim',**kwargs_write)
+            self.write_catalog(cat=cat,filetype=filetype,source='legacysim',**kwargs_write)
         return cat
 
     @utils.saveplot()
@@ -1132,7 +1442,7 @@ class ResourceEventAnalysis(CatalogMerging):
             indices = self.events.event
             values = self.events.nans()
             for mask in self.runcat.iter_mask(self.events):
-                events_run = self.events[mask]
+                events_run = self.events.view(mask)
                 dt = np.zeros(events_run.size,dtype='f4')
                 tf = events_run.unixtf[0]
                 for event in events[::-1]:
@@ -1153,6 +1463,24 @@ class ResourceEventAnalysis(CatalogMerging):
 
         return events,values
 
+    def process_wall_times(self):
+        """
+        Return wall time of each run with a ``ps`` file, from the first event to the last ``ps`` time step.
+
+        Returns
+        -------
+        walltimes : SimCatalog
+            Catalog with columns 'brickname', sim id (see :meth:`~legacysim.survey.get_sim_id.keys`) and 'walltime' (in seconds).
+        """
+        self.set_catalog(name='events',filetype='ps-events')
+        fields = ['brickname'] + get_sim_id.keys()
+        index = utils.unique_rows(utils.pack_columns([self.events.get(field) for field in fields]))[0]
+        walltimes = SimCatalog()
+        for field in fields:
+            walltimes.set(field,self.events.get(field)[index])
+        walltimes.walltime = self.events.unixtf[index] - self.events.unixti[index]
+        return walltimes
+
     def plot_bar(self, ax, events='stage', label_entries=True, kwargs_bar=None):
         """
         Plot event mean and standard deviation in the form of a bar graph.
@@ -1289,7 +1617,7 @@ class ResourceAnalysis(ResourceEventAnalysis):
         stats = {q:{} for q in quantities}
         stats['time'] = []
         for mask in self.runcat.iter_mask(self.series):
-            series = self.series[mask]
+            series = self.series.view(mask)
             qseries = self.process_one_series(series,quantities=quantities)
             for q in quantities:
                 for key,val in qseries[q].items():
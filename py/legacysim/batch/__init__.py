@@ -1,6 +1,8 @@
 """Routines for batch of tasks."""
 
-__all__ = ['TaskManager','run_shell','EnvironmentManager','get_pythonpath']
+__all__ = ['TaskManager','run_shell','EnvironmentManager','get_pythonpath','RunLedger','RunCostModel']
 
 from .task_manager import TaskManager, run_shell
 from .environment_manager import EnvironmentManager, get_pythonpath
+from .run_ledger import RunLedger
+from .cost_model import RunCostModel
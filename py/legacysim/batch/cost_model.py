@@ -0,0 +1,135 @@
+"""Estimate run costs, to dispatch the most expensive runs first."""
+
+import logging
+
+import numpy as np
+from legacypipe.survey import LegacySurveyData
+
+from legacysim import SimCatalog, BrickCatalog, get_sim_id, utils
+
+
+logger = logging.getLogger('legacysim.cost_model')
+
+
+class RunCostModel(object):
+    """
+    Estimate relative cost (wall time) of runs, modelled as ``a + b*nccds + c*ninjected``, with:
+
+        - ``nccds`` the number of CCDs (from survey-ccds) overlapping the brick
+        - ``ninjected`` the number of sources injected in the run
+
+    If wall times of previous runs are provided (see :meth:`~legacysim.analysis.ResourceEventAnalysis.process_wall_times`),
+    coefficients ``(a,b,c)`` are fitted to them, and these wall times are used as is for the corresponding runs.
+
+    To be passed to :meth:`~legacysim.batch.task_manager.BaseTaskManager.iterate` or ``map``
+    to dispatch runs by decreasing cost.
+
+    Attributes
+    ----------
+    coeffs : ndarray
+        Coefficients ``(a,b,c)``.
+    """
+
+    def __init__(self, survey=None, injected=None, nobj=None, walltimes=None, coeffs=(0.,1.,0.1), ccd_radius_in_degree=0.17):
+        """
+        Initialize :class:`RunCostModel`.
+
+        Parameters
+        ----------
+        survey : LegacySurveyData, string, default=None
+            ``survey_dir`` or ``survey``, to read survey-ccds and survey-bricks.
+            If ``None``, ``nccds`` is 0 for all runs.
+
+        injected : SimCatalog, string, default=None
+            Catalog (or file name) of sources to inject, with column 'brickname', as passed to :mod:`~legacysim.runbrick` (``--injected-fn``).
+            If ``None``, ``ninjected`` is 0 for all runs.
+
+        nobj : int, default=None
+            Maximum number of sources injected per run (``--nobj`` of :mod:`~legacysim.runbrick`), starting from row ``rowstart``.
+            If ``None``, all sources of the brick from ``rowstart`` are injected.
+
+        walltimes : SimCatalog, default=None
+            Wall times of previous runs, with columns 'brickname', sim id and 'walltime',
+            as returned by :meth:`~legacysim.analysis.ResourceEventAnalysis.process_wall_times`.
+
+        coeffs : tuple, default=(0.,1.,0.1)
+            Default coefficients ``(a,b,c)``, used if ``walltimes`` is not provided.
+
+        ccd_radius_in_degree : float, default=0.17
+            Radius of CCDs (half diagonal, 0.17 degree for DECam); CCDs whose center is closer to the brick center
+            than the brick and CCD radii are considered overlapping.
+        """
+        if survey is not None and not isinstance(survey,LegacySurveyData):
+            survey = LegacySurveyData(survey_dir=survey)
+        self.survey = survey
+        if isinstance(injected,str):
+            injected = SimCatalog(injected,lazy=True)
+        self.injected = injected
+        self.nobj = nobj
+        self.ccd_radius_in_degree = ccd_radius_in_degree
+        self.walltimes = walltimes
+        self.coeffs = np.array(coeffs,dtype='f8')
+        self._nccds = {}
+        if walltimes is not None and walltimes.size:
+            self.fit()
+
+    def get_nccds(self, bricknames):
+        """Return number of CCDs overlapping bricks ``bricknames``."""
+        bricknames = np.asarray(bricknames)
+        if self.survey is None:
+            return np.zeros(bricknames.size,dtype='i8')
+        uniques,inverse = np.unique(bricknames,return_inverse=True)
+        missing = [brickname for brickname in uniques if brickname not in self._nccds]
+        if missing:
+            if not hasattr(self,'_ccds'):
+                self._ccds = self.survey.get_ccds_readonly()
+                self._bricks = BrickCatalog(self.survey)
+            bricks = self._bricks.get_by_name(missing)
+            radius = np.hypot((bricks.ra2 - bricks.ra1)*np.cos(np.deg2rad(bricks.dec)),bricks.dec2 - bricks.dec1).max()/2. + self.ccd_radius_in_degree
+            index1 = utils.match_radec(bricks.ra,bricks.dec,self._ccds.ra,self._ccds.dec,radius_in_degree=radius,nearest=False)[0]
+            for brickname,nccds in zip(missing,np.bincount(index1,minlength=len(missing))):
+                self._nccds[brickname] = nccds
+        return np.array([self._nccds[brickname] for brickname in uniques],dtype='i8')[inverse]
+
+    def get_ninjected(self, runcat):
+        """Return number of sources injected in runs ``runcat``."""
+        if self.injected is None:
+            return np.zeros(runcat.size,dtype='i8')
+        uniques,counts = np.unique(self.injected.brickname,return_counts=True)
+        toret = np.zeros(runcat.size,dtype='i8')
+        if uniques.size:
+            index = np.searchsorted(uniques,runcat.brickname).clip(0,uniques.size-1)
+            mask = uniques[index] == runcat.brickname
+            toret[mask] = counts[index[mask]]
+        toret -= runcat.rowstart
+        if self.nobj is not None:
+            toret = np.minimum(toret,self.nobj)
+        return toret.clip(0,None)
+
+    def get_features(self, runcat):
+        """Return features ``(1,nccds,ninjected)`` for runs ``runcat``, of shape ``(runcat.size,3)``."""
+        return np.column_stack([np.ones(runcat.size,dtype='f8'),self.get_nccds(runcat.brickname),self.get_ninjected(runcat)])
+
+    def fit(self):
+        """Fit (non-negative) coefficients :attr:`coeffs` to wall times of previous runs."""
+        features = self.get_features(self.walltimes)
+        coeffs = np.linalg.lstsq(features,self.walltimes.walltime,rcond=None)[0]
+        self.coeffs = coeffs.clip(0,None)
+        logger.info('Fitted cost coefficients %s to %d wall times.',self.coeffs,self.walltimes.size)
+
+    def __call__(self, runcat):
+        """
+        Return estimated costs of runs ``runcat``.
+        For runs with wall time in :attr:`walltimes`, return this wall time.
+        """
+        costs = self.get_features(runcat).dot(self.coeffs)
+        if self.walltimes is not None and self.walltimes.size:
+            fields = ['brickname'] + get_sim_id.keys()
+            keys = utils.pack_columns([np.concatenate([self.walltimes.get(field),runcat.get(field)]) for field in fields])
+            inverse = utils.unique_rows(keys)[1]
+            index = np.full(inverse.max() + 1,-1,dtype='i8')
+            index[inverse[:self.walltimes.size]] = np.arange(self.walltimes.size)
+            index = index[inverse[self.walltimes.size:]]
+            mask = index >= 0
+            costs[mask] = self.walltimes.walltime[index[mask]]
+        return costs
@@ -9,6 +9,7 @@ For details, run::
 
 import os
 import sys
+import json
 import logging
 import argparse
 import fitsio
@@ -60,6 +61,9 @@ class EnvironmentManager(object):
     _shorts_stage = {'tims':'TIMS','refs':'REFS','outliers':'OUTL','halos':'HALO','srcs':'SRCS','fitblobs':'FITB',
                 'coadds':'COAD','wise_forced':'WISE','writecat':'WCAT'}
 
+    # prefixes of header keywords holding version information, see get_versions_header()
+    _versions_prefixes = ('VER_','LSV_','DEPNAM','DEPVER','LEGPIPEV')
+
     _docker_versions = []
     _docker_versions.append(('DR9.6.2',{'astrometry':'0.82','tractor':'dr9.4','legacypipe':'DR9.6.2'}))
     _docker_versions.append(('DR9.6.4',{'astrometry':'0.80-14-gf7363e4c','tractor':'dr9.3','legacypipe':'DR9.6.4'}))
@@ -78,9 +82,9 @@ class EnvironmentManager(object):
 
         Parameters
         ----------
-        header : FITSHDR, default=None
-            FITS header to read environment from. If not ``None``,
-            supersedes ``fn``, ``base_dir``, ``brickname``, ``source``, ``filetype``, ``kwargs_simid``.
+        header : FITSHDR, dict, default=None
+            FITS header (or dictionary of keywords, as returned by :meth:`read_versions_headers`) to read environment from.
+            If not ``None``, supersedes ``fn``, ``base_dir``, ``brickname``, ``source``, ``filetype``, ``kwargs_simid``.
             ``header`` is copied into :attr:`header`.
 
         fn : string, default=None
@@ -109,7 +113,9 @@ class EnvironmentManager(object):
         self.environ = {}
         if skip:
             return
-        if header is not None:
+        if isinstance(header,dict):
+            self.header = fitsio.FITSHDR(header)
+        elif header is not None:
             self.header = header.__class__()
             # copy for security
             for record in header.records():
@@ -118,18 +124,74 @@ class EnvironmentManager(object):
             self.fn = fn
             if self.fn is None:
                 if filetype is None:
-                    if source == 'legacysim':
-                        filetype = 'injected'
-                    else:
-                        filetype = 'tractor'
+                    filetype = self.default_filetype(source)
                 kwargs_simid = kwargs_simid or {}
                 self.fn = find_file(base_dir=base_dir,filetype=filetype,brickname=brickname,source=source,**kwargs_simid)
             self.header = fitsio.read_header(self.fn)
         # hack, since DR9.6.2 had no VER_TIMS entry
         if 'VER_TIMS' not in self.header: self.header['VER_TIMS'] = self.header['LEGPIPEV']
+        # index (module name, DEPVER keyword), first occurrence of module name in header wins
+        self._depver = {}
+        for key in self.header:
+            if key.startswith('DEPNAM'):
+                self._depver.setdefault(self.header[key],key.replace('DEPNAM','DEPVER'))
         #print('OSENVIRON',os.environ)
         self.set_environ()
 
+    @staticmethod
+    def default_filetype(source='legacypipe'):
+        """Return default type of file to read header from: 'injected' if ``source == 'legacysim'``, else 'tractor'."""
+        return 'injected' if source == 'legacysim' else 'tractor'
+
+    @classmethod
+    def get_versions_header(cls, header):
+        """Return dictionary of keywords of ``header`` holding version information, i.e. all that :class:`EnvironmentManager` needs."""
+        return {key:header[key] for key in header if key.startswith(cls._versions_prefixes)}
+
+    @classmethod
+    def read_versions_headers(cls, fns, nthreads=1, cache_fn=None):
+        """
+        Read version information from primary headers of files ``fns``, see :meth:`get_versions_header`.
+
+        Parameters
+        ----------
+        fns : list
+            List of file names. Duplicates are read only once.
+
+        nthreads : int, default=1
+            Number of threads to read headers with.
+
+        cache_fn : string, default=None
+            If not ``None``, file name of the JSON cache holding version information with file modification times,
+            such that only files modified since the last call are read again.
+
+        Returns
+        -------
+        headers : list
+            List of dictionaries, to be passed to :class:`EnvironmentManager`, in the same order as ``fns``.
+        """
+        cache = {}
+        if cache_fn is not None and os.path.isfile(cache_fn):
+            with open(cache_fn,'r') as file:
+                cache = json.load(file)
+
+        def read(fn):
+            mtime = os.stat(fn).st_mtime
+            if cache.get(fn,[None])[0] == mtime:
+                return cache[fn]
+            return [mtime,cls.get_versions_header(fitsio.read_header(fn))]
+
+        ufns = list(dict.fromkeys(fns))
+        entries = dict(zip(ufns,utils.read_files(read,ufns,nthreads=nthreads)))
+        if cache_fn is not None:
+            cache.update(entries)
+            utils.mkdir(os.path.dirname(cache_fn))
+            tmp_fn = '%s.tmp' % cache_fn
+            with open(tmp_fn,'w') as file:
+                json.dump(cache,file)
+            os.replace(tmp_fn,cache_fn)
+        return [entries[fn][1] for fn in fns]
+
     def __enter__(self):
         """Save current environment variables and enter new environment."""
         self._back_environ = dict(os.environ)
@@ -148,10 +210,8 @@ class EnvironmentManager(object):
         msg = 'Setting environment variable %s = %s'
         for name,keyw in self._shorts_env.items():
             value = None
-            for key in self.header:
-                if key.startswith('DEPNAM') and self.header[key] == keyw:
-                    value = self.header[key.replace('DEPNAM','DEPVER')]
-                    break
+            if keyw in self._depver:
+                value = self.header[self._depver[keyw]]
             if value is not None:
                 logger.info(msg,name,value)
                 self.environ[name] = value
@@ -226,10 +286,7 @@ class EnvironmentManager(object):
         elif module == 'legacysim':
             key = 'LSV_%s' % self._shorts_stage[stage]
         else:
-            for k in self.header:
-                if k.startswith('DEPNAM') and self.header[k] == module:
-                    key = k.replace('DEPNAM','DEPVER')
-                    break
+            key = self._depver.get(module,None)
         if key is None or key not in self.header:
             raise ValueError('Could not find version information on module %s for stage %s in header: %s' % (module,stage,self.header))
         return self.header[key]
@@ -259,13 +316,13 @@ class EnvironmentManager(object):
             stage_names.remove('wise_forced') # when wise not run, keyword not added in header
 
         last_stage = stage_names[0]
-        stages = Stages([(last_stage,get_stage_versions(last_stage))])
+        stages = {last_stage:get_stage_versions(last_stage)}
         for stage in stage_names[1:]:
             versions = get_stage_versions(stage)
             if versions != stages[last_stage]:
                 stages[stage] = versions
                 last_stage = stage
-        return stages
+        return Stages(stages)
 
 
 def get_pythonpath(module_dir='/src/',versions=(),full=False,as_string=False):
@@ -6,14 +6,19 @@ and https://github.com/bccp/nbodykit/blob/master/nbodykit/batch.py.
 """
 
 import os
+import time
+import json
 import traceback
 import logging
 import warnings
+from collections import deque
 from contextlib import contextmanager
 
 import numpy
 from mpi4py import MPI
 
+from .task_manager import get_task_order, save_task_result
+
 
 class CurrentMPIComm(object):
     """Class to faciliate getting and setting the current MPI communicator."""
@@ -141,6 +146,17 @@ def split_ranks(N_ranks, N, include_all=False):
                 yield i+1, ranks
 
 
+def get_task_key(task):
+    """
+    Return the string identifying `task` in a journal. A run
+    (:class:`~legacysim.catalog.RunCatalog` row) is identified by its
+    brick name and sim id; other tasks by their `repr`.
+    """
+    if hasattr(task, 'kwargs_simid'):
+        return ' '.join([str(task.brickname)] + ['%s=%s' % (key, task.kwargs_simid[key]) for key in task.kwargs_simid])
+    return repr(task)
+
+
 def enum(*sequential, **named):
     """
     Enumeration values to serve as status tags passed
@@ -161,11 +177,25 @@ class MPITaskManager(object):
 
     The main function is ``iterate`` which iterates through a set of tasks,
     distributing the tasks in parallel over the available ranks.
+
+    Results of ``map`` and ``imap`` are sent to the root along with the
+    notification that the task is done, as soon as it is done.
+
+    In ``map``, an exception raised by the function is caught and reported
+    to the root, which retries the task (up to `retries` times, on another
+    worker if possible) while the worker carries on with its next task.
+    Tasks done and failed can be recorded in an append-only `journal`;
+    tasks recorded as done there are skipped when restarting with the same journal.
+    Tasks failing all attempts are stored in `failed` (task index: traceback).
     """
     logger = logging.getLogger('MPITaskManager')
 
+    # communication tags
+    tags = enum('READY', 'DONE', 'EXIT', 'START', 'FAILED')
+
     @CurrentMPIComm.enable
-    def __init__(self, cpus_per_task=1, comm=None, debug=False, use_all_cpus=False):
+    def __init__(self, cpus_per_task=1, comm=None, debug=False, use_all_cpus=False, ledger=None,
+                 chunksize=1, prefetch=0, share_tasks=False, retries=0, journal=None, task_key=None):
         """
         Initialize MPITaskManager.
 
@@ -184,6 +214,28 @@ class MPITaskManager(object):
             if `True`, use all available CPUs, including the remainder
             if `cpus_per_task` is not divide the total number of CPUs
             evenly; default is `False`
+        ledger : RunLedger, optional
+            if not `None`, tasks are runs, marked as 'running' in `ledger` when
+            dispatched and 'done' when finished; only accessed by the root rank
+        chunksize : int, optional
+            the number of tasks sent to a worker at once; default is 1
+        prefetch : int, optional
+            the number of chunks a worker requests in advance of the one
+            it is computing, such that the next chunk is already available
+            when the current one is done; default is 0
+        share_tasks : bool, optional
+            if `True`, all ranks are assumed to hold the same list of tasks,
+            and the root only sends task indices; default is `False`
+        retries : int, optional
+            the number of times a task failing in `map` is sent again to
+            the workers; default is 0
+        journal : str, optional
+            if not `None`, path to a file where the root appends (as JSON lines)
+            tasks as they are done or failed; tasks already done according to
+            this file are skipped
+        task_key : callable, optional
+            the function returning the string identifying a task in `journal`;
+            default is :func:`get_task_key`
         """
 
         if debug:
@@ -191,6 +243,14 @@ class MPITaskManager(object):
 
         self.cpus_per_task = cpus_per_task
         self.use_all_cpus  = use_all_cpus
+        self.ledger        = ledger
+        self.chunksize     = max(chunksize, 1)
+        self.prefetch      = max(prefetch, 0)
+        self.share_tasks   = share_tasks
+        self.retries       = max(retries, 0)
+        self.journal       = journal
+        self.task_key      = get_task_key if task_key is None else task_key
+        self.failed        = {}
 
         # the base communicator
         self.basecomm = MPI.COMM_WORLD if comm is None else comm
@@ -201,9 +261,6 @@ class MPITaskManager(object):
         if self.size == 1:
             raise ValueError('need at least two processes to use a MPITaskManager')
 
-        # communication tags
-        self.tags = enum('READY', 'DONE', 'EXIT', 'START')
-
         # the task communicator
         self.comm = None
 
@@ -227,6 +284,7 @@ class MPITaskManager(object):
             total_ranks += len(ranks)
             nworkers = nworkers + 1
         self.workers = nworkers # store the total number of workers
+        self.worker_ranks = chain_ranks # and their master ranks
 
         # check for no workers!
         if self.workers == 0:
@@ -271,8 +329,18 @@ class MPITaskManager(object):
         except:
             raise ValueError('workers are only defined when inside the ``with MPITaskManager()`` context')
 
-    def _get_tasks(self):
-        """Internal generator that yields the next available task from a worker."""
+    def _get_tasks(self, tasks=None):
+        """
+        Internal generator that yields the next available task from a worker.
+
+        Tasks are received by chunks of `chunksize` tasks; the worker master rank keeps
+        `prefetch` chunk requests in flight, such that the root can answer them while
+        the current chunk is computed. If `share_tasks`, task values are taken from `tasks`.
+
+        The (result, traceback) of a task can be sent to the generator (see `_compute`):
+        the result is sent to the root with the DONE tag, unless the traceback is not `None`,
+        in which case the task is reported as failed.
+        """
 
         if self.is_root():
             raise RuntimeError('Root rank mistakenly told to await tasks')
@@ -282,31 +350,53 @@ class MPITaskManager(object):
             args = (self.rank, MPI.Get_processor_name(), self.comm.size)
             self.logger.debug('worker master rank is %d on %s with %d processes available',*args)
 
+        host = MPI.Get_processor_name()
+        nrequests = 0
+
         # continously loop and wait for instructions
         while True:
-            args = None
+            chunk = None
             tag = -1
 
-            # have the master rank of the subcomm ask for task and then broadcast
+            # have the master rank of the subcomm ask for tasks and then broadcast
             if self.comm.rank == 0:
-                self.basecomm.send(None, dest=0, tag=self.tags.READY)
-                args = self.basecomm.recv(source=0, tag=MPI.ANY_TAG, status=self.status)
+                if nrequests == 0:
+                    self.basecomm.send(host, dest=0, tag=self.tags.READY)
+                    nrequests += 1
+                chunk = self.basecomm.recv(source=0, tag=MPI.ANY_TAG, status=self.status)
                 tag = self.status.Get_tag()
+                nrequests -= 1
+                if tag == self.tags.START:
+                    # request next chunks before computing this one
+                    while nrequests < self.prefetch:
+                        self.basecomm.send(host, dest=0, tag=self.tags.READY)
+                        nrequests += 1
+                else:
+                    # no more tasks: remaining requests are answered by EXIT as well
+                    for i in range(nrequests):
+                        self.basecomm.recv(source=0, tag=self.tags.EXIT)
+                    nrequests = 0
 
             # bcast to everyone in the worker subcomm
-            args  = self.comm.bcast(args) # args is [task_number, task_value]
+            chunk = self.comm.bcast(chunk) # chunk is a list of [task_number, task_value]
             tag   = self.comm.bcast(tag)
 
-            # yield the task
+            # yield the tasks
             if tag == self.tags.START:
 
-                # yield the task value
-                yield args
+                for tasknum, args in chunk:
 
-                # wait for everyone in task group before telling master this task is done
-                self.comm.Barrier()
-                if self.comm.rank == 0:
-                    self.basecomm.send([args[0], None], dest=0, tag=self.tags.DONE)
+                    # yield the task value
+                    reply = yield tasknum, (tasks[tasknum] if self.share_tasks else args)
+                    result, error = (None, None) if reply is None else reply
+
+                    # wait for everyone in task group before telling master this task is done (or failed)
+                    errors = [error for error in self.comm.allgather(error) if error is not None]
+                    if self.comm.rank == 0:
+                        if errors:
+                            self.basecomm.send([tasknum, errors[0]], dest=0, tag=self.tags.FAILED)
+                        else:
+                            self.basecomm.send([tasknum, result], dest=0, tag=self.tags.DONE)
 
             # see ya later
             elif tag == self.tags.EXIT:
@@ -320,20 +410,103 @@ class MPITaskManager(object):
         # debug logging
         self.logger.debug('rank %d process is done waiting',self.rank)
 
-    def _distribute_tasks(self, tasks):
-        """Internal function that distributes the tasks from the root to the workers."""
+    @staticmethod
+    def _read_journal(journal):
+        """Internal function that returns the keys of tasks done according to `journal`."""
+        done = set()
+        if not os.path.isfile(journal):
+            return done
+        with open(journal, 'r') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError: # line truncated by a crash
+                    continue
+                if entry['status'] == 'done':
+                    done.add(entry['task'])
+        return done
+
+    def _distribute_tasks(self, tasks, costs=None):
+        """
+        Internal generator that distributes the tasks from the root to the workers,
+        by decreasing cost if `costs` is provided (see :func:`get_task_order`),
+        and yields the index and result of each task as soon as it is done.
+
+        Failed tasks are sent again (up to `retries` times), preferably to a worker
+        they have not failed on yet; workers are only told to exit once no task is left
+        to retry or running, such that they can take over failed tasks.
+        """
 
         if not self.is_root():
             raise ValueError('only the root rank should distribute the tasks')
 
         ntasks = len(tasks)
-        task_index     = 0
+        order = get_task_order(tasks, costs).tolist()
+        journal = None
+        if self.journal is not None:
+            keys = [self.task_key(task) for task in tasks]
+            done = self._read_journal(self.journal)
+            nskipped = sum(keys[tasknum] in done for tasknum in order)
+            if nskipped:
+                self.logger.info('skipping %d task(s) already done according to journal %s',nskipped,self.journal)
+                order = [tasknum for tasknum in order if keys[tasknum] not in done]
+            journal = open(self.journal, 'a')
+
+        fresh          = deque(order)
+        retry          = [] # failed tasks to be sent again
+        failed_on      = {} # worker ranks each task has failed on
+        nfailures      = {}
+        running        = set()
+        parked         = [] # requests from workers, waiting for failed tasks or running ones to complete
         closed_workers = 0
+        exited         = set() # workers told to exit
+        requests       = []
+        self.failed    = {}
 
         # logging info
         args = (self.workers, ntasks)
         self.logger.debug('master starting with %d worker(s) with %d total tasks',*args)
 
+        def write_journal(tasknum, source, status, trace=None):
+            if journal is None: return
+            entry = {'task':keys[tasknum], 'status':status, 'worker':source, 'time':time.time()}
+            if trace is not None: entry['traceback'] = trace
+            journal.write(json.dumps(entry) + '\n')
+            journal.flush()
+
+        def answer(source, host):
+            # failed tasks first, on a worker they have not failed on, unless they have failed on all remaining ones
+            alive = [rank for rank in self.worker_ranks if rank not in exited]
+            tasknums = []
+            for tasknum in list(retry):
+                if len(tasknums) < self.chunksize and (source not in failed_on[tasknum] or all(rank in failed_on[tasknum] for rank in alive)):
+                    retry.remove(tasknum)
+                    tasknums.append(tasknum)
+            while fresh and len(tasknums) < self.chunksize:
+                tasknums.append(fresh.popleft())
+
+            # send a chunk of tasks
+            if tasknums:
+                chunk = [[tasknum, None if self.share_tasks else tasks[tasknum]] for tasknum in tasknums]
+                if self.ledger is not None:
+                    for tasknum in tasknums:
+                        self.ledger.start(tasks[tasknum], host=host)
+                running.update(tasknums)
+                # non-blocking send, as the worker may be busy computing the previous chunk
+                requests[:] = [request for request in requests if not request.Test()]
+                requests.append(self.basecomm.isend(chunk, dest=source, tag=self.tags.START))
+                self.logger.debug('sending %d task(s) to worker %d',len(tasknums),source)
+                return True
+
+            # running tasks may fail and be sent to this worker
+            if retry or running:
+                return False
+
+            # all tasks done -- tell worker to exit
+            requests.append(self.basecomm.isend(None, dest=source, tag=self.tags.EXIT))
+            exited.add(source)
+            return True
+
         # loop until all workers have finished with no more tasks
         while closed_workers < self.workers:
 
@@ -342,30 +515,85 @@ class MPITaskManager(object):
             source = self.status.Get_source()
             tag = self.status.Get_tag()
 
-            # worker is ready, so send it a task
+            # worker is ready, so send it a chunk of tasks
             if tag == self.tags.READY:
-
-                # still more tasks to compute
-                if task_index < ntasks:
-                    this_task = [task_index, tasks[task_index]]
-                    self.basecomm.send(this_task, dest=source, tag=self.tags.START)
-                    self.logger.debug('sending task `%s` to worker %d',str(tasks[task_index]),source)
-                    task_index += 1
-
-                # all tasks sent -- tell worker to exit
-                else:
-                    self.basecomm.send(None, dest=source, tag=self.tags.EXIT)
+                parked.append((source, data))
 
             # store the results from finished tasks
             elif tag == self.tags.DONE:
                 self.logger.debug('received result from worker %d',source)
+                tasknum, result = data
+                running.discard(tasknum)
+                if self.ledger is not None:
+                    self.ledger.finish(tasks[tasknum])
+                write_journal(tasknum, source, 'done')
+
+            # task failed -- send it again, or give up
+            elif tag == self.tags.FAILED:
+                tasknum, trace = data
+                running.discard(tasknum)
+                failed_on.setdefault(tasknum, set()).add(source)
+                nfailures[tasknum] = nfailures.get(tasknum, 0) + 1
+                if self.ledger is not None:
+                    self.ledger.finish(tasks[tasknum], exitcode=1)
+                write_journal(tasknum, source, 'failed', trace=trace)
+                if nfailures[tasknum] <= self.retries:
+                    self.logger.warning('task %d failed on worker %d, retrying:\n%s',tasknum,source,trace)
+                    retry.append(tasknum)
+                else:
+                    self.logger.error('task %d failed on worker %d, giving up:\n%s',tasknum,source,trace)
+                    self.failed[tasknum] = trace
 
             # track workers that exited
             elif tag == self.tags.EXIT:
                 closed_workers += 1
                 self.logger.debug('worker %d has exited, closed workers = %d',source,closed_workers)
 
-    def iterate(self, tasks):
+            # answer pending requests, now that tasks may have completed or failed
+            parked = [request for request in parked if not answer(*request)]
+
+            # hand the result over, once workers have been answered
+            if tag == self.tags.DONE:
+                yield tasknum, result
+
+        MPI.Request.Waitall(requests)
+        if journal is not None:
+            journal.close()
+        if self.failed:
+            self.logger.error('%d task(s) failed: %s',len(self.failed),sorted(self.failed))
+
+    def _compute(self, function, tasks, save_fn=None):
+        """
+        Internal function that applies `function` to the tasks received by a worker,
+        sending back results (or tracebacks of failed tasks) to the root.
+        If `save_fn` is provided, results are saved by the worker master rank instead.
+        """
+        get_tasks = self._get_tasks(tasks)
+        reply = None
+        while True:
+            try:
+                tasknum, args = get_tasks.send(reply)
+            except StopIteration:
+                break
+
+            # make function arguments consistent with *args
+            if not isinstance(args, tuple):
+                args = (args,)
+
+            # compute the result (only worker root needs to save or send it)
+            try:
+                result = function(*args)
+            except Exception:
+                reply = (None, traceback.format_exc())
+                continue
+            if self.comm.rank != 0:
+                result = None
+            elif save_fn is not None:
+                save_task_result(save_fn, tasknum, result)
+                result = None
+            reply = (result, None)
+
+    def iterate(self, tasks, costs=None):
         """
         Iterate through a series of tasks in parallel.
 
@@ -379,6 +607,9 @@ class MPITaskManager(object):
         tasks : iterable
             An iterable of `task` items that will be yielded in parallel
             across all ranks.
+        costs : array-like, callable, optional
+            if not `None`, tasks are dispatched by decreasing cost, see
+            :func:`get_task_order`; only used by the root rank
 
         Yields
         -------
@@ -387,20 +618,87 @@ class MPITaskManager(object):
         """
         # master distributes the tasks and tracks closed workers
         if self.is_root():
-            self._distribute_tasks(tasks)
+            for tasknum, result in self._distribute_tasks(tasks, costs=costs):
+                pass
 
         # workers will wait for instructions
         elif self.is_worker():
-            for tasknum, args in self._get_tasks():
+            for tasknum, args in self._get_tasks(tasks):
                 yield args
 
-    def map(self, function, tasks):
+        # such that requests for the next tasks are not received by this call
+        self.basecomm.Barrier()
+
+    def _imap_root(self, tasks, costs=None):
+        """
+        Internal generator that yields results on the root rank (see `imap`).
+        If stopped early, remaining tasks are still computed (and their results discarded),
+        such that workers are released.
+        """
+        results = self._distribute_tasks(tasks, costs=costs)
+        try:
+            for tasknum, result in results:
+                yield tasknum, result
+        finally:
+            for tasknum, result in results:
+                pass
+            self.failed = self.basecomm.bcast(self.failed, root=0)
+
+    def imap(self, function, tasks, costs=None):
+        """
+        Apply a function to all of the values in a list and yield results
+        on the root rank, in order of completion.
+
+        If ``tasks`` contains tuples, the arguments are passed to
+        ``function`` using the ``*args`` syntax.
+
+        Notes
+        -----
+        This is a collective operation and should be called by
+        all ranks. Workers compute their tasks within this call, and
+        get an empty iterator. The root rank gets a generator, which
+        should be iterated over: if iteration is stopped early, remaining
+        tasks are still computed, with their results discarded. Failed tasks
+        (see `map`) are not yielded.
+
+        Parameters
+        ----------
+        function : callable
+            The function to apply to the list.
+        tasks : list
+            The list of tasks.
+        costs : array-like, callable, optional
+            if not `None`, tasks are dispatched by decreasing cost, see
+            :func:`get_task_order`; only used by the root rank
+
+        Returns
+        -------
+        results : iterator
+            Yields task index in `tasks` and return value of ``function``,
+            on the root rank only.
+        """
+        # master distributes the tasks and yields results as they come
+        if self.is_root():
+            return self._imap_root(tasks, costs=costs)
+
+        # workers compute and send back results
+        if self.is_worker():
+            self._compute(function, tasks)
+
+        self.failed = self.basecomm.bcast(self.failed, root=0)
+        return iter([])
+
+    def map(self, function, tasks, costs=None, callback=None, save_fn=None, broadcast=False):
         """
         Apply a function to all of the values in a list and return the list of results.
 
         If ``tasks`` contains tuples, the arguments are passed to
         ``function`` using the ``*args`` syntax.
 
+        Results are sent to the root as tasks are done, and only returned on the
+        root rank, unless `broadcast` is `True`. To avoid holding all results
+        in memory on the root rank, provide `callback` or `save_fn`.
+
         Notes
         -----
         This is a collective operation and should be called by
@@ -412,37 +710,48 @@ class MPITaskManager(object):
             The function to apply to the list.
         tasks : list
             The list of tasks.
+        costs : array-like, callable, optional
+            if not `None`, tasks are dispatched by decreasing cost, see
+            :func:`get_task_order`; only used by the root rank
+        callback : callable, optional
+            if not `None`, called on the root rank as ``callback(index, result)``
+            for each task as soon as it is done, instead of collecting results
+        save_fn : str, optional
+            if not `None`, results are pickled to ``save_fn % index`` by the
+            workers (see :func:`save_task_result`), instead of being collected
+        broadcast : bool, optional
+            if `True`, results are broadcast from the root to all ranks;
+            default is `False`
 
         Returns
         -------
         results : list
-            The list of the return values of ``function``.
+            The list of the return values of ``function``, in the order of ``tasks``;
+            `None` for tasks that failed (see `failed`) or were skipped (see `journal`).
+            `None` on ranks other than the root, unless `broadcast` is `True`,
+            and on all ranks if `callback` or `save_fn` is provided.
         """
-        results = []
+        if callback is not None and save_fn is not None:
+            raise ValueError('provide either callback or save_fn, not both')
+        collect = callback is None and save_fn is None
+        results = [None]*len(tasks) if collect and self.is_root() else None
 
-        # master distributes the tasks and tracks closed workers
+        # master distributes the tasks and collects results as they come
         if self.is_root():
-            self._distribute_tasks(tasks)
+            for tasknum, result in self._distribute_tasks(tasks, costs=costs):
+                if callback is not None:
+                    callback(tasknum, result)
+                elif results is not None:
+                    results[tasknum] = result
 
-        # workers will wait for instructions
+        # workers compute and send back results
         elif self.is_worker():
+            self._compute(function, tasks, save_fn=save_fn)
 
-            # iterate through tasks in parallel
-            for tasknum, args in self._get_tasks():
-
-                # make function arguments consistent with *args
-                if not isinstance(args, tuple):
-                    args = (args,)
-
-                # compute the result (only worker root needs to save)
-                result = function(*args)
-                if self.comm.rank == 0:
-                    results.append((tasknum, result))
-
-        # put the results in the correct order
-        results = self.basecomm.allgather(results)
-        results = [item for sublist in results for item in sublist]
-        return [r[1] for r in sorted(results, key=lambda x: x[0])]
+        self.failed = self.basecomm.bcast(self.failed, root=0)
+        if collect and broadcast:
+            results = self.basecomm.bcast(results, root=0)
+        return results
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
         """Exit gracefully by closing and freeing the MPI-related variables."""
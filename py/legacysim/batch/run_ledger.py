@@ -0,0 +1,219 @@
+"""Ledger of run statuses, backed by a SQLite file."""
+
+import os
+import time
+import socket
+import sqlite3
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+
+from legacysim import RunCatalog, get_sim_id, utils
+
+
+logger = logging.getLogger('legacysim.run_ledger')
+
+
+class RunLedger(object):
+    """
+    Record the status of runs (defined by brick x sim id x stages, as in :class:`~legacysim.catalog.RunCatalog`)
+    in a SQLite file, along with the number of attempts, host, start and end times and exit code.
+
+    Runs are identified by (brick name x sim id): stages are stored, but are not part of the run identifier.
+
+    Attributes
+    ----------
+    _statuses : list
+        Possible run statuses.
+    """
+    _statuses = ['pending','running','done','failed']
+
+    def __init__(self, fn, timeout=60.):
+        """
+        Open (and create if needed) ledger.
+
+        Parameters
+        ----------
+        fn : string
+            Path to SQLite file. Should be on a local (or at least lock-supporting) file system.
+
+        timeout : float, default=60.
+            How many seconds to wait for a lock on the database to be released.
+        """
+        self.fn = fn
+        utils.mkdir(os.path.dirname(fn))
+        # autocommit mode: transactions are handled by _transaction()
+        self.connection = sqlite3.connect(fn,timeout=timeout,isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        columns = ','.join(['%s INTEGER NOT NULL' % key for key in get_sim_id.keys()])
+        keys = ','.join(self.keys())
+        with self._transaction() as cursor:
+            cursor.execute('CREATE TABLE IF NOT EXISTS runs (brickname TEXT NOT NULL,%s,stages TEXT NOT NULL,'
+                           'status TEXT NOT NULL DEFAULT \'pending\',attempts INTEGER NOT NULL DEFAULT 0,'
+                           'host TEXT,start_time REAL,end_time REAL,exitcode INTEGER,PRIMARY KEY (%s))' % (columns,keys))
+            cursor.execute('CREATE INDEX IF NOT EXISTS runs_status ON runs (status)')
+
+    @staticmethod
+    def keys():
+        """Return names of columns identifying a run."""
+        return ['brickname'] + get_sim_id.keys()
+
+    @classmethod
+    def statuses(cls):
+        """Return :attr:`_statuses`."""
+        return cls._statuses
+
+    @contextmanager
+    def _transaction(self):
+        """Context in which statements are executed atomically, holding the write lock from the start."""
+        cursor = self.connection.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            yield cursor
+        except:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+
+    def __enter__(self):
+        """Return self."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        """Close connection."""
+        self.close()
+
+    def close(self):
+        """Close connection."""
+        self.connection.close()
+
+    def _get_key(self, run):
+        """Return identifier of run ``run``, a :class:`~legacysim.catalog.RunCatalog` row."""
+        return (str(run.brickname),) + tuple(int(run.kwargs_simid[key]) for key in get_sim_id.keys())
+
+    def _where_key(self):
+        return ' AND '.join(['%s = ?' % key for key in self.keys()])
+
+    def _where_status(self, status=None):
+        if status is None:
+            status = self.statuses()
+        if np.ndim(status) == 0:
+            status = [status]
+        for s in status:
+            if s not in self.statuses():
+                raise ValueError('Unknown status %s, should be one of %s' % (s,self.statuses()))
+        return 'status IN (%s)' % ','.join(['?']*len(status)),list(status)
+
+    def add_runs(self, runcat, reset=False):
+        """
+        Add runs to the ledger, with status 'pending'.
+
+        Parameters
+        ----------
+        runcat : RunCatalog
+            Runs to add.
+
+        reset : bool, default=False
+            If ``True``, runs already in the ledger are reset (status 'pending', no attempt).
+            Else, they are left untouched.
+        """
+        runcat = runcat.remove_duplicates(copy=True)
+        list_stages = [str(stages) for stages in runcat.get_list_stages()]
+        rows = zip(*([np.asarray(runcat.brickname).tolist()] + [np.asarray(runcat.get(key)).tolist() for key in get_sim_id.keys()]
+                      + [[list_stages[istages] for istages in runcat.stagesid]]))
+        keys = self.keys() + ['stages']
+        statement = 'INSERT OR %s INTO runs (%s) VALUES (%s)' % ('REPLACE' if reset else 'IGNORE',','.join(keys),','.join(['?']*len(keys)))
+        with self._transaction() as cursor:
+            cursor.executemany(statement,rows)
+
+    def import_list(self, fns, reset=False):
+        """Add runs of run list(s) ``fns``, see :meth:`RunCatalog.from_list` and :meth:`add_runs`."""
+        self.add_runs(RunCatalog.from_list(fns),reset=reset)
+
+    def get_runs(self, status=None):
+        """
+        Return runs with status ``status``, in insertion order.
+
+        Parameters
+        ----------
+        status : string, list, default=None
+            Status(es) of runs to return, e.g. ['pending','failed'] for what is left to do.
+            If ``None``, return all runs.
+
+        Returns
+        -------
+        runcat : RunCatalog
+            Runs.
+        """
+        where,args = self._where_status(status)
+        rows = self.connection.execute('SELECT %s,stages FROM runs WHERE %s ORDER BY rowid' % (','.join(self.keys()),where),args).fetchall()
+        columns = list(zip(*rows)) or [[]]*(len(self.keys()) + 1)
+        runcat = RunCatalog()
+        runcat.set('brickname',np.array(columns[0],dtype='U'))
+        for key,column in zip(get_sim_id.keys(),columns[1:]):
+            runcat.set(key,np.array(column,dtype='i8'))
+        istages = {stages:runcat.append_stages(stages) for stages in dict.fromkeys(columns[-1])}
+        runcat.set('stagesid',np.array([istages[stages] for stages in columns[-1]],dtype='i8'))
+        return runcat
+
+    def export_list(self, fn, status=('pending','failed')):
+        """Write runs with status ``status`` to run list ``fn``, see :meth:`get_runs` and :meth:`RunCatalog.write_list`."""
+        self.get_runs(status=status).write_list(fn)
+
+    def count(self, status=None):
+        """Return number of runs with status ``status`` (all runs if ``None``)."""
+        where,args = self._where_status(status)
+        return self.connection.execute('SELECT COUNT(*) FROM runs WHERE %s' % where,args).fetchone()[0]
+
+    def get_info(self, run):
+        """
+        Return information about run ``run``, a :class:`~legacysim.catalog.RunCatalog` row.
+
+        Returns
+        -------
+        info : dict
+            Dictionary with keys 'stages', 'status', 'attempts', 'host', 'start_time', 'end_time', 'exitcode';
+            ``None`` if ``run`` is not in the ledger.
+        """
+        names = ['stages','status','attempts','host','start_time','end_time','exitcode']
+        row = self.connection.execute('SELECT %s FROM runs WHERE %s' % (','.join(names),self._where_key()),self._get_key(run)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(names,row))
+
+    def start(self, run, host=None):
+        """
+        Mark run ``run`` as 'running' and increment its number of attempts.
+        If ``run`` is not in the ledger, it is added.
+
+        Parameters
+        ----------
+        run : RunCatalog row
+            Run.
+
+        host : string, default=None
+            Host the run is executed on. Defaults to :func:`socket.gethostname`.
+        """
+        if host is None: host = socket.gethostname()
+        key = self._get_key(run)
+        with self._transaction() as cursor:
+            cursor.execute('INSERT OR IGNORE INTO runs (%s,stages) VALUES (%s)' % (','.join(self.keys()),','.join(['?']*(len(key) + 1))),key + (str(run.stages),))
+            cursor.execute('UPDATE runs SET status = \'running\',attempts = attempts + 1,host = ?,start_time = ?,end_time = NULL,exitcode = NULL WHERE %s' % self._where_key(),
+                           (host,time.time()) + key)
+
+    def finish(self, run, exitcode=0):
+        """
+        Mark run ``run`` as 'done' if ``exitcode`` is 0, else 'failed'.
+        Only runs with status 'running' are updated, such that a status set by the user is not overriden by a task manager.
+        """
+        status = 'done' if exitcode == 0 else 'failed'
+        with self._transaction() as cursor:
+            cursor.execute('UPDATE runs SET status = ?,end_time = ?,exitcode = ? WHERE status = \'running\' AND %s' % self._where_key(),
+                           (status,time.time(),exitcode) + self._get_key(run))
+
+    def reset(self, status='running'):
+        """Set runs with status ``status`` (e.g. left 'running' by a crashed job) back to 'pending'."""
+        where,args = self._where_status(status)
+        with self._transaction() as cursor:
+            cursor.execute('UPDATE runs SET status = \'pending\' WHERE %s' % where,args)
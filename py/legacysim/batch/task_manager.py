@@ -1,24 +1,109 @@
 """Task manager that run tasks in series."""
 
+import os
 import sys
+import pickle
 import logging
 import subprocess
 
+import numpy as np
+
+from legacysim import utils
+
 
 logger = logging.getLogger('legacysim.task_manager')
 
 
+def get_task_order(tasks, costs=None):
+    """
+    Return indices of ``tasks`` by decreasing cost, such that the most expensive tasks are dispatched first.
+
+    Parameters
+    ----------
+    tasks : list
+        The list of tasks.
+
+    costs : array-like, callable, default=None
+        Estimated task costs, or callable returning them given ``tasks``
+        (e.g. :class:`~legacysim.batch.cost_model.RunCostModel`).
+        If ``None``, return tasks in list order.
+
+    Returns
+    -------
+    order : ndarray
+        Task indices.
+    """
+    if costs is None:
+        return np.arange(len(tasks))
+    if callable(costs):
+        costs = costs(tasks)
+    costs = np.asarray(costs)
+    if costs.shape != (len(tasks),):
+        raise ValueError('Expected %d costs, got array of shape %s' % (len(tasks),costs.shape))
+    return np.argsort(-costs,kind='stable')
+
+
+def save_task_result(save_fn, index, result):
+    """
+    Pickle ``result`` of task ``index``.
+
+    Parameters
+    ----------
+    save_fn : string
+        File name template, formatted with the task index, e.g. 'results/result_%d.pkl'.
+
+    index : int
+        Task index.
+
+    result : object
+        Result to save.
+    """
+    fn = save_fn % index
+    utils.mkdir(os.path.dirname(fn))
+    with open(fn,'wb') as file:
+        pickle.dump(result,file)
+
+
 class BaseTaskManager(object):
     """A dumb task manager, that simply iterates through the tasks in series."""
 
+    def __init__(self, ledger=None, chunksize=1, prefetch=0, share_tasks=False, retries=0, journal=None, task_key=None,
+                 cpus_per_task=1, use_all_cpus=False, debug=False, comm=None):
+        """
+        Initialize BaseTaskManager.
+
+        Parameters
+        ----------
+        ledger : RunLedger, default=None
+            If not ``None``, tasks are runs (:class:`~legacysim.catalog.RunCatalog` rows), marked as 'running' in ``ledger``
+            when dispatched and 'done' when finished (or 'failed' if an exception is raised).
+
+        chunksize, prefetch, share_tasks, retries, journal, task_key, cpus_per_task, use_all_cpus, debug, comm
+            Options specific to :class:`~legacysim.batch.mpi_task_manager.MPITaskManager`, ignored.
+        """
+        self.ledger = ledger
+        self._task = None
+
     def __enter__(self):
         """Return self."""
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
-        """Do nothing."""
+        """Mark current task as failed in :attr:`ledger` if an exception was raised."""
+        if exc_value is not None and self.ledger is not None and self._task is not None:
+            self.ledger.finish(self._task,exitcode=1)
+
+    def _start(self, task):
+        self._task = task
+        if self.ledger is not None:
+            self.ledger.start(task)
+
+    def _finish(self, task, exitcode=0):
+        if self.ledger is not None:
+            self.ledger.finish(task,exitcode=exitcode)
+        self._task = None
 
-    def iterate(self, tasks):
+    def iterate(self, tasks, costs=None):
         """
         Iterate through a series of tasks.
 
@@ -27,15 +112,52 @@ class BaseTaskManager(object):
         tasks : iterable
             An iterable of tasks that will be yielded.
 
+        costs : array-like, callable, default=None
+            If not ``None``, tasks (then a list) are yielded by decreasing cost, see :func:`get_task_order`.
+
         Yields
         -------
         task :
             The individual items of ```tasks``, iterated through in series.
         """
+        if costs is not None:
+            tasks = [tasks[index] for index in get_task_order(tasks,costs)]
         for task in tasks:
+            self._start(task)
             yield task
+            self._finish(task)
+
+    def imap(self, function, tasks, costs=None):
+        """
+        Apply a function to all of the values in a list and yield results as they are computed.
+
+        If ``tasks`` contains tuples, the arguments are passed to
+        ``function`` using the ``*args`` syntax.
 
-    def map(self, function, tasks):
+        Parameters
+        ----------
+        function : callable
+            The function to apply to the list.
+        tasks : list
+            The list of tasks.
+        costs : array-like, callable, default=None
+            If not ``None``, tasks are processed by decreasing cost, see :func:`get_task_order`.
+
+        Yields
+        ------
+        index : int
+            Task index in ``tasks``.
+        result : object
+            Return value of ``function``.
+        """
+        for index in get_task_order(tasks,costs):
+            task = tasks[index]
+            self._start(task)
+            result = function(*(task if isinstance(task,tuple) else (task,)))
+            self._finish(task)
+            yield index,result
+
+    def map(self, function, tasks, costs=None, callback=None, save_fn=None, broadcast=False):
         """
         Apply a function to all of the values in a list and return the list of results.
 
@@ -48,13 +170,35 @@ class BaseTaskManager(object):
             The function to apply to the list.
         tasks : list
             The list of tasks.
+        costs : array-like, callable, default=None
+            If not ``None``, tasks are processed by decreasing cost, see :func:`get_task_order`.
+        callback : callable, default=None
+            If not ``None``, called as ``callback(index,result)`` for each task as soon as it is done,
+            instead of collecting results.
+        save_fn : string, default=None
+            If not ``None``, results are pickled to ``save_fn % index`` (see :func:`save_task_result`),
+            instead of being collected.
+        broadcast : bool, default=False
+            Whether :class:`~legacysim.batch.mpi_task_manager.MPITaskManager` should return results on all ranks
+            (else, only on the root rank); the single (root) process always gets results.
 
         Returns
         -------
         results : list
-            The list of the return values of ``function``.
+            The list of the return values of ``function``, in the order of ``tasks``;
+            ``None`` if ``callback`` or ``save_fn`` is provided.
         """
-        return [function(*(t if isinstance(t,tuple) else (t,))) for t in tasks]
+        if callback is not None and save_fn is not None:
+            raise ValueError('Provide either callback or save_fn, not both')
+        results = [None]*len(tasks) if callback is None and save_fn is None else None
+        for index,result in self.imap(function,tasks,costs=costs):
+            if save_fn is not None:
+                save_task_result(save_fn,index,result)
+            elif callback is not None:
+                callback(index,result)
+            else:
+                results[index] = result
+        return results
 
 
 def TaskManager(ntasks=None, **kwargs):
@@ -2,25 +2,65 @@
 
 import os
 import re
-import glob
-import itertools
+import ast
 import logging
 import argparse
 import copy
+import json
 from collections import UserDict, UserList
+from concurrent import futures
 
 import numpy as np
 import fitsio
 from astrometry.util import fits
 from legacypipe.survey import LegacySurveyData, wcs_for_brick
 
-from .survey import find_file, get_sim_id
+from .survey import find_file, find_files, get_sim_id
 from . import utils
 
 
 logger = logging.getLogger('legacysim.catalog')
 
 
+class CatalogRow(object):
+    """
+    Lightweight catalog row, as yielded by :meth:`BaseCatalog.iter_rows`.
+
+    Column values are accessed as attributes (e.g. ``row.ra``) or with :meth:`get` (e.g. ``row.get('ra')``).
+
+    Note
+    ----
+    The same instance is reused for all rows: copy values to keep them after iteration.
+    """
+    __slots__ = ['_columns','_index']
+
+    def __init__(self, columns, index=0):
+        """
+        Initialize :class:`CatalogRow`.
+
+        Parameters
+        ----------
+        columns : dict
+            Dictionary of (field, list of values).
+
+        index : int, default=0
+            Row index.
+        """
+        self._columns = columns
+        self._index = index
+
+    def get(self, name):
+        """Return value of column ``name``."""
+        return self._columns[name][self._index]
+
+    def __getattr__(self, name):
+        """Return value of column ``name``."""
+        try:
+            return self._columns[name][self._index]
+        except KeyError:
+            raise AttributeError('Row has no column %s' % name)
+
+
 class BaseCatalog(fits.tabledata):
     """
     Extend :class:`~astrometry.util.fits.tabledata`, with convenient methods.
@@ -34,21 +74,125 @@ class BaseCatalog(fits.tabledata):
         Catalog columns, including internals (starting with `_`). Without internals: :attr:`fields`.
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, lazy=False, **kwargs):
         """
         Call :func:`astrometry.util.fits.fits_table`.
 
         For an empty catalog, one can provide size or length, to define :meth:`len`,
         used in methods to build ``numpy`` arrays (e.g. :meth:`zeros`).
         Otherwise, :meth:`len` is set when the first column is added.
+
+        If ``lazy`` and a file name is provided, only the header and table shape are read;
+        columns are read on first access (see :meth:`load_columns`).
+        ``rows`` can be a slice, to read a row range.
         """
         length = kwargs.pop('length',kwargs.pop('size',None))
-        table = fits.fits_table(*args,**kwargs)
-        self.__dict__.update(table.__dict__)
+        dataorfn = kwargs.get('dataorfn',args[0] if args else None)
+        if isinstance(dataorfn,str) and (lazy or isinstance(kwargs.get('rows',None),slice)):
+            self._init_lazy(dataorfn,**{key:val for key,val in kwargs.items() if key != 'dataorfn'})
+            if not lazy: self.load_columns()
+        else:
+            table = fits.fits_table(*args,**kwargs)
+            self.__dict__.update(table.__dict__)
         if length is not None: self._length = length
 
+    def _init_lazy(self, fn, rows=None, ext=None, hdu=None, header='default', columns=None, **kwargs):
+        """Read header and table shape of ``fn``, and set up :attr:`_lazy` to read columns on demand."""
+        ext = ext if ext is not None else hdu if hdu is not None else 1
+        with fitsio.FITS(fn) as file:
+            if header == 'default':
+                header = file[ext].read_header()
+            nrows = file[ext].get_nrows()
+            colnames = file[ext].get_colnames()
+        if isinstance(rows,slice):
+            rows = np.arange(nrows)[rows]
+        if nrows == 0 or colnames == ['dummy']:
+            table = fits.fits_table(fn,ext=ext,header=header)
+            self.__dict__.update(table.__dict__)
+            return
+        self.__dict__.update(fits.tabledata(header=header).__dict__)
+        lazy = {colname.lower():colname for colname in colnames}
+        if columns is not None:
+            columns = [column.lower() for column in columns]
+            lazy = {column:colname for column,colname in lazy.items() if column in columns}
+        self._columns = list(lazy.keys())
+        self._length = nrows if rows is None else len(rows)
+        self._lazy = {'fn':fn,'ext':ext,'rows':rows,'columns':lazy,'kwargs':kwargs}
+
+    def load_columns(self, *fields):
+        """
+        Read columns ``fields`` from file, for a catalog initialized with ``lazy = True``.
+
+        Parameters
+        ----------
+        fields : list
+            Fields to read. Defaults to all columns not read yet.
+            Columns already read are ignored.
+        """
+        lazy = self.__dict__.get('_lazy',None)
+        if not lazy:
+            return
+        if not fields:
+            fields = list(lazy['columns'].keys())
+        fields = [field for field in fields if field in lazy['columns']]
+        if not fields:
+            return
+        table = fits.fits_table(lazy['fn'],ext=lazy['ext'],rows=lazy['rows'],header=None,
+                                columns=[lazy['columns'][field] for field in fields],**lazy['kwargs'])
+        for field in fields:
+            self.__dict__[field] = table.get(field)
+            del lazy['columns'][field]
+
+    def __getattr__(self, name):
+        """Read lazy column ``name`` on first access."""
+        lazy = self.__dict__.get('_lazy',None)
+        if lazy and name in lazy['columns']:
+            self.load_columns(name)
+            return self.__dict__[name]
+        raise AttributeError('%s has no attribute %s' % (self.__class__.__name__,name))
+
+    def __setattr__(self, name, val):
+        """Set attribute, which supersedes lazy column ``name``."""
+        lazy = self.__dict__.get('_lazy',None)
+        if lazy and name in lazy['columns']:
+            del lazy['columns'][name]
+        super(BaseCatalog,self).__setattr__(name,val)
+
+    def getcolumn(self, name):
+        """Return column ``name``, reading it first if lazy."""
+        self.load_columns(name)
+        return super(BaseCatalog,self).getcolumn(name)
+
+    get = getcolumn
+
+    def delete_column(self, name):
+        """Delete column ``name``."""
+        lazy = self.__dict__.get('_lazy',None)
+        if lazy and name in lazy['columns']:
+            del lazy['columns'][name]
+            self._columns.remove(name)
+            return
+        super(BaseCatalog,self).delete_column(name)
+
+    def cut(self, index):
+        """Keep rows ``index``; lazy columns are not read, only restricted to rows ``index``."""
+        lazy = self.__dict__.get('_lazy',None)
+        if lazy and lazy['columns']:
+            rows = np.arange(len(self)) if lazy['rows'] is None else lazy['rows']
+            lazy['rows'] = rows[index]
+            super(BaseCatalog,self).cut(index)
+            self._length = len(lazy['rows'])
+            return
+        super(BaseCatalog,self).cut(index)
+
+    def append(self, other):
+        """Append rows of ``other`` to ``self``."""
+        self.load_columns()
+        super(BaseCatalog,self).append(other)
+
     def __getitem__(self, item):
         """Redefine :meth:`astrometry.util.fits.tabledata.__getitem__` to avoid calling :meth:`__init__`."""
+        self.load_columns()
         toret = self.copy(fields=[])
         for name, val in self.__dict__.items():
             if name.startswith('_'):
@@ -63,6 +207,49 @@ class BaseCatalog(fits.tabledata):
                 toret._length = len(getattr(toret, name))
         return toret
 
+    def view(self, item=slice(None)):
+        """
+        Return catalog of rows ``item``, sharing memory with ``self`` where possible.
+
+        Contrary to :meth:`__getitem__`, internal (starting with '_') values are shallow-copied,
+        and columns are not copied if ``item`` is a slice (:class:`numpy.ndarray` views).
+        Index or boolean arrays return column copies, as in :mod:`numpy`.
+
+        Parameters
+        ----------
+        item : slice, int, array-like, default=slice(None)
+            Slice, index or boolean array. A single index returns a one-row catalog.
+
+        Returns
+        -------
+        new : BaseCatalog
+            View of ``self``.
+
+        Note
+        ----
+        Modifying a column of the view in place (e.g. ``new.ra[:] = 0.``) also modifies ``self`` if ``item`` is a slice;
+        setting a column (e.g. ``new.ra = new.zeros()``) does not. Call :meth:`copy` to get an independent catalog.
+        """
+        self.load_columns()
+        new = object.__new__(self.__class__)
+        for name,val in self.__dict__.items():
+            if name.startswith('_'):
+                new.__dict__[name] = copy.copy(val)
+        if isinstance(item,slice):
+            new._length = len(range(*item.indices(len(self))))
+        else:
+            item = np.asarray(item)
+            if item.ndim == 0:
+                item = item[None]
+            new._length = item.sum() if item.dtype == np.bool_ else item.size
+        for name in self.fields:
+            val = self.get(name)
+            if isinstance(val,np.ndarray):
+                new.__dict__[name] = val[item]
+            else:
+                new.__dict__[name] = fits.cut_array(val,item,name)
+        return new
+
     @classmethod
     def from_dict(cls, d):
         """Construct catalog from dictionary of (field, column)."""
@@ -221,8 +408,11 @@ class BaseCatalog(fits.tabledata):
             fields = self.fields
         if isinstance(fields,str):
             fields = [fields]
+        self.load_columns(*fields)
         new = object.__new__(self.__class__)
         for name,val in self.__dict__.items():
+            if name == '_lazy':
+                continue
             if name.startswith('_') or name in fields:
                 new.set(name,copy.deepcopy(val))
             new._columns = fields
@@ -274,6 +464,55 @@ class BaseCatalog(fits.tabledata):
         new.append(other)
         return new
 
+    @classmethod
+    def concatenate(cls, cats):
+        """
+        Concatenate catalogs ``cats``, allocating each column once.
+
+        Fields are the union of ``cats`` fields, taken in order of appearance.
+        Missing columns are filled with NaN for floating types, and zeros (``False``, empty strings) otherwise.
+        Column types are promoted with :func:`numpy.result_type`.
+        Internal (starting with '_') values are (deep) copied from the first catalog.
+
+        Parameters
+        ----------
+        cats : list
+            List of catalogs. Catalogs without fields (empty) are ignored.
+
+        Returns
+        -------
+        new : BaseCatalog
+            Concatenated catalog, of size the sum of ``cats`` sizes.
+        """
+        cats = [cat for cat in cats if not isinstance(cat,int) and cat.fields]
+        new = object.__new__(cls)
+        if cats:
+            for name,val in cats[0].__dict__.items():
+                if name.startswith('_'):
+                    new.__dict__[name] = copy.deepcopy(val)
+        else:
+            new.__dict__.update(cls().__dict__)
+        new._columns = []
+        sizes = [len(cat) for cat in cats]
+        new._length = sum(sizes)
+        offsets = np.cumsum([0] + sizes)
+        fields = []
+        for cat in cats:
+            fields += [field for field in cat.fields if field not in fields]
+        for field in fields:
+            columns = [np.asarray(cat.get(field)) if field in cat.fields else None for cat in cats]
+            present = [column for column in columns if column is not None]
+            dtype = np.result_type(*present)
+            col = np.empty((new._length,) + present[0].shape[1:],dtype=dtype)
+            for icat,column in enumerate(columns):
+                sl = slice(offsets[icat],offsets[icat+1])
+                if column is None:
+                    col[sl] = np.nan if np.issubdtype(dtype,np.floating) else np.zeros((),dtype=dtype)
+                else:
+                    col[sl] = column
+            new.set(field,col)
+        return new
+
     def to_recarray(self, fields=None):
         """
         Return :class:`numpy.recarray` representation for columns ``fields``.
@@ -326,44 +565,50 @@ class BaseCatalog(fits.tabledata):
             Return catalog with unique rows for columns ``fields``.
 
         kwargs : dict
-            Other arguments for :func:`numpy.unique`.
+            Flags ``return_index``, ``return_inverse``, ``return_counts``, as for :func:`numpy.unique`.
 
         Returns
         -------
         unique : BaseCatalog
             If ``return_unique == True``, return catalog with unique rows.
             For other values see :func:`numpy.unique`.
+
+        Note
+        ----
+        Rows are compared through :func:`utils.pack_columns` keys, hence NaNs are considered equal.
         """
-        return_index = kwargs.get('return_index',False)
-        if sort_index:
-            kwargs = {**kwargs,**{'return_index':True}}
-        toret = np.unique(self.to_ndarray(fields), axis=0, **kwargs)
-        if not isinstance(toret,tuple):
-            toret = (toret,)
-        if sort_index:
-            argsort = np.argsort(toret[1])
-            if not return_index:
-                toret = (toret[0],) + toret[2:]
-            tmp = toret
-            toret = (tmp[0][argsort],)
-            i = 0
-            if return_index:
-                i += 1
-                toret = toret + (tmp[i][argsort],)
-            if kwargs.get('return_inverse',False):
-                i += 1
-                toret = toret + (argsort[tmp[i]],)
-            for j in range(i+1,len(tmp)):
-                toret = toret + (tmp[j][argsort],)
+        if fields is None:
+            fields = self.fields
+        if isinstance(fields,str):
+            fields = [fields]
+        index,inverse,counts = utils.unique_rows(utils.pack_columns([self.get(field) for field in fields]))
+        if not sort_index:
+            # same order as numpy.unique, i.e. lexicographic order of rows
+            columns = [self.get(field)[index] for field in fields]
+            if all(column.ndim == 1 for column in columns):
+                order = np.lexsort(columns[::-1])
+            else:
+                rows = np.empty(index.size,dtype=[(field,column.dtype,column.shape[1:]) for field,column in zip(fields,columns)])
+                for field,column in zip(fields,columns): rows[field] = column
+                order = np.argsort(rows,kind='stable')
+            rank = np.empty_like(order)
+            rank[order] = np.arange(order.size)
+            index,inverse,counts = index[order],rank[inverse],counts[order]
+        toret = ()
+        if kwargs.get('return_index',False):
+            toret += (index,)
+        if kwargs.get('return_inverse',False):
+            toret += (inverse,)
+        if kwargs.get('return_counts',False):
+            toret += (counts,)
         if return_unique:
             cat = self.copy(fields=[])
-            for name in toret[0].dtype.names:
-                cat.set(name,toret[0][name])
-            cat._length = toret[0].size
-            if len(toret) == 1:
+            for field in fields:
+                cat.set(field,self.get(field)[index])
+            cat._length = index.size
+            if not toret:
                 return cat
-            return (cat,) + toret[1:]
-        toret = toret[1:]
+            return (cat,) + toret
         if len(toret) == 1:
             return toret[0]
         return toret
@@ -413,8 +658,52 @@ class BaseCatalog(fits.tabledata):
             fields = self.fields
         if isinstance(fields,str):
             fields = [fields]
-        rows = np.array([self.get(field) for field in fields]).T
-        return np.array(['-'.join(row) for row in rows])
+        toret = np.asarray(self.get(fields[0])).astype(str)
+        for field in fields[1:]:
+            toret = np.char.add(np.char.add(toret,'-'),np.asarray(self.get(field)).astype(str))
+        return toret
+
+    def mask_where(self, where):
+        """
+        Return mask selecting rows satisfying predicate(s) ``where``.
+
+        Only columns involved in ``where`` are accessed, hence read from file if catalog is lazy.
+
+        Parameters
+        ----------
+        where : string, callable, list
+            Predicate, or list of predicates to be combined with logical and.
+            A string predicate is either a (boolean) field, possibly negated with '~' or 'not ', e.g. 'brick_primary',
+            or a comparison of a field to a Python literal, e.g. 'collided == False', 'type != "PSF"', 'flux_g > 0'.
+            A callable predicate takes the catalog as input and returns a mask.
+
+        Returns
+        -------
+        mask : bool ndarray
+            Mask.
+        """
+        operators = {'==':np.equal,'!=':np.not_equal,'<':np.less,'>':np.greater,'<=':np.less_equal,'>=':np.greater_equal}
+        if isinstance(where,str) or callable(where):
+            where = [where]
+        mask = self.trues()
+        for predicate in where:
+            if callable(predicate):
+                mask &= predicate(self)
+                continue
+            match = re.match(r'^\s*(?P<neg>~|not\s+)?\s*(?P<field>\w+)\s*(?:(?P<op>==|!=|<=|>=|<|>)\s*(?P<value>.+?))?\s*$',predicate)
+            if match is None or (match.group('neg') and match.group('op')):
+                raise ValueError('Predicate %s cannot be parsed' % predicate)
+            col = np.asarray(self.get(match.group('field')))
+            if match.group('op') is None:
+                col = col.astype(np.bool_)
+                mask &= ~col if match.group('neg') else col
+            else:
+                try:
+                    value = ast.literal_eval(match.group('value'))
+                except (ValueError,SyntaxError):
+                    raise ValueError('Value in predicate %s must be a Python literal' % predicate)
+                mask &= operators[match.group('op')](col,value)
+        return mask
 
     def isin(self, other, fields=None):
         """
@@ -437,8 +726,38 @@ class BaseCatalog(fits.tabledata):
             fields = self.fields
         if isinstance(fields,str):
             fields = [fields]
-        selfid,otherid = self.uniqid(fields=fields),other.uniqid(fields=fields)
-        return np.isin(selfid,otherid)
+        # object columns (e.g. strings) are converted to arrays, such that both catalogs share the same (string width) types
+        selfcolumns,othercolumns = [[np.array(column.tolist()) if column.dtype.kind == 'O' else column for column in [cat.get(field) for field in fields]]
+                                    for cat in [self,other]]
+        dtypes = [np.result_type(selfcolumn,othercolumn) for selfcolumn,othercolumn in zip(selfcolumns,othercolumns)]
+        selfkeys = utils.pack_columns(selfcolumns,dtypes=dtypes)
+        otherkeys = utils.pack_columns(othercolumns,dtypes=dtypes)
+        inverse = utils.unique_rows(np.concatenate([selfkeys,otherkeys],axis=0))[1]
+        return np.isin(inverse[:self.size],inverse[self.size:])
+
+    def iter_rows(self, fields=None):
+        """
+        Iterate over rows, without building a one-row catalog per row as ``for row in self``.
+
+        Parameters
+        ----------
+        fields : string, list, default=None
+            Single field or list of fields. If ``None``, use all fields.
+
+        Returns
+        -------
+        rows : iterator
+            Iterator over :class:`CatalogRow`, holding values of ``fields`` as Python scalars.
+            The same instance is yielded at each iteration.
+        """
+        if fields is None:
+            fields = self.fields
+        if isinstance(fields,str):
+            fields = [fields]
+        row = CatalogRow({field:np.asarray(self.get(field)).tolist() for field in fields})
+        for index in range(len(self)):
+            row._index = index
+            yield row
 
     def tile(self, repeats, copy=True):
         """
@@ -496,6 +815,279 @@ class BaseCatalog(fits.tabledata):
         utils.mkdir(os.path.dirname(fn))
         super(BaseCatalog,self).writeto(fn,*args,**kwargs)
 
+    def get_npy_state(self):
+        """Return JSON-serializable state written by :meth:`write_npy_dir` along with columns."""
+        header = self.get_header()
+        if header is not None:
+            if hasattr(header,'records'):
+                header = [{key:record[key] for key in ['name','value','comment'] if key in record} for record in header.records()]
+            else:
+                header = [{'name':key,'value':val} for key,val in dict(header).items()]
+        return {'size':self.size,'fields':self.fields,'header':header}
+
+    def set_npy_state(self, state):
+        """Set internals from ``state``, as returned by :meth:`get_npy_state`."""
+        header = state['header']
+        if header is not None:
+            header = fitsio.FITSHDR(header)
+        self._header = header
+        self._length = state['size']
+
+    def write_npy_dir(self, dirname):
+        """
+        Write catalog to directory ``dirname``, with one native-endian ``.npy`` file per column
+        and a JSON file holding :meth:`get_npy_state` (header, etc.).
+
+        Parameters
+        ----------
+        dirname : string
+            Directory name.
+        """
+        logger.info('Writing %s to %s.',self.__class__.__name__,dirname)
+        utils.mkdir(dirname)
+        for field in self.fields:
+            col = np.asarray(self.get(field))
+            if col.dtype.kind == 'O':
+                col = np.array(col.tolist())
+            np.save(os.path.join(dirname,'%s.npy' % field),col.astype(col.dtype.newbyteorder('='),copy=False))
+        with open(os.path.join(dirname,'catalog.json'),'w') as file:
+            json.dump(self.get_npy_state(),file)
+
+    @classmethod
+    def read_npy_dir(cls, dirname, columns=None, mmap_mode='r'):
+        """
+        Read catalog written by :meth:`write_npy_dir`.
+
+        Parameters
+        ----------
+        dirname : string
+            Directory name.
+
+        columns : list, default=None
+            Columns to read. If ``None``, read all columns.
+
+        mmap_mode : string, default='r'
+            Memory-map mode, see :func:`numpy.load`. With 'r', columns are read-only views of the files:
+            use 'c' (copy-on-write) or ``None`` (read in memory) to modify them in place.
+
+        Returns
+        -------
+        new : BaseCatalog
+            Catalog.
+        """
+        with open(os.path.join(dirname,'catalog.json'),'r') as file:
+            state = json.load(file)
+        new = cls()
+        new.set_npy_state(state)
+        fields = state['fields']
+        if columns is not None:
+            fields = [field for field in fields if field in columns]
+        for field in fields:
+            new.set(field,np.load(os.path.join(dirname,'%s.npy' % field),mmap_mode=mmap_mode if new.size else None))
+        return new
+
+    def get_partition_keys(self, partition_by='brick', nside=32):
+        """
+        Return partition key of each row, see :meth:`write_partitions`.
+
+        Parameters
+        ----------
+        partition_by : string, default='brick'
+            If 'brick', partition by brick name prefix ``brickname[:3]`` (i.e. ra stripes of 1 degree).
+            If 'healpix', partition by HEALPix pixel (nested scheme) of (ra,dec) at resolution ``nside``.
+            If 'simid', partition by :class:`~legacysim.survey.get_sim_id` (default values are used for missing columns).
+
+        nside : int, default=32
+            HEALPix resolution, used if ``partition_by == 'healpix'``.
+
+        Returns
+        -------
+        keys : ndarray
+            String partition keys.
+        """
+        if partition_by == 'brick':
+            brickname = np.asarray(self.brickname)
+            if brickname.dtype.kind == 'S': brickname = np.char.decode(brickname)
+            return brickname.astype('U3')
+        if partition_by == 'healpix':
+            return utils.radec_to_healpix(self.ra,self.dec,nside).astype('U')
+        if partition_by == 'simid':
+            keys = get_sim_id.keys()
+            columns = [self.get(key) if key in self.fields else self.full(default) for key,default in zip(keys,get_sim_id.default())]
+            index,inverse = utils.unique_rows(utils.pack_columns(columns))[:2]
+            uniques = [get_sim_id(**{key:column[ii] for key,column in zip(keys,columns)}) for ii in index]
+            return np.array(uniques,dtype='U')[inverse] if uniques else np.array([],dtype='U')
+        raise ValueError('Unknown partition_by = %s' % partition_by)
+
+    def write_partitions(self, dirname, partition_by='brick', nside=32, nthreads=1):
+        """
+        Write catalog to directory ``dirname``, with one FITS file per partition (see :meth:`get_partition_keys`)
+        and a JSON partition index holding partition keys, file names, sizes and ra, dec boundaries.
+
+        Parameters
+        ----------
+        dirname : string
+            Directory name.
+
+        partition_by : string, default='brick'
+            Partitioning, see :meth:`get_partition_keys`.
+
+        nside : int, default=32
+            HEALPix resolution, used if ``partition_by == 'healpix'``.
+
+        nthreads : int, default=1
+            Number of threads to write partitions with.
+        """
+        self.load_columns()
+        keys = self.get_partition_keys(partition_by=partition_by,nside=nside)
+        uniques,inverse = np.unique(keys,return_inverse=True)
+        order = np.argsort(inverse,kind='stable')
+        bounds = np.searchsorted(inverse[order],np.arange(uniques.size + 1))
+        index_fn = os.path.join(dirname,'partitions.json')
+        if os.path.isfile(index_fn):
+            # remove partitions of previous write
+            for part in self.read_partition_index(dirname)['parts']:
+                fn = os.path.join(dirname,part['fn'])
+                if os.path.isfile(fn): os.remove(fn)
+        utils.mkdir(dirname)
+
+        def write(ipart):
+            part = self[order[bounds[ipart]:bounds[ipart+1]]]
+            entry = {'key':str(uniques[ipart]),'fn':'part_%s.fits' % uniques[ipart],'size':part.size}
+            part.writeto(os.path.join(dirname,entry['fn']))
+            if 'ra' in part.fields and 'dec' in part.fields:
+                entry['radecbox'] = [float(part.ra.min()),float(part.ra.max()),float(part.dec.min()),float(part.dec.max())]
+            return entry
+
+        if nthreads > 1:
+            with futures.ThreadPoolExecutor(max_workers=nthreads) as pool:
+                parts = list(pool.map(write,range(uniques.size)))
+        else:
+            parts = [write(ipart) for ipart in range(uniques.size)]
+        with open(index_fn,'w') as file:
+            json.dump({'partition_by':partition_by,'nside':nside,'size':self.size,'fields':self.fields,'parts':parts},file)
+
+    @staticmethod
+    def read_partition_index(dirname):
+        """Return partition index of directory ``dirname`` written by :meth:`write_partitions`, ``None`` if it does not exist."""
+        index_fn = os.path.join(dirname,'partitions.json')
+        if not os.path.isfile(index_fn):
+            return None
+        with open(index_fn,'r') as file:
+            return json.load(file)
+
+    @classmethod
+    def read_partitions(cls, dirname, partitions=None, radecbox=None, columns=None, where=None, nthreads=1):
+        """
+        Read catalog written by :meth:`write_partitions`. Only partitions needed by the query are read.
+
+        Parameters
+        ----------
+        dirname : string
+            Directory name.
+
+        partitions : string, int, list, default=None
+            Partition keys to read, e.g. brick name prefixes, HEALPix pixels, or sim ids.
+            If ``None``, all partitions are considered.
+
+        radecbox : list, tuple, default=None
+            ramin, ramax, decmin, decmax: read only partitions overlapping this box, and keep rows inside.
+
+        columns : list, default=None
+            Columns to read. If ``None``, read all columns.
+
+        where : string, callable, list, default=None
+            Keep only rows satisfying these predicates, see :meth:`mask_where`.
+
+        nthreads : int, default=1
+            Number of threads to read partitions with, see :func:`utils.read_files`.
+
+        Returns
+        -------
+        new : BaseCatalog
+            Catalog.
+        """
+        index = cls.read_partition_index(dirname)
+        if index is None:
+            raise ValueError('No partition index found in %s' % dirname)
+        parts = index['parts']
+        if where is None: where = []
+        if isinstance(where,str) or callable(where): where = [where]
+        where = list(where)
+        if partitions is not None:
+            if np.ndim(partitions) == 0: partitions = [partitions]
+            partitions = set(str(partition) for partition in partitions)
+            parts = [part for part in parts if part['key'] in partitions]
+        if radecbox is not None:
+            ramin,ramax,decmin,decmax = radecbox
+            parts = [part for part in parts if 'radecbox' not in part or
+                    (part['radecbox'][0] <= ramax and part['radecbox'][1] >= ramin and part['radecbox'][2] <= decmax and part['radecbox'][3] >= decmin)]
+            where += ['ra >= %r' % ramin,'ra <= %r' % ramax,'dec >= %r' % decmin,'dec <= %r' % decmax]
+        logger.info('Reading %d/%d partitions of %s.',len(parts),len(index['parts']),dirname)
+
+        def read(fn):
+            tmp = cls(fn,lazy=True)
+            if where: tmp.cut(tmp.mask_where(where))
+            if columns is None:
+                tmp.load_columns()
+            else:
+                tmp.load_columns(*columns)
+                tmp.keep_columns(*columns)
+            return tmp
+
+        builder = CatalogBuilder(cls)
+        for tmp in utils.read_files(read,[os.path.join(dirname,part['fn']) for part in parts],nthreads=nthreads):
+            builder.append(tmp)
+        return builder.finalize()
+
+
+class CatalogBuilder(object):
+    """
+    Collect catalog chunks, to be concatenated once with :meth:`BaseCatalog.concatenate`.
+
+    Replaces ``cat += tmp`` accumulation, which copies all previous rows at each step.
+
+    Attributes
+    ----------
+    cls : type
+        Catalog class to build.
+
+    chunks : list
+        List of collected catalogs.
+    """
+
+    def __init__(self, cls=None):
+        """
+        Initialize :class:`CatalogBuilder`.
+
+        Parameters
+        ----------
+        cls : type, default=None
+            Catalog class to build. Defaults to type of first collected catalog.
+        """
+        self.cls = cls
+        self.chunks = []
+
+    def append(self, cat):
+        """Collect catalog ``cat``."""
+        if self.cls is None:
+            self.cls = cat.__class__
+        self.chunks.append(cat)
+
+    def __iadd__(self, cat):
+        """Collect catalog ``cat``: ``self += cat``."""
+        self.append(cat)
+        return self
+
+    def __len__(self):
+        """Total number of collected rows."""
+        return sum(len(cat) for cat in self.chunks)
+
+    def finalize(self):
+        """Return concatenated catalog."""
+        cls = self.cls or BaseCatalog
+        return cls.concatenate(self.chunks)
+
 
 class SimCatalog(BaseCatalog):
     """Extend :class:`BaseCatalog` with convenient methods for handling sources injected by **legacysim**."""
@@ -831,7 +1423,44 @@ class BrickCatalog(BaseCatalog):
         return bricknames
 
 
-class Versions(UserDict):
+class BaseFrozenDict(UserDict):
+    """
+    Immutable, hashable :class:`UserDict`, such that instances can be used as dictionary keys.
+    ``data`` should be set once for all in ``__init__``.
+    """
+
+    def __setitem__(self, key, item):
+        """Raise :class:`TypeError`, as ``self`` is immutable."""
+        raise TypeError('%s is immutable' % self.__class__.__name__)
+
+    def __delitem__(self, key):
+        """Raise :class:`TypeError`, as ``self`` is immutable."""
+        raise TypeError('%s is immutable' % self.__class__.__name__)
+
+    def copy(self):
+        """Return ``self``, as it is immutable."""
+        return self
+
+    def __hash__(self):
+        """Hash, independent of ``data`` order."""
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(frozenset(self.data.items()))
+        return self._hash
+
+    def __getstate__(self):
+        """Return state, without cached hash (string hashes are process-dependent)."""
+        state = self.__dict__.copy()
+        state.pop('_hash',None)
+        return state
+
+    def __setstate__(self, state):
+        """Set state."""
+        self.__dict__.update(state)
+
+
+class Versions(BaseFrozenDict):
     """Handle (module,version) mapping. No order relation."""
 
     def __init__(self, *args, **kwargs):
@@ -850,7 +1479,7 @@ class Versions(UserDict):
             args = args[0]
             self.data = {}
             if isinstance(args,(UserDict,dict)):
-                self.data = args
+                self.data = dict(args)
                 return
             if isinstance(args,str):
                 args = args.split(',')
@@ -880,7 +1509,7 @@ class Versions(UserDict):
         return bool(self.data)
 
 
-class Stages(UserDict):
+class Stages(BaseFrozenDict):
     """
     Handle (stage,versions) mapping. Keys sorted in :mod:`legacypipe.runbrick` chronological order.
 
@@ -945,10 +1574,7 @@ class Stages(UserDict):
 
     def without_versions(self):
         """Return copy with empty versions."""
-        key = self.keys()[-1]
-        toret = self.__class__({key:self.data[key]})
-        toret[key] = Versions()
-        return toret
+        return self.__class__({self.keys()[-1]:Versions()})
 
     def __repr__(self):
         """String representation."""
@@ -978,22 +1604,65 @@ class Stages(UserDict):
 
 
 class ListStages(UserList):
-    """Handle list of unique stages."""
+    """
+    Handle list of unique stages.
+
+    Attributes
+    ----------
+    _index : dict
+        (stages,index) mapping, for constant-time look-up.
+    """
 
     def __init__(self, args=None):
         """``args`` must be a list of stages."""
         self.data = []
+        self._index = {}
         if args is not None:
             for arg in args:
                 self.append(arg)
 
+    def __getstate__(self):
+        """Return state, without :attr:`_index` (rebuilt by :meth:`__setstate__`)."""
+        return {'data':self.data}
+
+    def __setstate__(self, state):
+        """Set state and rebuild :attr:`_index`."""
+        self.data = state['data']
+        self._reindex()
+
+    def _reindex(self):
+        """Rebuild :attr:`_index` from ``data``."""
+        self._index = {}
+        for istages,stages in enumerate(self.data):
+            self._index.setdefault(stages,istages)
+
     def append(self, *args, **kwargs):
         """Append stages, return current index."""
         new = Stages(*args, **kwargs)
-        if new not in self:
+        index = self._index.get(new,None)
+        if index is None:
+            index = self._index[new] = len(self.data)
             self.data.append(new)
-            return len(self) - 1
-        return self.index(new)
+        return index
+
+    def extend(self, other):
+        """Append all stages of ``other``."""
+        for stages in other:
+            self.append(stages)
+
+    def __iadd__(self, other):
+        """Append all stages of ``other``."""
+        self.extend(other)
+        return self
+
+    def clear(self):
+        """Remove all stages."""
+        self.data.clear()
+        self._index.clear()
+
+    def __contains__(self, stages):
+        """Is ``stages`` in ``self``?"""
+        return self.index(stages) >= 0
 
     def without_versions(self):
         """
@@ -1020,9 +1689,51 @@ class ListStages(UserList):
 
     def index(self, stages):
         """Return index of stages if in ``self``, else -1."""
-        if stages in self:
-            return self.data.index(stages)
-        return -1
+        if type(stages) is dict:
+            stages = Stages(stages)
+        try:
+            return self._index.get(stages,-1)
+        except TypeError: # unhashable
+            return -1
+
+    def __setitem__(self, i, item):
+        """Set item(s) and rebuild :attr:`_index`."""
+        if isinstance(i,slice):
+            self.data[i] = [Stages(stages) for stages in item]
+        else:
+            self.data[i] = Stages(item)
+        self._reindex()
+
+    def __delitem__(self, i):
+        """Delete item(s) and rebuild :attr:`_index`."""
+        del self.data[i]
+        self._reindex()
+
+    def insert(self, i, item):
+        """Insert stages and rebuild :attr:`_index`."""
+        self.data.insert(i,Stages(item))
+        self._reindex()
+
+    def pop(self, i=-1):
+        """Pop stages and rebuild :attr:`_index`."""
+        toret = self.data.pop(i)
+        self._reindex()
+        return toret
+
+    def remove(self, item):
+        """Remove stages and rebuild :attr:`_index`."""
+        self.data.remove(item)
+        self._reindex()
+
+    def reverse(self):
+        """Reverse in place and rebuild :attr:`_index`."""
+        self.data.reverse()
+        self._reindex()
+
+    def sort(self, *args, **kwargs):
+        """Sort in place and rebuild :attr:`_index`."""
+        self.data.sort(*args, **kwargs)
+        self._reindex()
 
     def match(self, other):
         """
@@ -1113,7 +1824,7 @@ class RunCatalog(BaseCatalog):
         return parser
 
     @staticmethod
-    def get_output_parser(parser=None, add_stages=False, add_filetype=False, add_source=False):
+    def get_output_parser(parser=None, add_stages=False, add_filetype=False, add_source=False, add_scan_cache=False):
         """
         Add parser arguments to reconstruct runs from **legacypipe** or **legacysim** file structure.
 
@@ -1131,6 +1842,9 @@ class RunCatalog(BaseCatalog):
         add_source : bool, default=False
             Add argument '--source'?
 
+        add_scan_cache : bool, default=False
+            Add argument '--scan-cache'?
+
         Returns
         -------
         parser : argparse.ArgumentParser
@@ -1147,6 +1861,8 @@ class RunCatalog(BaseCatalog):
             parser.add_argument('--filetype', type=str, default=None, help='File type to search for.')
         if add_source:
             parser.add_argument('--source', type=str, choices=['legacysim','legacypipe'], default='legacysim', help='legacypipe or legacysim file structure?')
+        if add_scan_cache:
+            parser.add_argument('--scan-cache', type=str, default=None, help='File name of directory listing cache, to speed up later explorations of the file structure')
         return parser
 
     @staticmethod
@@ -1280,7 +1996,8 @@ class RunCatalog(BaseCatalog):
         (default file type is 'tractor' except if 'stages' is not ``None``, in which case default is 'pickle').
 
         Else, explore the **legacyipe** or **legacysim** (default 'source') file structure to fill in the other command-line arguments;
-        and return new instance.
+        and return new instance. Directories are listed with 'nthreads' threads (default 1), and listings are cached in 'scan_cache'
+        (if provided), see :func:`utils.scan_files`.
 
         Parameters
         ----------
@@ -1351,12 +2068,10 @@ class RunCatalog(BaseCatalog):
             return toret
 
         if opt['brick'] is None:
-            fns = glob.iglob(template_search % dict(brick='*'))
+            patterns = [template_search % dict(brick='*')]
         else:
-            fns = []
-            for brickname in opt['brick']:
-                fns.append(glob.iglob(template_search % dict(brick=brickname)))
-            fns = itertools.chain(*fns) # chain iterators
+            patterns = [template_search % dict(brick=brickname) for brickname in opt['brick']]
+        fns = utils.scan_files(patterns,nthreads=opt.get('nthreads',None) or 1,cache_fn=opt.get('scan_cache',None))
 
         for fn in fns:
             decode = decode_output_fn(fn)
@@ -1380,6 +2095,20 @@ class RunCatalog(BaseCatalog):
         """Return fields."""
         return ['brickname'] + get_sim_id.keys() + ['stagesid']
 
+    def get_npy_state(self):
+        """Return JSON-serializable state written by :meth:`write_npy_dir`, including :attr:`_list_stages`."""
+        state = super(RunCatalog,self).get_npy_state()
+        state['list_stages'] = [str(stages) for stages in self.get_list_stages()]
+        return state
+
+    def set_npy_state(self, state):
+        """Set internals from ``state``, including :attr:`_list_stages`."""
+        super(RunCatalog,self).set_npy_state(state)
+        self._list_stages = ListStages()
+        for istages,stages in enumerate(state['list_stages']):
+            if self.append_stages(stages) != istages:
+                raise ValueError('Stage list is incorrect: stages %s are duplicated.' % stages)
+
     def get_list_stages(self):
         """Return :attr:`_list_stages`."""
         return self._list_stages
@@ -1408,14 +2137,23 @@ class RunCatalog(BaseCatalog):
         runcat = self.remove_duplicates(copy=copy)
         runcat.get_list_stages().clear()
 
-        uniqid = runcat.uniqid(fields=[field for field in runcat.fields if field != 'stagesid'])
-        stagesid_bak = runcat.stagesid
-        runcat.stagesid = runcat.zeros(dtype='i4')
-        for uid in uniqid:
-            mask = uniqid == uid
-            runcat.stagesid[mask] = runcat.append_stages(stagesid_bak[mask].tolist())
-
-        return runcat.remove_duplicates(fields=[field for field in runcat.fields if field != 'stagesid'])
+        fields = [field for field in runcat.fields if field != 'stagesid']
+        # groups of rows with same (brickname x sim id), in order of first appearance
+        inverse,counts = utils.unique_rows(utils.pack_columns([runcat.get(field) for field in fields]))[1:]
+        order = np.argsort(inverse,kind='stable')
+        bounds = np.concatenate([[0],np.cumsum(counts)])
+        stagesid_bak = np.asarray(runcat.stagesid)[order].tolist()
+        stagesid = np.empty(counts.size,dtype='i4')
+        interned = {}
+        for igroup in range(counts.size):
+            stages = stagesid_bak[bounds[igroup]:bounds[igroup+1]]
+            key = tuple(map(str,stages))
+            if key not in interned:
+                interned[key] = runcat.append_stages(stages)
+            stagesid[igroup] = interned[key]
+        runcat.stagesid = stagesid[inverse]
+
+        return runcat.remove_duplicates(fields=fields)
 
     def without_stage_versions(self, copy=False):
         """
@@ -1579,6 +2317,23 @@ class RunCatalog(BaseCatalog):
         other.stagesid = other_stagesid_bak
         self.remove_duplicates(copy=False)
 
+    @classmethod
+    def concatenate(cls, cats):
+        """Concatenate catalogs ``cats``, taking care to update the column ``stagesid``, and remove duplicate runs."""
+        cats = [cat for cat in cats if not isinstance(cat,int) and cat.fields]
+        new = super(RunCatalog,cls).concatenate(cats)
+        new._list_stages = ListStages()
+        if not cats:
+            return new
+        stagesids = []
+        for cat in cats:
+            stagesid = np.array(cat.stagesid)
+            for istages,stages in enumerate(cat.get_list_stages()):
+                stagesid[cat.stagesid == istages] = new.append_stages(stages)
+            stagesids.append(stagesid)
+        new.stagesid = np.concatenate(stagesids)
+        return new.remove_duplicates(copy=False)
+
     def replace_sim_id(self, copy=False, kwargs_simids=None):
         """
         Replace sim id by those in ``kwargs_simids``.
@@ -1621,6 +2376,33 @@ class RunCatalog(BaseCatalog):
             toret.stages = self._list_stages[toret.stagesid]
         return toret
 
+    def find_files(self, base_dir=None, filetype=None, source='legacysim', **kwargs):
+        """
+        Return list of file names for all runs, in the same order, see :func:`~legacysim.survey.find_files`.
+
+        Parameters
+        ----------
+        base_dir : string, default=None
+            **legacysim** (if ``source == 'legacysim'``) or legacypipe (if ``source == 'legacypipe'``) root file directory.
+
+        filetype : string, default=None
+            Type of file to find.
+
+        source : string, default='legacysim'
+            If 'legacysim', return **legacysim** output file names, else **legacypipe** file names.
+
+        kwargs : dict
+            Other arguments to file paths.
+
+        Returns
+        -------
+        fns : list
+            List of file names.
+        """
+        keys = get_sim_id.keys()
+        kwargs_simids = [dict(zip(keys,values)) for values in zip(*[self.get(key).tolist() for key in keys])]
+        return find_files(base_dir=base_dir,filetype=filetype,bricknames=self.brickname.tolist(),kwargs_simids=kwargs_simids,source=source,**kwargs)
+
     def iter_mask(self, cat, fields=None):
         """
         Yield boolean mask for the different runs in input catalog ``cat``.
@@ -1671,11 +2453,13 @@ class RunCatalog(BaseCatalog):
         else:
             runcat = self
         list_stages_bak = runcat.get_list_stages().copy()
-        stagesid_bak = runcat.stagesid.copy()
+        used = np.unique(runcat.stagesid)
         runcat._list_stages.clear()
-        for istages,stages in enumerate(list_stages_bak):
-            if np.any(stagesid_bak == istages):
-                runcat.stagesid[stagesid_bak == istages] = runcat.append_stages(stages)
+        if used.size:
+            lookup = np.full(max(used.max(),len(list_stages_bak)-1) + 1,-1,dtype=runcat.stagesid.dtype)
+            for istages in used:
+                lookup[istages] = runcat.append_stages(list_stages_bak[istages])
+            runcat.stagesid[...] = lookup[runcat.stagesid]
         return runcat
 
     def check(self):
@@ -1691,12 +2475,19 @@ class RunCatalog(BaseCatalog):
         Parameters
         ----------
         fn : string
-            Path to run list.
+            Path to run list. If it ends with '.npz', write binary run list
+            (one array per column and :meth:`get_npy_state`, including the stage table),
+            much faster to read back with :meth:`from_list`. Else, write text run list.
         """
         utils.mkdir(os.path.dirname(fn))
         runcat = self.remove_duplicates(copy=True).update_stages()
         runcat.check()
         logger.info('Writing %s to %s.',runcat.__class__.__name__,fn)
+        if fn.endswith('.npz'):
+            with open(fn,'wb') as file: # file object, such that numpy does not append .npz
+                np.savez(file,state=np.array(json.dumps(runcat.get_npy_state())),
+                         **{field:np.asarray(runcat.get(field)) for field in runcat.fields})
+            return
         with open(fn,'w') as file:
             for istages,stages in enumerate(runcat._list_stages):
                 file.write('#stages%d = %s\n' % (istages,stages))
@@ -1704,14 +2495,45 @@ class RunCatalog(BaseCatalog):
                 file.write('%s %s stages%d\n' % (run.brickname,get_sim_id(**run.kwargs_simid),run.stagesid))
 
     @classmethod
-    def from_list(cls, fns):
+    def _read_list(cls, fn):
+        """Read run list ``fn`` written by :meth:`write_list`, without removing duplicate runs."""
+        if fn.endswith('.npz'):
+            with np.load(fn,allow_pickle=False) as file:
+                state = json.loads(file['state'].item())
+                self = cls.from_dict({field:file[field] for field in state['fields']})
+            self.set_npy_state(state)
+            return self
+        with open(fn,'r') as file:
+            text = file.read()
+        self = cls()
+        for istages,(i,stages) in enumerate(re.findall('^#stages(.*?) = (.*?)\\r?$',text,flags=re.MULTILINE)):
+            if self.append_stages(Stages(stages)) != istages or int(i) != istages:
+                raise ValueError('Stage header is incorrect: stage ID (%s) does not match stage order (%d).' % (i,istages))
+        # parse all runs at once, then convert column-wise
+        simid = get_sim_id.template() % tuple('(-?\\d+)' for key in get_sim_id.keys())
+        runs = re.findall('^[ \\t]*([^#\\s]\\S*)[ \\t]+%s[ \\t]+stages(\\d+)[ \\t]*\\r?$' % simid,text,flags=re.MULTILINE)
+        nlines = len(re.findall('^[ \\t]*[^#\\s]',text,flags=re.MULTILINE))
+        if len(runs) != nlines:
+            raise ValueError('Issue with file %s: %d line(s) could not be parsed' % (fn,nlines - len(runs)))
+        columns = np.array(runs,dtype='U').reshape(len(runs),len(self.fields)).T
+        self.set('brickname',columns[0])
+        for field,column in zip(self.fields[1:],columns[1:]):
+            self.set(field,column.astype('i8'))
+        return self
+
+    @classmethod
+    def from_list(cls, fns, comm=None):
         """
         Initialize :class:`RunCatalog` from run list(s) in ``fns``.
 
         Parameters
         ----------
         fns : list, string
-            Path to run list. If multiple paths are provided, catalogs are appended (see :meth:`append`).
+            Path to run list. If multiple paths are provided, catalogs are concatenated (see :meth:`concatenate`).
+            Paths ending with '.npz' are read as binary run lists, see :meth:`write_list`.
+
+        comm : MPI communicator, default=None
+            If not ``None``, run list(s) are read by rank 0 only, then broadcast to the other ranks of ``comm``.
 
         Returns
         -------
@@ -1722,33 +2544,32 @@ class RunCatalog(BaseCatalog):
         ----
         Column ``stagesid`` can be modified, in particular if more than one run lists are provided.
         """
-        self = 0
+        if comm is not None:
+            state = None
+            if comm.rank == 0:
+                try:
+                    self = cls.from_list(fns)
+                    state = (self.get_npy_state(),{field:self.get(field) for field in self.fields})
+                except Exception as exc:
+                    # raise on all ranks, rather than leaving them waiting for the broadcast
+                    state = exc
+            state = comm.bcast(state,root=0)
+            if isinstance(state,Exception):
+                raise state
+            state,columns = state
+            if comm.rank != 0:
+                self = cls.from_dict(columns)
+                self.set_npy_state(state)
+            return self
+        cats = []
         if np.ndim(fns) == 0:
             fns = [fns]
         for fn in fns:
-            tmp = RunCatalog()
-            for field in tmp.fields: tmp.set(field,[])
-            with open(fn,'r') as file:
-                for line in file:
-                    match = re.match('#stages(?P<i>.*?) = (?P<s>.*?)$',line)
-                    if match is not None:
-                        stages = match.group('s')
-                        istages = tmp.append_stages(Stages(stages))
-                        i = int(match.group('i'))
-                        if istages != i:
-                            raise ValueError('Stage header is incorrect: stage ID (%d) does not match stage order (%d).' % (i,istages))
-                    else:
-                        brickname,simid,stages = line.split()
-                        tmp.get('brickname').append(brickname)
-                        tmp.get('stagesid').append(int(re.match('stages(?P<s>.*?)$',stages).group('s')))
-                        simid = get_sim_id.match(simid)
-                        for key in simid:
-                            tmp.get(key).append(simid[key])
-                tmp.to_np_arrays()
-                tmp.remove_duplicates(copy=False).update_stages()
-                try:
-                    tmp.check()
-                except ValueError:
-                    raise ValueError('Issue with file %s' % fn)
-            self += tmp
-        return self
+            tmp = cls._read_list(fn)
+            tmp.remove_duplicates(copy=False).update_stages()
+            try:
+                tmp.check()
+            except ValueError:
+                raise ValueError('Issue with file %s' % fn)
+            cats.append(tmp)
+        return cls.concatenate(cats)
@@ -98,7 +98,8 @@ class BaseSimImage(object):
             objstamp = GalSimStamp(tim)
 
         any_overlap = False
-        for obj in self.survey.injected:
+        fields = ['id','seed','ra','dec','sersic','shape_r','shape_e1','shape_e2','flux_%s' % objstamp.band]
+        for obj in self.survey.injected.iter_rows(fields=fields):
             t0 = Time()
             logger.info('%s drawing source id=%d, band=%s, seed=%d: flux=%.2g, sersic=%.2f, shape_r=%.2f, shape_e1=%.2f, shape_e2=%.2f',
                 objstamp.__class__.__name__,obj.id,objstamp.band,obj.seed,obj.get('flux_%s' % objstamp.band),obj.sersic,obj.shape_r,obj.shape_e1,obj.shape_e2)
@@ -424,7 +425,7 @@ class TractorSimStamp(BaseSimStamp):
 
         Parameters
         ----------
-        obj : SimCatalog row
+        obj : SimCatalog row, CatalogRow
             An object with attributes ``ra``, ``dec``, ``sersic``, ``shape_r``,
             ``shape_e1``, ``shape_e2``, ``'flux_%s' % self.band``.
 
@@ -510,7 +511,7 @@ class GalSimStamp(BaseSimStamp):
 
         Parameters
         ----------
-        obj : SimCatalog row
+        obj : SimCatalog row, CatalogRow
             An object with attributes ``ra``, ``dec``, ``sersic``, ``shape_r``,
             ``shape_e1``, ``shape_e2``, ``'flux_'+self.band``.
 
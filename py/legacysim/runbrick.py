@@ -215,14 +215,14 @@ def run_brick(opt, survey, **kwargs):
             from legacysim import find_file
             kwargs_simid = {**survey.kwargs_simid,**{'skipid':opt.skipid-1}}
             fn = find_file(base_dir=survey.output_dir,filetype='injected',brickname=opt.brick,source='legacysim',**kwargs_simid)
-            injected = SimCatalog(fn)
+            injected = SimCatalog(fn,lazy=True)
             injected.cut(injected.collided)
         else:
-            injected = SimCatalog(opt.injected_fn)
+            injected = SimCatalog(opt.injected_fn,lazy=True)
             injected.fill_legacysim(survey=survey,seed=opt.seed)
             injected.cut(injected.brickname == opt.brick)
             if opt.nobj >= 0:
-                injected = injected[opt.rowstart:opt.rowstart+opt.nobj]
+                injected = injected.view(slice(opt.rowstart,opt.rowstart+opt.nobj))
                 logger.info('Cutting to nobj = %d',opt.nobj)
         logger.info('SimCatalog size = %d',len(injected))
 
@@ -240,7 +240,7 @@ def run_brick(opt, survey, **kwargs):
     if ncollided > 0:
         logger.info('Found %d collisions! You will have to run runbrick.py with --skipid = %d.',ncollided,opt.skipid+1)
 
-    survey.injected = injected[mask_injected]
+    survey.injected = injected.view(mask_injected)
 
     if opt.sim_blobs:
         if not len(survey.injected):
@@ -9,8 +9,9 @@ For details, run::
 
 import argparse
 import logging
+import functools
 
-from astrometry.util.file import unpickle_from_file
+import numpy as np
 
 from legacysim import SimCatalog, RunCatalog, find_file, get_sim_id, utils, setup_logging
 
@@ -22,12 +23,18 @@ def main(args=None):
     """Check runs."""
     parser = argparse.ArgumentParser(description=main.__doc__,formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('--read', action='store_true', default=False,
-                        help='Try read file from disk?')
+                        help='Check files on disk are complete (FITS headers and data size, pickle framing)?')
+    parser.add_argument('--checksum', action='store_true', default=False,
+                        help='With --read, also verify FITS CHECKSUM/DATASUM keywords when present (reads all data)')
+    parser.add_argument('--nthreads', type=int, default=1,
+                        help='Number of threads (or processes, see --pool) to list output directories and check files with')
+    parser.add_argument('--pool', type=str, choices=['thread','process'], default='thread',
+                        help='Check files with a pool of threads or processes')
     runlist_template = 'runlist.txt'
     parser.add_argument('--write-list', nargs='?', type=str, default=False, const=True,
                         help='Write missing run list to file name. If file name is not provided, defaults to %s.' % runlist_template
                          + ' This run list can be used to instantiate RunCatalog through RunCatalog.from_list(), in order to iterate easily through the runs.')
-    parser = RunCatalog.get_output_parser(parser=parser,add_stages=True,add_filetype=True,add_source=True)
+    parser = RunCatalog.get_output_parser(parser=parser,add_stages=True,add_filetype=True,add_source=True,add_scan_cache=True)
     opt = parser.parse_args(args=utils.get_parser_args(args))
     for key,default in zip(get_sim_id.keys(),get_sim_id.default()):
         if getattr(opt,key,None) is None: setattr(opt,key,[default])
@@ -35,35 +42,37 @@ def main(args=None):
     RunCatalog.set_default_output_cmdline(opt)
     runoutput = RunCatalog.from_output_cmdline(opt,force_from_disk=True)
     if opt.read:
-        mask = runoutput.trues()
-        msg = 'File %s exists but yields OSError.'
-        for irun,run in enumerate(runoutput):
+        fns = []
+        for run in runoutput:
             if opt.filetype == 'pickle' and opt.pickle_pat is not None:
-                fn = opt.pickle_pat % dict(brick=run.brickname,ranid=get_sim_id(**run.kwargs_simid)) % run.stages[-1]
+                fns.append(opt.pickle_pat % dict(brick=run.brickname,ranid=get_sim_id(**run.kwargs_simid)) % run.stages[-1])
             else:
-                fn = find_file(base_dir=opt.output_dir,filetype=opt.filetype,brickname=run.brickname,
-                                source=opt.source,stage=run.stages.keys()[-1],**run.kwargs_simid)
-            try:
-                if opt.filetype == 'pickle':
-                    unpickle_from_file(fn)
-                else:
-                    SimCatalog(fn)
-            except OSError:
-                logger.info(msg,fn)
-                mask[irun] = False
+                fns.append(find_file(base_dir=opt.output_dir,filetype=opt.filetype,brickname=run.brickname,
+                                source=opt.source,stage=run.stages.keys()[-1],**run.kwargs_simid))
+
+        if opt.filetype == 'pickle':
+            read = utils.check_pickle_file
+        else:
+            read = functools.partial(utils.check_fits_file,checksum=opt.checksum)
+        mask = np.array(list(utils.read_files(read,fns,nthreads=opt.nthreads,pool=opt.pool)),dtype='?')
+        for fn in np.array(fns)[~mask]:
+            logger.info('File %s exists but is incomplete or corrupted.',fn)
         runoutput = runoutput[mask]
 
     mask = runinput.isin(runoutput,ignore_stage_version=True)
     # remove runs without injected sources.
     if opt.source == 'legacysim':
-        for irun,run in enumerate(runinput):
-            if not mask[irun]:
-                fn = find_file(opt.output_dir,'injected',brickname=run.brickname,source=opt.source,**run.kwargs_simid)
-                try:
-                    injected = SimCatalog(fn)
-                    if injected.size == 0: mask[irun] = True
-                except OSError:
-                    pass
+        indices = np.flatnonzero(~mask)
+        fns = [find_file(opt.output_dir,'injected',brickname=runinput.brickname[irun],source=opt.source,
+                         **{key:runinput.get(key)[irun] for key in get_sim_id.keys()}) for irun in indices]
+
+        def read(fn):
+            try:
+                return SimCatalog(fn,lazy=True).size == 0
+            except OSError:
+                return False
+
+        mask[indices] = list(utils.read_files(read,fns,nthreads=opt.nthreads))
 
     runinput = runinput[~mask]
     if mask.all():
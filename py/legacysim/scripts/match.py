@@ -43,8 +43,11 @@ def main(args=None):
     plot_scatter_base_template = 'scatter_output_input.png'
     parser.add_argument('--plot-scatter', nargs='?', type=str, default=False, const=True,
                         help='Scatter plot difference (output-input). If no filename provided, defaults to cat-dir/%s' % plot_scatter_base_template.replace('%','%%'))
+    parser.add_argument('--fields-input', type=str, nargs='*', default=None, help='Input fields to export (wildcards allowed), defaults to all')
+    parser.add_argument('--fields-output', type=str, nargs='*', default=None, help='Output fields to export (wildcards allowed), defaults to all')
+    parser.add_argument('--chunksize', type=int, default=None, help='If provided, write matched catalog by chunks of this number of rows')
     parser.add_argument('--plot-fields', type=str, nargs='*', default=['ra','dec','flux_g','flux_r','flux_z'], help='Fields to plot')
-    RunCatalog.get_output_parser(parser=parser)
+    RunCatalog.get_output_parser(parser=parser,add_scan_cache=True)
     opt = parser.parse_args(args=utils.get_parser_args(args))
 
     if any([getattr(opt,filetype) is None for filetype in ['injected','tractor','tractor_legacypipe']]):
@@ -73,7 +76,8 @@ def main(args=None):
 
     if opt.cat_fn is None:
         opt.cat_fn = os.path.join(opt.cat_dir,cat_matched_base % {'base':opt.base})
-    match.export(base=opt.base,key_input='input',key_output=None,write=True,cat_fn=opt.cat_fn)
+    match.export(base=opt.base,key_input='input',key_output=None,fields_input=opt.fields_input,fields_output=opt.fields_output,
+                write=True,chunksize=opt.chunksize,cat_fn=opt.cat_fn)
 
     if opt.plot_hist:
         if not isinstance(opt.plot_hist,str):
@@ -26,8 +26,19 @@ def main(args=None):
     cat_legacypipe_base_template = 'merged_%(filetype)s_legacypipe.fits'
     parser.add_argument('--cat-fn', type=str, default=None,
                         help='Output file name. If not provided, defaults to cat-dir/%s if source is legacypipe, \
-                        else cat-dir/%s.' % (cat_legacypipe_base_template.replace('%','%%'),cat_base_template.replace('%','%%')))
-    RunCatalog.get_output_parser(parser=parser,add_source=True,add_filetype=True)
+                        else cat-dir/%s. If ending with .npy, catalog is written as a directory of .npy files, \
+                        which can be memory-mapped.' % (cat_legacypipe_base_template.replace('%','%%'),cat_base_template.replace('%','%%')))
+    parser.add_argument('--partition-by', type=str, choices=['brick','healpix','simid'], default=None,
+                        help='If provided, output catalog is written as a directory of partitions (by brick name prefix, HEALPix pixel or sim id), \
+                        with a partition index used to read only the required partitions')
+    parser.add_argument('--nside', type=int, default=32, help='HEALPix resolution, if partition-by is healpix')
+    parser.add_argument('--keep-columns', nargs='*', type=str, default=None, help='Only read and merge these columns')
+    parser.add_argument('--where', nargs='*', type=str, default=None,
+                        help='Only merge rows satisfying these predicates, e.g. "brick_primary" "flux_g > 0"')
+    parser.add_argument('--incremental', action='store_true', default=False,
+                        help='Only read files that are new or modified since the last (incremental) merge, using a manifest saved next to the output file')
+    parser.add_argument('--nthreads', type=int, default=1, help='Number of threads to list output directories and read catalogs with')
+    RunCatalog.get_output_parser(parser=parser,add_source=True,add_filetype=True,add_scan_cache=True)
     opt = parser.parse_args(args=utils.get_parser_args(args))
     RunCatalog.set_default_output_cmdline(opt)
     runcat = RunCatalog.from_output_cmdline(opt)
@@ -35,7 +46,8 @@ def main(args=None):
         opt.cat_fn = os.path.join(opt.cat_dir,(cat_legacypipe_base_template if opt.source == 'legacypipe' else cat_base_template) % {'filetype':opt.filetype})
     merge = CatalogMerging(base_dir=opt.output_dir,runcat=runcat,source=opt.source)
     #for field in runcat.fields: print(field,runcat.get(field))
-    merge.merge(opt.filetype,cat_fn=opt.cat_fn,write=True)
+    merge.merge(opt.filetype,cat_fn=opt.cat_fn,keep_columns=opt.keep_columns,where=opt.where,write=True,incremental=opt.incremental,
+                partition_by=opt.partition_by,nside=opt.nside,nthreads=opt.nthreads)
 
 
 if __name__ == '__main__':
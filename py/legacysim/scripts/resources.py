@@ -28,7 +28,7 @@ def main(args=None):
     parser.add_argument('--plot-fn', type=str, default=None, help='Plot filename; \
                         if --do single, defaults to ps-filename + .png; \
                         else (--do summary), defaults to %s' % plot_summary_base)
-    RunCatalog.get_output_parser(parser=parser)
+    RunCatalog.get_output_parser(parser=parser,add_scan_cache=True)
     opt = parser.parse_args(args=utils.get_parser_args(args))
     runcat = RunCatalog.from_output_cmdline(opt)
 
@@ -24,10 +24,13 @@ def main(args=None,force_write=False):
     for key in get_sim_id.keys():
         parser.add_argument('--%s-out' % key, nargs='*', type=int, default=None, help='Write these %ss in run list.' % key)
     parser.add_argument('--modules', nargs='*', type=str, default=[], help='Read version of these modules in file headers (if files exist).')
+    parser.add_argument('--nthreads', type=int, default=1, help='Number of threads to list output directories and read file headers with')
+    parser.add_argument('--header-cache', type=str, default=None,
+                        help='JSON file to cache module versions read in file headers; only files modified since the last call are read again')
     parser.add_argument('--write-list', nargs='?', type=str, default=False, const=True,
-                        help='Write missing run list to file name. If file name is not provided, defaults to %s.' % runlist_template
+                        help='Write missing run list to file name (binary format if it ends with .npz). If file name is not provided, defaults to %s.' % runlist_template
                          + ' This run list can be used to instantiate RunCatalog through RunCatalog.from_list(), in order to iterate easily through the runs.')
-    RunCatalog.get_output_parser(parser=parser,add_source=True)
+    RunCatalog.get_output_parser(parser=parser,add_source=True,add_scan_cache=True)
     utils.get_parser_action_by_dest(parser,'source').default = 'legacypipe'
     opt = parser.parse_args(args=utils.get_parser_args(args))
     # if script called from command-line, write list; else, write only if --write-list is provided
@@ -42,10 +45,15 @@ def main(args=None,force_write=False):
     level = logging.root.level
     setup_logging('warning')
     if opt.modules:
-        for irun,run in enumerate(runcat):
-            environment = EnvironmentManager(base_dir=opt.output_dir,brickname=run.brickname,source=opt.source,kwargs_simid=run.kwargs_simid)
-            istages = runcat.append_stages(environment.get_stages_versions(opt.modules))
-            runcat.stagesid[irun] = istages
+        fns = runcat.find_files(base_dir=opt.output_dir,filetype=EnvironmentManager.default_filetype(opt.source),source=opt.source)
+        headers = EnvironmentManager.read_versions_headers(fns,nthreads=opt.nthreads,cache_fn=opt.header_cache)
+        # stages are computed once for each set of versions
+        istages = {}
+        for irun,header in enumerate(headers):
+            key = tuple(sorted(header.items()))
+            if key not in istages:
+                istages[key] = runcat.append_stages(EnvironmentManager(header=header).get_stages_versions(opt.modules))
+            runcat.stagesid[irun] = istages[key]
     setup_logging(level)
     # replace old ranids with new ones, if not None
     kwargs_simids = {key:getattr(opt,'%s_out' % key) for key in get_sim_id.keys()}
@@ -3,6 +3,7 @@
 import os
 import re
 import logging
+import functools
 
 from legacypipe.survey import LegacySurveyData
 from legacypipe.runs import DecamSurvey, NinetyPrimeMosaic
@@ -102,11 +103,81 @@ class get_sim_id(object):
         return {key: int(match.group(key)) for key in cls.keys()}
 
 
+def _find_file(base_dir=None, filetype=None, brickname=None, source='legacysim', **kwargs):
+    # build survey object to get file name, see find_file
+    if source == 'legacysim':
+        survey = LegacySurveySim(survey_dir=base_dir,output_dir=base_dir,kwargs_simid=get_sim_id.as_dict(**kwargs))
+    else:
+        survey = LegacySurveyData(survey_dir=base_dir,output_dir=base_dir)
+    kwargs = {key:val for key,val in kwargs.items() if key not in get_sim_id.keys()}
+    return survey.find_file(filetype,brick=brickname,output=False,**kwargs)
+
+
+# placeholders for brick name and sim ids, used to compile file name templates
+_template_placeholders = [('\x01\x02\x03\x04','brickname'),('\x01\x02\x03','brickpre')]\
+                        + [(chr(5 + ikey),key) for ikey,key in enumerate(get_sim_id.keys())]
+# (brickname, sim id) used to check compiled templates against direct calls
+_template_probes = [('0001p000',dict(zip(get_sim_id.keys(),[1,22,333]))),('3599m895',dict(zip(get_sim_id.keys(),[40,5,0])))]
+
+
+@functools.lru_cache(maxsize=None)
+def _get_file_template(base_dir, filetype, source, kwargs):
+    kwargs = dict(kwargs)
+    placeholders = {name:placeholder for placeholder,name in _template_placeholders}
+    fn = _find_file(base_dir=base_dir,filetype=filetype,brickname=placeholders['brickname'],source=source,
+                    **{key:placeholders[key] for key in get_sim_id.keys()},**kwargs)
+    if not isinstance(fn,str):
+        return None
+    template = fn.replace('{','{{').replace('}','}}')
+    for placeholder,name in _template_placeholders:
+        template = template.replace(placeholder,'{%s}' % name)
+    for brickname,kwargs_simid in _template_probes:
+        if template.format(brickname=brickname,brickpre=brickname[:3],**kwargs_simid)\
+            != _find_file(base_dir=base_dir,filetype=filetype,brickname=brickname,source=source,**kwargs_simid,**kwargs):
+            logger.debug('File name for filetype %s cannot be compiled into a template.',filetype)
+            return None
+    return template
+
+
+def get_file_template(base_dir=None, filetype=None, source='legacysim', **kwargs):
+    """
+    Return file name template, to be formatted with ``brickname``, ``brickpre`` (first 3 letters of brick name)
+    and :meth:`get_sim_id.keys`, e.g. ``template.format(brickname=brickname,brickpre=brickname[:3],**get_sim_id.as_dict(**kwargs_simid))``.
+
+    Templates are obtained once for each set of input arguments (by calling :func:`find_file` with placeholders) and cached.
+
+    Parameters
+    ----------
+    base_dir : string, default=None
+        **legacysim** (if ``source == 'legacysim'``) or legacypipe (if ``source == 'legacypipe'``) root file directory.
+
+    filetype : string, default=None
+        Type of file to find.
+
+    source : string, default='legacysim'
+        If 'legacysim', return an **legacysim** output file name template, else a **legacypipe** file name template.
+
+    kwargs : dict
+        Other arguments to file paths, except :meth:`get_sim_id.keys`.
+
+    Returns
+    -------
+    template : string, None
+        File name template, ``None`` if file name cannot be expressed as a template (e.g. list of files).
+    """
+    kwargs = tuple(sorted(kwargs.items()))
+    try:
+        hash(kwargs)
+    except TypeError:
+        return None
+    return _get_file_template(base_dir,filetype,source,kwargs)
+
+
 def find_file(base_dir=None, filetype=None, brickname=None, source='legacysim', **kwargs):
     """
     Return file name.
 
-    Shortcut to :meth:`LegacySurveySim.find_file`.
+    Shortcut to :meth:`LegacySurveySim.find_file`; file name templates are cached, see :func:`get_file_template`.
 
     base_dir : string, default=None
         **legacysim** (if ``source == 'legacysim'``) or legacypipe (if ``source == 'legacypipe'``) root file directory.
@@ -123,12 +194,51 @@ def find_file(base_dir=None, filetype=None, brickname=None, source='legacysim',
     kwargs : dict
         Other arguments to file paths (e.g. :meth:`get_sim_id.keys`).
     """
-    if source == 'legacysim':
-        survey = LegacySurveySim(survey_dir=base_dir,output_dir=base_dir,kwargs_simid=get_sim_id.as_dict(**kwargs))
-    else:
-        survey = LegacySurveyData(survey_dir=base_dir,output_dir=base_dir)
-    kwargs = {key:val for key,val in kwargs.items() if key not in get_sim_id.keys()}
-    return survey.find_file(filetype,brick=brickname,output=False,**kwargs)
+    if brickname is not None:
+        template = get_file_template(base_dir=base_dir,filetype=filetype,source=source,
+                                    **{key:val for key,val in kwargs.items() if key not in get_sim_id.keys()})
+        if template is not None:
+            return template.format(brickname=brickname,brickpre=brickname[:3],**get_sim_id.as_dict(**kwargs))
+    return _find_file(base_dir=base_dir,filetype=filetype,brickname=brickname,source=source,**kwargs)
+
+
+def find_files(base_dir=None, filetype=None, bricknames=None, kwargs_simids=None, source='legacysim', **kwargs):
+    """
+    Return list of file names, for each brick name and sim id.
+
+    Same as calling :func:`find_file` for each brick name and sim id, but the file name template is obtained once.
+
+    base_dir : string, default=None
+        **legacysim** (if ``source == 'legacysim'``) or legacypipe (if ``source == 'legacypipe'``) root file directory.
+
+    filetype : string, default=None
+        Type of file to find.
+
+    bricknames : list
+        List of brick names.
+
+    kwargs_simids : dict, list, default=None
+        Single or list (of the same length as ``bricknames``) of :class:`get_sim_id` dictionaries.
+
+    source : string, default='legacysim'
+        If 'legacysim', return **legacysim** output file names, else **legacypipe** file names.
+
+    kwargs : dict
+        Other arguments to file paths.
+
+    Returns
+    -------
+    fns : list
+        List of file names.
+    """
+    if kwargs_simids is None: kwargs_simids = {}
+    if isinstance(kwargs_simids,dict): kwargs_simids = [kwargs_simids]*len(bricknames)
+    template = get_file_template(base_dir=base_dir,filetype=filetype,source=source,**kwargs)
+    if template is None:
+        return [_find_file(base_dir=base_dir,filetype=filetype,brickname=brickname,source=source,**kwargs_simid,**kwargs)
+                for brickname,kwargs_simid in zip(bricknames,kwargs_simids)]
+    return [template.format(brickname=brickname,brickpre=brickname[:3],**get_sim_id.as_dict(**kwargs_simid))
+            for brickname,kwargs_simid in zip(bricknames,kwargs_simids)]
 
 
 def find_legacypipe_file(survey_dir, filetype, brickname=None, **kwargs):
@@ -2,10 +2,17 @@
 
 import os
 import sys
+import time
+import json
+import pickle
+import fnmatch
 import logging
 import functools
+import collections
+from concurrent import futures
 
 import numpy as np
+import fitsio
 from matplotlib import pyplot as plt
 from astrometry.libkd import spherematch
 
@@ -174,6 +181,278 @@ def mkdir(dirnm):
         return
 
 
+def get_file_stat(fn):
+    """
+    Return file size and modification time, used to detect file changes.
+
+    Parameters
+    ----------
+    fn : string
+        File name.
+
+    Returns
+    -------
+    stat : tuple, None
+        Size (in bytes) and modification time (in seconds since epoch), ``None`` if file does not exist.
+    """
+    try:
+        stat = os.stat(fn)
+    except OSError:
+        return None
+    return stat.st_size,stat.st_mtime
+
+
+def read_files(read, fns, nthreads=1, prefetch=None, pool='thread'):
+    """
+    Yield ``read(fn)`` for each file name ``fn`` in ``fns``, in the same order as ``fns``.
+
+    Files are read by a pool of ``nthreads`` threads, which overlaps file opening latencies
+    (e.g. on parallel file systems) as long as ``read`` releases the GIL (as :mod:`fitsio` does).
+    For CPU-bound ``read``, use a pool of processes instead.
+    Number of files and bytes read per second are logged at the end.
+
+    Parameters
+    ----------
+    read : callable
+        Function taking a file name as input.
+
+    fns : list
+        List of file names. Can also be other arguments to ``read``, in which case read bytes are not counted.
+
+    nthreads : int, default=1
+        Number of threads. If ``nthreads <= 1``, files are read sequentially, in the main thread.
+
+    prefetch : int, default=None
+        Maximum number of files read in advance of the consumer. Defaults to ``2*nthreads``.
+
+    pool : string, default='thread'
+        If 'thread', use a pool of threads; if 'process', a pool of processes
+        (``read`` and its outputs must then be picklable).
+
+    Returns
+    -------
+    results : iterator
+        Iterator over ``read(fn)``.
+    """
+    if pool not in ['thread','process']:
+        raise ValueError('Unknown pool %s, should be one of [thread, process]' % pool)
+    fns = list(fns)
+    if prefetch is None: prefetch = 2*nthreads
+    prefetch = max(prefetch,nthreads,1)
+    t0 = time.time()
+    nbytes = 0
+
+    def get_size(fn):
+        try:
+            return os.path.getsize(fn)
+        except (OSError,TypeError):
+            return 0
+
+    if nthreads <= 1:
+        for fn in fns:
+            result = read(fn)
+            nbytes += get_size(fn)
+            yield result
+    else:
+        Executor = futures.ThreadPoolExecutor if pool == 'thread' else futures.ProcessPoolExecutor
+        with Executor(max_workers=nthreads) as executor:
+            queue = collections.deque()
+            for fn in fns:
+                queue.append((fn,executor.submit(read,fn)))
+                if len(queue) >= prefetch:
+                    fn,future = queue.popleft()
+                    nbytes += get_size(fn)
+                    yield future.result()
+            while queue:
+                fn,future = queue.popleft()
+                nbytes += get_size(fn)
+                yield future.result()
+    dt = max(time.time() - t0,1e-9)
+    if fns:
+        logger.info('Read %d files (%.2f MB) in %.2f s with %d %s(s): %.1f files/s, %.2f MB/s.',
+                    len(fns),nbytes/1e6,dt,max(nthreads,1),pool if nthreads > 1 else 'thread',len(fns)/dt,nbytes/1e6/dt)
+
+
+def check_fits_file(fn, checksum=False, ext=1):
+    """
+    Check FITS file ``fn`` is complete, without reading data:
+    headers of all HDUs must be parsed, extension ``ext`` must exist and data (of size given by NAXIS1, NAXIS2, etc.) must fit in the file.
+
+    Parameters
+    ----------
+    fn : string
+        Path to FITS file.
+
+    checksum : bool, default=False
+        If ``True``, also verify CHECKSUM and DATASUM keywords, when present (this reads all data).
+
+    ext : int, string, default=1
+        Extension that must exist, e.g. the table of a catalog (as read by :class:`~legacysim.catalog.SimCatalog`).
+        A file truncated within a header is indeed seen as ending with the previous HDU.
+
+    Returns
+    -------
+    ok : bool
+        ``True`` if file is complete.
+    """
+    try:
+        size = os.path.getsize(fn)
+        with fitsio.FITS(fn) as file:
+            if ext not in file:
+                return False
+            for hdu in file:
+                if hdu.get_offsets()['data_end'] > size:
+                    return False
+                if checksum:
+                    header = hdu.read_header()
+                    if 'CHECKSUM' in header and 'DATASUM' in header:
+                        hdu.verify_checksum()
+    except (OSError,ValueError):
+        return False
+    return True
+
+
+def check_pickle_file(fn):
+    """
+    Check pickle file ``fn`` is complete, without unpickling it:
+    the protocol must be supported, the first frame (protocol >= 4) must fit in the file, and the file must end with the STOP opcode.
+
+    Parameters
+    ----------
+    fn : string
+        Path to pickle file.
+
+    Returns
+    -------
+    ok : bool
+        ``True`` if file is complete.
+    """
+    try:
+        size = os.path.getsize(fn)
+        with open(fn,'rb') as file:
+            head = file.read(11)
+            if size < 2:
+                return False
+            file.seek(-1,os.SEEK_END)
+            tail = file.read(1)
+    except OSError:
+        return False
+    if tail != pickle.STOP:
+        return False
+    if head[:1] == pickle.PROTO:
+        if head[1] > pickle.HIGHEST_PROTOCOL:
+            return False
+        if head[2:3] == pickle.FRAME:
+            if len(head) < 11 or 11 + int.from_bytes(head[3:11],'little') > size:
+                return False
+    return True
+
+
+def scan_files(patterns, nthreads=1, cache_fn=None):
+    """
+    Return file names matching glob pattern(s) ``patterns``, as :func:`glob.glob` would, and in the same order.
+
+    The file structure is explored level by level; directories of each level are listed in parallel with :func:`os.scandir`.
+    If ``cache_fn`` is provided, directory listings are saved in this JSON file with directory modification times,
+    such that only directories modified since the last call are listed again.
+
+    Parameters
+    ----------
+    patterns : string, list
+        Single glob pattern or list of glob patterns.
+
+    nthreads : int, default=1
+        Number of threads to list directories with.
+
+    cache_fn : string, default=None
+        If not ``None``, file name of the directory listing cache.
+
+    Returns
+    -------
+    fns : list
+        List of file names.
+    """
+    if isinstance(patterns,str): patterns = [patterns]
+    t0 = time.time()
+    cache = {}
+    if cache_fn is not None and os.path.isfile(cache_fn):
+        try:
+            with open(cache_fn,'r') as file:
+                cache = json.load(file)
+        except ValueError:
+            logger.warning('Cannot read directory listing cache %s, ignoring it.',cache_fn)
+    listings = {}
+    nlisted = collections.Counter()
+
+    def has_magic(name):
+        return any(char in name for char in '*?[')
+
+    def listdir(dirname):
+        if dirname in listings:
+            return listings[dirname][2]
+        try:
+            mtime = os.stat(dirname or os.curdir).st_mtime
+        except OSError:
+            return []
+        cached = cache.get(dirname,None)
+        # listings made less than 1 second after the last modification may be incomplete, given mtime resolution
+        if cached is not None and cached[0] == mtime and mtime < cached[1] - 1.:
+            listings[dirname] = cached
+        else:
+            scantime = time.time()
+            try:
+                with os.scandir(dirname or os.curdir) as it:
+                    names = [entry.name for entry in it]
+            except OSError:
+                names = []
+            listings[dirname] = [mtime,scantime,names]
+            nlisted['listed'] += 1
+        return listings[dirname][2]
+
+    def map_listdir(dirnames):
+        dirnames = [dirname for dirname in dict.fromkeys(dirnames) if dirname not in listings]
+        if nthreads > 1 and len(dirnames) > 1:
+            with futures.ThreadPoolExecutor(max_workers=nthreads) as pool:
+                list(pool.map(listdir,dirnames))
+        else:
+            for dirname in dirnames: listdir(dirname)
+
+    fns = []
+    for pattern in patterns:
+        components = pattern.split(os.sep)
+        # start from the longest path without wildcards
+        istart = 0
+        while istart < len(components) - 1 and not has_magic(components[istart]):
+            istart += 1
+        base = os.sep.join(components[:istart])
+        if not base and pattern.startswith(os.sep): base = os.sep
+        paths = [base]
+        for component in components[istart:]:
+            map_listdir(paths)
+            matches = []
+            for dirname in paths:
+                names = listdir(dirname)
+                if has_magic(component):
+                    if not component.startswith('.'):
+                        names = [name for name in names if not name.startswith('.')]
+                    names = fnmatch.filter(names,component)
+                else:
+                    names = [component] if component in names else []
+                matches += [os.path.join(dirname,name) for name in names]
+            paths = matches
+        fns += paths
+
+    if cache_fn is not None:
+        cache.update(listings)
+        mkdir(os.path.dirname(cache_fn))
+        with open(cache_fn + '.tmp','w') as file:
+            json.dump(cache,file)
+        os.replace(cache_fn + '.tmp',cache_fn)
+    logger.info('Found %d files in %d directories (%d listed) in %.2f s with %d thread(s).',
+                len(fns),len(listings),nlisted['listed'],time.time() - t0,max(nthreads,1))
+    return fns
+
+
 def get_parser_args(args=None):
     """
     Transform args (``None``, ``str``, ``list``, ``dict``) to parser-compatible (list of strings) args.
@@ -356,6 +635,50 @@ def match_radec(ra1, dec1, ra2, dec2, radius_in_degree=None, return_distance=Fal
     return index1, index2
 
 
+def select_nearest(index1, index2, distance, radius_in_degree=None, groups=None):
+    """
+    Select nearest matches among candidate pairs, typically obtained with :func:`match_radec` and ``nearest == False``.
+
+    Parameters
+    ----------
+    index1 : array-like
+        Indices of ra1,dec1 matching points.
+
+    index2 : array-like
+        Indices of ra2,dec2 matching points.
+
+    distance : array-like
+        Distance (degree).
+
+    radius_in_degree : float, default=None
+        If not None, maximum radius (degree) to match ra, dec pairs.
+
+    groups : array-like, default=None
+        If not ``None``, group label of each pair; the nearest match of each point in (ra1,dec1) is selected within each group.
+
+    Returns
+    -------
+    index1 : ndarray
+        Indices of ra1,dec1 matching points, sorted by increasing (group,) index.
+
+    index2 : ndarray
+        Indices of ra2,dec2 matching points.
+
+    distance : ndarray
+        Distance (degree).
+    """
+    index1,index2,distance = np.asarray(index1),np.asarray(index2),np.asarray(distance)
+    groups = np.zeros_like(index1) if groups is None else np.asarray(groups)
+    if radius_in_degree is not None:
+        mask = distance<radius_in_degree
+        index1,index2,distance,groups = index1[mask],index2[mask],distance[mask],groups[mask]
+    argsort = np.lexsort((distance,index1,groups))
+    index1,index2,distance,groups = index1[argsort],index2[argsort],distance[argsort],groups[argsort]
+    mask = np.ones(index1.size,dtype=np.bool_)
+    mask[1:] = (index1[1:] != index1[:-1]) | (groups[1:] != groups[:-1])
+    return index1[mask],index2[mask],distance[mask]
+
+
 def mask_collisions(ra, dec, radius_in_degree=5./3600.):
     """
     Return mask of collided objects.
@@ -418,6 +741,69 @@ def get_radecbox_area(ramin, ramax, decmin, decmax):
     return area
 
 
+def radec_to_healpix(ra, dec, nside):
+    """
+    Return HEALPix pixel (nested scheme) of ra, dec positions, following the HEALPix (Gorski et al. 2005) ang2pix algorithm.
+
+    Parameters
+    ----------
+    ra : array-like
+        Right ascension (degree).
+
+    dec : array-like
+        Declination (degree).
+
+    nside : int
+        HEALPix resolution, must be a power of 2.
+
+    Returns
+    -------
+    pix : ndarray
+        HEALPix pixels.
+    """
+    nside = int(nside)
+    if nside < 1 or (nside & (nside - 1)):
+        raise ValueError('nside = %d is not a power of 2' % nside)
+    ra,dec = np.broadcast_arrays(np.asarray(ra,dtype='f8'),np.asarray(dec,dtype='f8'))
+    shape = ra.shape
+    z = np.sin(np.deg2rad(dec.ravel()))
+    za = np.abs(z)
+    tt = np.mod(ra.ravel(),360.)/90.
+    tt[tt >= 4.] = 0. # in [0,4)
+    face,ix,iy = (np.empty(z.shape,dtype='i8') for i in range(3))
+    # equatorial region
+    mask = za <= 2./3.
+    temp1 = nside*(0.5 + tt[mask])
+    temp2 = nside*z[mask]*0.75
+    jp = (temp1 - temp2).astype('i8')
+    jm = (temp1 + temp2).astype('i8')
+    ifp,ifm = jp//nside,jm//nside
+    face[mask] = np.where(ifp == ifm,ifp | 4,np.where(ifp < ifm,ifp,ifm + 8))
+    ix[mask] = jm & (nside - 1)
+    iy[mask] = nside - (jp & (nside - 1)) - 1
+    # polar caps
+    mask = ~mask
+    ntt = np.minimum(tt[mask].astype('i8'),3)
+    tp = tt[mask] - ntt
+    tmp = nside*np.sqrt(3.*(1. - za[mask]))
+    jp = np.minimum((tp*tmp).astype('i8'),nside - 1)
+    jm = np.minimum(((1. - tp)*tmp).astype('i8'),nside - 1)
+    north = z[mask] >= 0
+    face[mask] = np.where(north,ntt,ntt + 8)
+    ix[mask] = np.where(north,nside - jm - 1,jp)
+    iy[mask] = np.where(north,nside - jp - 1,jm)
+
+    def spread_bits(x):
+        # interleave bits of x with zeros
+        x = x.astype('u8')
+        for shift,magic in [(16,0x0000FFFF0000FFFF),(8,0x00FF00FF00FF00FF),(4,0x0F0F0F0F0F0F0F0F),(2,0x3333333333333333),(1,0x5555555555555555)]:
+            x = (x | (x << np.uint64(shift))) & np.uint64(magic)
+        return x
+
+    pix = face.astype('u8')*np.uint64(nside**2) + spread_bits(ix) + (spread_bits(iy) << np.uint64(1))
+    return pix.astype('i8').reshape(shape)
+
+
 def get_shape_e(ba):
     """
     Return ellipticity ``e`` given minor-to-major axis ratio ``ba``.
@@ -604,3 +990,98 @@ def match_id(id1,id2):
     ind1 = np.flatnonzero(sortright2-sortleft2 > 0)
 
     return sort1[ind1], sort2[ind2]
+
+
+def pack_columns(columns, dtypes=None):
+    """
+    Pack columns into one fixed-width byte key per row.
+
+    Two rows have the same key if and only if their values are equal in all columns.
+    Floating-point columns are canonicalized: -0. and 0. give the same key, as do all NaNs.
+
+    Parameters
+    ----------
+    columns : list
+        List of arrays, all with the same length.
+
+    dtypes : list, default=None
+        Type each column is cast to before packing, e.g. to compare columns of two catalogs with different string widths.
+        If ``None``, use column types. Object columns are first converted to arrays (e.g. of strings),
+        whose type is used if the provided type is object.
+
+    Returns
+    -------
+    keys : ndarray
+        ``uint8`` array of shape ``(size, width)``.
+    """
+    columns = [np.asarray(column) for column in columns]
+    if dtypes is None:
+        dtypes = [column.dtype for column in columns]
+    size = len(columns[0]) if columns else 0
+    descr = []
+    for icol,(column,dtype) in enumerate(zip(columns,dtypes)):
+        dtype = np.dtype(dtype)
+        if column.dtype.kind == 'O':
+            columns[icol] = column = np.array(column.tolist())
+        if dtype.kind == 'O':
+            dtype = column.dtype
+        descr.append(('f%d' % icol,dtype.newbyteorder('='),column.shape[1:]))
+    rows = np.empty(size,dtype=descr)
+    for icol,(name,dtype,shape) in enumerate(descr):
+        rows[name] = columns[icol]
+        if dtype.kind in ['f','c']:
+            rows[name] += 0.
+            rows[name][np.isnan(rows[name])] = np.nan
+    return rows.view(np.uint8).reshape(size,rows.dtype.itemsize)
+
+
+def unique_rows(keys):
+    """
+    Find unique rows of ``keys``, as returned by :func:`pack_columns`.
+
+    Rows are grouped by 64-bit hashes; in case of hash collision, rows are grouped by their full keys.
+
+    Parameters
+    ----------
+    keys : array-like
+        ``uint8`` array of shape ``(size, width)``.
+
+    Returns
+    -------
+    index : ndarray
+        Index of the first occurrence of each unique row, sorted by increasing index.
+
+    inverse : ndarray
+        Index in ``index`` of each row.
+
+    counts : ndarray
+        Number of occurrences of each unique row.
+    """
+    keys = np.asarray(keys,dtype=np.uint8)
+    size,width = keys.shape
+    nwords = (width + 7)//8
+    keys = np.ascontiguousarray(np.pad(keys,((0,0),(0,8*nwords-width))))
+    exact = nwords <= 1
+    if nwords == 0:
+        hashes = np.zeros(size,dtype=np.uint64)
+    elif exact:
+        hashes = keys.view(np.uint64)[:,0]
+    else:
+        # combine words with splitmix64 finalizer, wrapping around 2**64
+        words = keys.view(np.uint64)
+        hashes = np.full(size,0xcbf29ce484222325,dtype=np.uint64)
+        for iword in range(nwords):
+            hashes ^= words[:,iword]
+            hashes ^= hashes >> np.uint64(30)
+            hashes *= np.uint64(0xbf58476d1ce4e5b9)
+            hashes ^= hashes >> np.uint64(27)
+            hashes *= np.uint64(0x94d049bb133111eb)
+            hashes ^= hashes >> np.uint64(31)
+    index,inverse,counts = np.unique(hashes,return_index=True,return_inverse=True,return_counts=True)[1:]
+    if not exact and not np.all(keys[index[inverse]] == keys):
+        logger.debug('Hash collision, grouping rows by full keys.')
+        index,inverse,counts = np.unique(keys.view('V%d' % keys.shape[1]).ravel(),return_index=True,return_inverse=True,return_counts=True)[1:]
+    order = np.argsort(index)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.size)
+    return index[order],rank[inverse.ravel()],counts[order]
@@ -6,7 +6,7 @@ from matplotlib import pyplot as plt
 from legacypipe import runbrick as lprunbrick
 
 from legacysim import setup_logging, runbrick, SimCatalog, RunCatalog, get_sim_id, find_file, utils
-from legacysim.analysis import ImageAnalysis
+from legacysim.analysis import ImageAnalysis, CatalogMatching
 from legacysim.scripts import check, merge, match, resources, cutout
 from test_runbrick import generate_injected
 
@@ -58,6 +58,8 @@ def test_check():
                         {'outdir':legacypipe_dir,'source':'legacypipe'},
                         {'read':''},
                         {'stages':['fitblobs','writecat'],'read':''},
+                        {'read':'','nthreads':2},
+                        {'read':'','checksum':'','pool':'process','nthreads':2},
                         {'brick':'2447p121'},
                         {'brick':bricklist_fn},
                         {'fileid':3},
@@ -88,7 +90,12 @@ def test_merge():
     base_kwargs = {'outdir':output_dir,'cat-dir':os.path.join(output_dir,'merged'),'fileid':0,'skipid':0,'rowstart':0}
     for extra_kwargs in [{'outdir':legacypipe_dir,'source':'legacypipe','filetype':'tractor'},
                         {'source':'legacysim','filetype':'tractor'},
+                        {'source':'legacysim','filetype':'tractor','cat-fn':os.path.join(base_kwargs['cat-dir'],'merged_tractor_nthreads.fits'),'nthreads':2},
                         {'filetype':'injected','cat-fn':os.path.join(base_kwargs['cat-dir'],'merged_injected.fits')},
+                        {'filetype':'injected','cat-fn':os.path.join(base_kwargs['cat-dir'],'merged_injected_where.fits'),
+                        'keep-columns':['ra','dec','flux_g'],'where':['flux_g>0.1']},
+                        {'filetype':'tractor','cat-fn':os.path.join(base_kwargs['cat-dir'],'merged_tractor_incremental.fits'),'incremental':''},
+                        {'filetype':'tractor','cat-fn':os.path.join(base_kwargs['cat-dir'],'merged_tractor_incremental.fits'),'incremental':''},
                         ]:
         all_kwargs = {**base_kwargs,**extra_kwargs}
         merge.main(all_kwargs)
@@ -105,10 +112,28 @@ def test_merge():
                                         source=source,brickname=brickname,**get_sim_id.as_dict(**all_kwargs)))
         if filetype == 'injected':
             origin.cut(~origin.collided)
+        if 'where' in all_kwargs:
+            origin.cut(origin.flux_g > 0.1)
+            origin.keep_columns(*all_kwargs['keep-columns'])
+            assert set(merged.fields) == set(origin.fields)
         assert merged.size == origin.size
         for field in origin.fields:
             assert np.all(merged.get(field) == origin.get(field))
 
+    # incremental merge after an input file is modified gives the same catalog as a full merge
+    incremental_kwargs = {**base_kwargs,'filetype':'tractor','cat-fn':os.path.join(base_kwargs['cat-dir'],'merged_tractor_incremental.fits'),'incremental':''}
+    full_kwargs = {**base_kwargs,'filetype':'tractor','cat-fn':os.path.join(base_kwargs['cat-dir'],'merged_tractor_full.fits')}
+    fn = find_file(base_dir=output_dir,filetype='tractor',source='legacysim',brickname=brickname,**get_sim_id.as_dict(**base_kwargs))
+    origin = SimCatalog(fn)
+    try:
+        origin[:origin.size//2].writeto(fn)
+        merge.main(incremental_kwargs)
+        merge.main(full_kwargs)
+        merged = SimCatalog(incremental_kwargs['cat-fn'])
+        assert merged.size == origin.size//2 and merged == SimCatalog(full_kwargs['cat-fn'])
+    finally:
+        origin.writeto(fn)
+
 
 def test_match():
 
@@ -125,6 +150,7 @@ def test_match():
                         {'base':'inter','radius':5.},
                         {'base':'extra'},
                         {'base':'all'},
+                        {'base':'all','chunksize':2},
                         {'plot-hist':''},
                         {'plot-scatter':''}]:
         all_kwargs = {**base_kwargs,**extra_kwargs}
@@ -186,6 +212,39 @@ def test_match():
             if not fn: fn = os.path.join(all_kwargs['cat-dir'],'scatter_output_input.png')
             assert os.path.isfile(fn)
 
+    runcat = RunCatalog.from_output_cmdline({'output_dir':output_dir})
+    radii = [0.5/3600.,1.5/3600.,5./3600.]
+    multi = CatalogMatching(base_dir=output_dir,runcat=runcat)
+    multi.match(radius_in_degree=radii)
+    assert len(multi.matches) == len(radii)
+    for radius,matches in zip(radii,multi.matches):
+        single = CatalogMatching(base_dir=output_dir,runcat=runcat)
+        single.match(radius_in_degree=radius)
+        for key,val in matches.items():
+            if key.startswith('distance'):
+                assert np.allclose(val,single.get(key))
+            else:
+                assert np.all(val == single.get(key))
+    multi.set_radius(radii[0])
+    assert np.all(multi.inter_input == multi.matches[0]['inter_input'])
+    for base in ['input','output','inter','extra','all']:
+        cat = multi.export(base=base,fields_input=['flux_*','ra','dec'],fields_output=['flux_*'])
+        assert set(cat.fields) == set(['input_%s' % field for field in ['flux_g','flux_r','flux_z','ra','dec']]
+                                    + ['flux_g','flux_r','flux_z','distance','matched','injected'])
+        fn = os.path.join(output_dir,'merged','matched_chunks.fits')
+        assert multi.export(base=base,write=True,chunksize=3,cat_fn=fn) is None
+        fn_ref = os.path.join(output_dir,'merged','matched_ref.fits')
+        multi.export(base=base,write=True,cat_fn=fn_ref)
+        assert SimCatalog(fn) == SimCatalog(fn_ref)
+    save_fn = os.path.join(output_dir,'merged','matching')
+    multi.save(save_fn)
+    loaded = CatalogMatching.load(save_fn)
+    assert 'input' not in loaded.__dict__ and loaded.runcat == multi.runcat
+    for matches,matches_loaded in zip(multi.matches,loaded.matches):
+        for key,val in matches.items():
+            assert np.all(matches_loaded[key] == val)
+    assert loaded.input.size == multi.input.size
+
 
 def test_resources():
 
@@ -2,6 +2,9 @@ import os
 import io
 import sys
 import shutil
+import json
+import pickle
+import tempfile
 import importlib
 
 import numpy as np
@@ -12,7 +15,8 @@ from legacypipe import runbrick as lprunbrick
 
 from legacysim import setup_logging, runbrick, SimCatalog, RunCatalog, find_file, utils
 from legacysim.catalog import ListStages, Stages
-from legacysim.batch import TaskManager, EnvironmentManager, environment_manager, run_shell, get_pythonpath
+from legacysim.batch import TaskManager, RunLedger, RunCostModel, EnvironmentManager, environment_manager, run_shell, get_pythonpath
+from legacysim.batch.mpi_task_manager import MPITaskManager, get_task_key
 from legacysim.scripts import runlist
 
 
@@ -29,6 +33,112 @@ def test_task_manager():
         assert li == lit
         li = tm.map(lambda i: i+1,lit)
         assert li == list(range(1,len(lit)+1))
+    with pytest.raises(TypeError):
+        TaskManager(ntasks=1,ledgr=None)
+    with TaskManager(ntasks=1,chunksize=4,prefetch=2,share_tasks=True) as tm:
+        assert tm.map(lambda i: i+1,lit) == list(range(1,len(lit)+1))
+        # most expensive tasks first, results in input order
+        assert list(tm.iterate(lit,costs=lit)) == lit[::-1]
+        li = []
+        assert tm.map(lambda i: li.append(i) or i+1,lit,costs=lambda tasks: np.array(tasks) % 3) == list(range(1,len(lit)+1))
+        assert li == [2,5,8,1,4,7,0,3,6,9]
+        assert sorted(tm.imap(lambda i: i+1,lit,costs=lit))[::-1] == list(tm.imap(lambda i: i+1,lit,costs=lit))
+        results = {}
+        assert tm.map(lambda i: i+1,lit,callback=results.__setitem__) is None and results == {i:i+1 for i in lit}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            save_fn = os.path.join(tmp_dir,'results','result_%d.pkl')
+            tm.map(lambda i: i+1,lit,save_fn=save_fn)
+            with open(save_fn % 3,'rb') as file:
+                assert pickle.load(file) == 4
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        runcat = RunCatalog.from_brick_sim_id(bricknames=['1588p560','1589p560'],kwargs_simids=[dict(fileid=0,rowstart=0,skipid=0),dict(fileid=1,rowstart=0,skipid=0)])
+        with RunLedger(os.path.join(tmp_dir,'ledger.sqlite')) as ledger:
+            ledger.add_runs(runcat)
+            assert ledger.count('pending') == runcat.size and ledger.get_runs() == runcat
+            with TaskManager(ntasks=1,ledger=ledger) as tm:
+                for irun,run in enumerate(tm.iterate(ledger.get_runs('pending'))):
+                    if irun == 0: ledger.finish(run,exitcode=2)
+            assert ledger.count('done') == runcat.size - 1
+            info = ledger.get_info(runcat[0])
+            assert info['status'] == 'failed' and info['attempts'] == 1 and info['exitcode'] == 2
+            fn = os.path.join(tmp_dir,'runlist.txt')
+            ledger.export_list(fn)
+            assert RunCatalog.from_list(fn) == runcat[:1]
+            ledger.import_list(fn,reset=True)
+            assert ledger.count('pending') == 1 and ledger.count() == runcat.size
+
+        # journal of MPITaskManager
+        assert get_task_key(runcat[1]) == '1588p560 fileid=1 rowstart=0 skipid=0'
+        assert get_task_key((1,'a')) == repr((1,'a'))
+        journal = os.path.join(tmp_dir,'journal.txt')
+        assert MPITaskManager._read_journal(journal) == set()
+        with open(journal,'w') as file:
+            for key,status in zip(['a','b','c'],['done','failed','done']):
+                file.write(json.dumps({'task':key,'status':status,'worker':1}) + '\n')
+            file.write('{"task": "d", "sta') # truncated by a crash
+        assert MPITaskManager._read_journal(journal) == {'a','c'}
+
+        injected = SimCatalog()
+        injected.brickname = np.array(['1588p560']*4 + ['1589p560']*2)
+        model = RunCostModel(injected=injected,nobj=3)
+        assert np.allclose(model(runcat),0.1*np.array([3,3,2,2]))
+        walltimes = runcat[:2].copy()
+        walltimes.walltime = np.array([10.,20.])
+        model = RunCostModel(injected=injected,walltimes=walltimes)
+        costs = model(runcat)
+        assert np.allclose(costs[:2],walltimes.walltime)
+        with TaskManager(ntasks=1) as tm:
+            assert tm.map(lambda run: run.brickname,runcat,costs=model) == list(runcat.brickname)
+
+    class FakeComm(object):
+        # workers computing tasks as soon as the root sends them, to test task distribution without MPI
+        rank,size = 0,3
+
+        def __init__(self, function):
+            self.function = function
+            self.messages = [(rank,MPITaskManager.tags.READY,'host') for rank in [1,2]]
+            self.computed = []
+
+        def recv(self, source=None, tag=None, status=None):
+            source,tag,data = self.messages.pop(0)
+            status.Set_source(source)
+            status.Set_tag(tag)
+            return data
+
+        def isend(self, data, dest=None, tag=None):
+            from mpi4py import MPI
+            if tag == MPITaskManager.tags.START:
+                for tasknum,task in data:
+                    self.computed.append((dest,task))
+                    try:
+                        self.messages.append((dest,MPITaskManager.tags.DONE,[tasknum,self.function(dest,task)]))
+                    except ValueError as exc:
+                        self.messages.append((dest,MPITaskManager.tags.FAILED,[tasknum,str(exc)]))
+                self.messages.append((dest,MPITaskManager.tags.READY,'host'))
+            else:
+                self.messages.append((dest,MPITaskManager.tags.EXIT,None))
+            return MPI.REQUEST_NULL
+
+        def bcast(self, data, root=0):
+            return data
+
+    def function(rank, task):
+        if task == 0 and rank == 1 or task == 3:
+            raise ValueError('task %d failed on rank %d' % (task,rank))
+        return task + 1
+
+    comm = FakeComm(function)
+    tm = MPITaskManager(comm=comm,chunksize=2,retries=1)
+    tm.workers,tm.worker_ranks = 2,[1,2]
+    results = dict(tm._distribute_tasks(list(range(6))))
+    assert results == {task:task + 1 for task in range(6) if task != 3}
+    assert list(tm.failed) == [3] and comm.computed.count((2,0)) == 1 and len(comm.computed) == 8
+    # stopping imap early on root still has all tasks computed
+    tm.basecomm = comm = FakeComm(function)
+    for tasknum,result in tm.imap(function,list(range(6))):
+        break
+    assert list(tm.failed) == [3] and len(comm.computed) == 8
 
 
 def test_environment_manager_runlist():
@@ -252,6 +362,10 @@ def test_environment_manager_runlist():
         runcat = runlist.main(['--outdir',legacypipe_dir[run],'--modules'] + modules)
         assert runcat is not None
         assert not os.path.exists(list_fn)
+        cache_fn = os.path.join(output_dirs[3],'headers.json')
+        for i in range(2):
+            assert runlist.main(['--outdir',legacypipe_dir[run],'--header-cache',cache_fn,'--nthreads',2,'--modules'] + modules) == runcat
+        assert os.path.isfile(cache_fn)
         list_fn = os.path.join(output_dirs[3],'runlist.txt')
         run_shell(['python',runlist.__file__] + ['--outdir',output_dirs[0],'--source','legacysim','--write-list',list_fn,'--modules'] + modules)
         runcat2 = RunCatalog.from_list(list_fn)
@@ -2,11 +2,12 @@ import os
 import tempfile
 import logging
 import argparse
+import pickle
 
 import numpy as np
 import pytest
 
-from legacysim import setup_logging, BaseCatalog, SimCatalog, BrickCatalog, RunCatalog, get_sim_id, find_file, utils
+from legacysim import setup_logging, BaseCatalog, SimCatalog, BrickCatalog, RunCatalog, CatalogBuilder, get_sim_id, find_file, utils
 from legacysim.catalog import Versions, Stages, ListStages
 
 
@@ -38,6 +39,30 @@ def test_base():
         fn = os.path.join(tmp_dir,'tmp.fits')
         cat.writeto(fn)
         cat2 = BaseCatalog(fn)
+        cat3 = BaseCatalog(fn,lazy=True)
+        assert cat3.fields == cat.fields and cat3.size == cat.size
+        cat3.cut(mask)
+        assert np.all(cat3.dec == cat.dec[mask]) and cat3 == cat[mask]
+        assert BaseCatalog(fn,rows=slice(10,20)) == cat[10:20]
+        dirname = os.path.join(tmp_dir,'tmp.npy')
+        cat2.write_npy_dir(dirname)
+        cat3 = BaseCatalog.read_npy_dir(dirname)
+        assert cat3 == cat2 and isinstance(cat3.ra,np.memmap)
+        assert BaseCatalog.read_npy_dir(dirname,columns=['ra']).fields == ['ra']
+        cat3 = cat.copy()
+        cat3.ra = np.linspace(0.,20.,cat3.size)
+        cat3.brickname = np.array(['%04dp010' % (ra*10) for ra in cat3.ra])
+        cat3.fileid = np.arange(cat3.size) % 2
+        for partition_by in ['brick','healpix','simid']:
+            dirname = os.path.join(tmp_dir,'tmp_%s' % partition_by)
+            cat3.write_partitions(dirname,partition_by=partition_by,nside=16,nthreads=2)
+            index = BaseCatalog.read_partition_index(dirname)
+            assert sum(part['size'] for part in index['parts']) == cat3.size
+            assert BaseCatalog.read_partitions(dirname).size == cat3.size
+            cat4 = BaseCatalog.read_partitions(dirname,radecbox=[0.,5.,-90.,90.],columns=['ra','fileid'],where='fileid == 1')
+            assert cat4.fields == ['ra','fileid'] and np.all(np.sort(cat4.ra) == cat3.ra[(cat3.ra <= 5.) & (cat3.fileid == 1)])
+        assert np.all(BaseCatalog.read_partitions(os.path.join(tmp_dir,'tmp_brick'),partitions=['000','001']).ra < 2.)
+        assert np.all(BaseCatalog.read_partitions(os.path.join(tmp_dir,'tmp_simid'),partitions='file1_rs0_skip0').fileid == 1)
     assert cat2 == cat
     cat2 = 0
     cat2 += cat + 0
@@ -105,6 +130,50 @@ def test_base():
     assert cat2.isin(cat4).all()
     assert np.all(np.flatnonzero(cat2.isin(cat3)) == [0,1])
     assert cat2.isin(cat3,fields='id').all()
+    cat3 = cat2.copy()
+    cat3.id = cat3.id.astype('U8')
+    assert cat3.isin(cat2).all()
+    cat6 = cat2.copy()
+    cat6.id = np.array(['a'*(i % 3 + 1) for i in range(cat2.size)],dtype=object)
+    cat7 = cat6[:2].copy()
+    cat7.id = np.array(['b'*5]*2,dtype=object)
+    assert not cat6.isin(cat7).any() and cat6[:2].isin(cat6).all()
+    assert np.all(cat2.mask_where('ra == 0.') == (cat2.ra == 0.))
+    cat3 = cat2.copy()
+    cat3.flag = cat3.id == cat3.id[0]
+    assert np.all(cat3.mask_where('~flag') == ~cat3.flag)
+    assert np.all(cat3.mask_where(['flag','ra >= 0.',lambda cat: cat.dec >= 0.]) == (cat3.flag & (cat3.ra >= 0.) & (cat3.dec >= 0.)))
+    with pytest.raises(ValueError):
+        cat3.mask_where('ra == dec')
+    ra = cat2.ra.copy()
+    view = cat2.view(slice(1,3))
+    assert view == cat2[1:3]
+    view.ra[:] = -1.
+    assert np.all(cat2.ra[1:3] == -1.)
+    view.dec = view.zeros()
+    assert np.all(cat2.dec[1:3] != 0.) and view.fields == cat2.fields
+    view = cat2.view(cat2.ra == -1.)
+    assert view == cat2[cat2.ra == -1.]
+    view.ra[:] = 1.
+    assert np.all(cat2.ra[1:3] == -1.)
+    view = cat2.view(1)
+    assert view.size == 1 and view.ra.shape == (1,) and view == cat2.view([1])
+    cat2.ra[:] = ra
+    for irow,row in enumerate(cat4.iter_rows(fields=['ra','id'])):
+        assert row.ra == cat4.ra[irow] and row.get('id') == cat4.id[irow]
+        with pytest.raises(AttributeError):
+            row.dec
+    assert irow == cat4.size - 1
+    cat3 = cat4.copy()
+    cat3.flag = cat3.trues()
+    cat3.id = cat3.id.astype('U8')
+    cat5 = BaseCatalog.concatenate([cat4,0,cat3,cat4])
+    assert cat5.fields == cat4.fields + ['flag'] and cat5.size == 3*cat4.size
+    assert cat5.id.dtype == cat3.id.dtype and np.all(cat5.flag == [False]*cat4.size + [True]*cat4.size + [False]*cat4.size)
+    builder = CatalogBuilder()
+    for cat in [cat4,cat3,cat4]: builder += cat
+    assert len(builder) == cat5.size and builder.finalize() == cat5
+    assert type(SimCatalog.concatenate([cat4])) is SimCatalog
     cat3 = cat4.tile(4,copy=True)
     assert np.all(cat3.ra == np.concatenate([cat4.ra]*4))
     cat3.tile(2,copy=False)
@@ -220,6 +289,17 @@ def test_stages():
     l2 = ListStages([s1,s])
     i1,i2 = l2.match(l3)
     assert i1 == [1,-1] and i2 == [-1,0]
+    assert hash(Versions('b:v1:2,a:v1')) == hash(v1)
+    assert hash(Stages('outliers:a:v1,b:v1:2 fitblobs:c:v3')) == hash(s1)
+    assert len({s1,s2,s}) == 2
+    with pytest.raises(TypeError):
+        s1['tims'] = Versions()
+    l4 = pickle.loads(pickle.dumps(l1))
+    assert l4 == l1 and l4.index(s1) == 1 and l4.index({'writecat':{}}) == 0
+    l4.insert(0,s3)
+    assert l4.index(s) == 1 and l4.append(s3) == 0
+    l4.clear()
+    assert len(l4) == 0 and s not in l4 and l4.append(s1) == 0
 
 
 def test_run():
@@ -281,6 +361,11 @@ def test_run():
         assert runcat3.get_list_stages() == ListStages([Stages()])
         runcat4 = RunCatalog.from_catalog(runcat3,stages='fitblobs')
         assert runcat4.get_list_stages() == ListStages([Stages('fitblobs')])
+        cat = BaseCatalog.concatenate([runcat3,runcat3,runcat3[:1]])
+        cat.stagesid = np.array(['fitblobs']*runcat3.size + ['writecat:a:v1']*runcat3.size + ['tims'],dtype='U16')
+        runcat4 = RunCatalog.from_catalog(cat)
+        assert runcat4.size == runcat3.size and np.all(runcat4.stagesid == [0] + [1]*(runcat3.size - 1))
+        assert runcat4.get_list_stages() == ListStages([Stages('tims fitblobs writecat:a:v1'),Stages('fitblobs writecat:a:v1')])
         runcat3 = RunCatalog.from_catalog(runcat2,list_stages=runcat2.get_list_stages())
         assert runcat3 == runcat2
         runcat3.stagesid[runcat1.size:] = istages = runcat3.append_stages('outliers:a:v1 writecat:a:v2')
@@ -296,6 +381,10 @@ def test_run():
         runcat2.write_list(fn4)
         runcat3 = RunCatalog(fn3)
         runcat4 = RunCatalog.from_list(fn4)
+        dirname = os.path.join(tmp_dir,'run_list.npy')
+        runcat2.write_npy_dir(dirname)
+        runcat5 = RunCatalog.read_npy_dir(dirname)
+        assert runcat5 == runcat2 and runcat5.get_list_stages() == runcat2.get_list_stages()
         assert runcat3 == runcat2
         assert runcat4 == runcat2
         assert runcat3.get_list_stages() == runcat4.get_list_stages()
@@ -307,6 +396,24 @@ def test_run():
         runcat4 = runcat1.copy()
         runcat4.append(runcat3)
         assert runcat4 == runcat3
+        runcat5 = RunCatalog.concatenate([runcat1,runcat3])
+        assert runcat5 == runcat4 and runcat5.get_list_stages() == runcat4.get_list_stages()
+        assert RunCatalog.from_list([fn4,fn4]) == runcat2
+        fn5 = os.path.join(tmp_dir,'run_list.npz')
+        runcat2.write_list(fn5)
+        runcat5 = RunCatalog.from_list(fn5)
+        assert runcat5 == runcat2 and runcat5.get_list_stages() == runcat2.get_list_stages()
+        assert RunCatalog.from_list([fn4,fn5]) == runcat2
+        fn5 = os.path.join(tmp_dir,'run_list_bad.txt')
+        with open(fn5,'w') as file:
+            file.write('#stages0 = writecat\n0001p000 file0_rs0 stages0\n')
+        with pytest.raises(ValueError):
+            RunCatalog.from_list(fn5)
+        with open(fn4,'r') as file:
+            text = file.read()
+        with open(fn5,'w',newline='') as file:
+            file.write(text.replace('\n','\r\n'))
+        assert RunCatalog.from_list(fn5) == runcat2
         runcat3.stagesid[:runcat1.size] = runcat3.append_stages('outliers:a:v1 writecat:b:v2')
         runcat3.append(runcat4)
         assert runcat3.size == 3*runcat1.size
@@ -5,7 +5,7 @@ import numpy as np
 import galsim
 
 from legacysim import setup_logging
-from legacysim.survey import (find_file, find_legacypipe_file, find_legacysim_file, get_git_version, get_version, get_sim_id,
+from legacysim.survey import (find_file, find_files, get_file_template, find_legacypipe_file, find_legacysim_file, get_git_version, get_version, get_sim_id,
                             get_survey, DecamSim, NinetyPrimeMosaicSim, CosmosSim, LegacySurveySim)
 from legacysim.image import GSImage
 
@@ -34,6 +34,13 @@ def test_paths():
     assert os.path.normpath(fn) == os.path.normpath('file1_rs2_skip3/logs/259/log-2599p187.log')
     fn = find_file(base_dir='.',filetype='ps',brickname='2599p187',source='legacysim',fileid=1,rowstart=2,skipid=3)
     assert os.path.normpath(fn) == os.path.normpath('file1_rs2_skip3/metrics/259/ps-2599p187.fits')
+    template = get_file_template(base_dir='tests',filetype='injected',source='legacysim')
+    assert template.format(brickname='2599p187',brickpre='259',fileid=1,rowstart=2,skipid=3) == fn2
+    bricknames,kwargs_simids = ['2599p187','0001m002'],[{'fileid':1,'rowstart':2,'skipid':3},{'fileid':4}]
+    for source in ['legacysim','legacypipe']:
+        fns = find_files(base_dir='tests',filetype='tractor',bricknames=bricknames,kwargs_simids=kwargs_simids,source=source)
+        assert fns == [find_file(base_dir='tests',filetype='tractor',brickname=brickname,source=source,**kwargs_simid)
+                        for brickname,kwargs_simid in zip(bricknames,kwargs_simids)]
 
 
 def test_versions():
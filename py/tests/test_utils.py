@@ -1,13 +1,16 @@
 import os
+import glob
 import tempfile
 import logging
 import argparse
+import pickle
 
 import numpy as np
+import fitsio
 
 from legacysim import setup_logging
-from legacysim.utils import (saveplot, MonkeyPatching, get_parser_args, list_parser_dest, get_parser_action_by_dest,
-                            match_id, sample_ra_dec, match_radec, mask_collisions, get_radecbox_area,
+from legacysim.utils import (saveplot, MonkeyPatching, get_file_stat, read_files, check_fits_file, check_pickle_file, scan_files, get_parser_args, list_parser_dest, get_parser_action_by_dest,
+                            match_id, pack_columns, unique_rows, sample_ra_dec, match_radec, select_nearest, mask_collisions, get_radecbox_area, radec_to_healpix,
                             get_shape_e1_e2, get_shape_ba_phi, mag2nano, nano2mag, get_extinction)
 
 
@@ -91,6 +94,42 @@ def test_misc():
                     break
         assert ok
     """
+    for nthreads,prefetch in [(1,None),(4,None),(4,1)]:
+        assert list(read_files(lambda i: i**2,range(20),nthreads=nthreads,prefetch=prefetch)) == [i**2 for i in range(20)]
+    assert get_file_stat(os.path.join(os.path.dirname(__file__),'nonexistent.fits')) is None
+    assert get_file_stat(__file__)[0] == os.path.getsize(__file__)
+    pattern = os.path.join(os.path.dirname(os.path.abspath(__file__)),'test_*.py')
+    assert scan_files(pattern,nthreads=2) == glob.glob(pattern)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_fn = os.path.join(tmp_dir,'scan.json')
+        for i in range(2):
+            assert scan_files([pattern]*2,cache_fn=cache_fn) == glob.glob(pattern)*2
+        assert list(read_files(abs,range(-4,4),nthreads=2,pool='process')) == list(map(abs,range(-4,4)))
+        fn = os.path.join(tmp_dir,'tmp.pickle')
+        with open(fn,'wb') as file:
+            pickle.dump({'a':np.arange(100000)},file)
+        assert check_pickle_file(fn)
+        with open(fn,'r+b') as file:
+            file.truncate(os.path.getsize(fn)//2)
+        assert not check_pickle_file(fn)
+        fn = os.path.join(tmp_dir,'tmp.fits')
+        fitsio.write(fn,np.zeros(1000,dtype=[('a','f8')]),clobber=True)
+        with fitsio.FITS(fn,'rw') as file:
+            file[1].write_checksum()
+        assert check_fits_file(fn) and check_fits_file(fn,checksum=True)
+        with open(fn,'r+b') as file:
+            file.seek(-4000,os.SEEK_END)
+            file.write(b'\x01')
+        assert check_fits_file(fn) and not check_fits_file(fn,checksum=True)
+        with open(fn,'r+b') as file:
+            file.truncate(os.path.getsize(fn) - 2880)
+        assert not check_fits_file(fn) and not check_fits_file(os.path.join(tmp_dir,'nonexistent.fits'))
+        for size in [2880,3000,4000,5759]: # truncated within table header
+            fitsio.write(fn,np.zeros(1000,dtype=[('a','f8')]),clobber=True)
+            with open(fn,'r+b') as file:
+                file.truncate(size)
+            assert not check_fits_file(fn)
+        assert check_fits_file(fn,ext=0)
     truth = ['--a','1','--b','2']
     args = '--a 1 --b 2'
     assert get_parser_args(args) == truth
@@ -105,6 +144,14 @@ def test_misc():
     assert len(ind1) == len(ind2) and len(ind1) == 3
     assert (id1[ind1] == id2[ind2]).all()
 
+    columns = [np.array([0.,-0.,np.nan,np.nan,1.]),np.array(['a','a','bb','bb','a']),np.array([[0,1],[0,1],[2,3],[2,3],[0,1]])]
+    keys = pack_columns(columns)
+    assert keys.shape[0] == 5
+    index,inverse,counts = unique_rows(keys)
+    assert np.all(index == [0,2,4]) and np.all(inverse == [0,0,1,1,2]) and np.all(counts == [2,2,1])
+    index,inverse,counts = unique_rows(pack_columns(columns[1:2]))
+    assert np.all(index == [0,2]) and np.all(counts == [3,2])
+
 
 def test_radec():
     ramin,ramax,decmin,decmax = 259.9,260.2,18.7,18.8
@@ -115,6 +162,14 @@ def test_radec():
     assert np.all((ra>=ramin) & (ra<=ramax) & (dec>=decmin) & (dec<=decmax))
     ind1,ind2 = match_radec(ra,dec,ra[::-1],dec[::-1])
     assert (ind1 == ind2[::-1]).all()
+    ind1,ind2,distance = match_radec(ra,dec,ra[::-1],dec[::-1],radius_in_degree=0.1,nearest=False,return_distance=True)
+    for radius in [0.01,0.05,0.1]:
+        ind1n,ind2n,distancen = select_nearest(ind1,ind2,distance,radius_in_degree=radius)
+        ind1r,ind2r,distancer = match_radec(ra,dec,ra[::-1],dec[::-1],radius_in_degree=radius,nearest=True,return_distance=True)
+        assert np.all(ind1n == ind1r) and np.all(ind2n == ind2r) and np.allclose(distancen,distancer)
+    ind1n,ind2n = select_nearest(np.concatenate([ind1]*2),np.concatenate([ind2]*2),np.concatenate([distance]*2),
+                                groups=np.repeat([0,1],ind1.size))[:2]
+    assert ind1n.size == 2*np.unique(ind1).size
     mask = mask_collisions(ra,dec,radius_in_degree=1.)
     assert mask[1:].all()
     ra[:] = dec[:] = 0
@@ -129,6 +184,12 @@ def test_radec():
     assert np.allclose(area, decfrac*rafrac)
     ramin, ramax, decmin, decmax = [np.ones(4, dtype='f8')]*4
     assert get_radecbox_area(ramin,ramax,decmin,decmax).shape == (4, )
+    assert radec_to_healpix(0.,0.,1) == 4 and radec_to_healpix(45.,89.,1) == 0 and radec_to_healpix(45.,-89.,1) == 8
+    ra, dec = sample_ra_dec(size=100000,seed=20)
+    pix = radec_to_healpix(ra,dec,16)
+    assert np.all(radec_to_healpix(ra,dec,8) == pix//4)
+    counts = np.bincount(pix,minlength=12*16**2)
+    assert counts.size == 12*16**2 and np.all(np.abs(counts - counts.mean()) < 6.*counts.mean()**0.5)
 
 
 def test_quantities():